@@ -0,0 +1,5 @@
+"""
+Package: benchmarks
+Micro benchmarks for the service. They are not part of the test suite; run
+them one at a time with python -m benchmarks.<name>
+"""
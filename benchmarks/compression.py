@@ -0,0 +1,58 @@
+"""
+Benchmark: response compression
+
+Compresses a serialized list of promotions with every available encoder
+over a range of levels, and reports the CPU time spent against the bytes
+saved.
+
+Usage:
+    python -m benchmarks.compression [ROWS]
+"""
+import json
+import sys
+import time
+
+from service.common.compression import ENCODERS
+from tests.factories import PromotionFactory
+
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 6, 11), "zstd": (1, 3, 9, 19)}
+ROUNDS = 20
+
+
+def payload(rows):
+    """Builds a list response body like GET /api/promotions returns"""
+    promotions = []
+    for i in range(rows):
+        data = PromotionFactory().serialize()
+        data["_id"] = str(i + 1)
+        promotions.append(data)
+    return json.dumps(promotions).encode("utf8")
+
+
+def measure(encoder_class, level, body):
+    """Returns (compressed size, milliseconds per compression)"""
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        encoder = encoder_class(level)
+        size = len(encoder.compress(body) + encoder.finish())
+    return size, (time.process_time() - start) * 1000 / ROUNDS
+
+
+def main():
+    """Runs the benchmark and prints a table of results"""
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    body = payload(rows)
+    print(f"{rows} promotions, {len(body)} bytes uncompressed\n")
+    print(f"{'encoding':<10}{'level':>6}{'bytes':>12}{'ratio':>8}{'ms':>10}{'MB/s':>10}")
+    for name, encoder_class in ENCODERS.items():
+        for level in LEVELS[name]:
+            size, millis = measure(encoder_class, level, body)
+            throughput = len(body) / 1e6 / (millis / 1000) if millis else float("inf")
+            print(
+                f"{name:<10}{level:>6}{size:>12}{len(body) / size:>8.1f}"
+                f"{millis:>10.2f}{throughput:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark: gunicorn worker configurations
+
+Starts gunicorn with gunicorn.conf.py under several worker classes and
+worker counts, drives it with concurrent clients reading and listing
+promotions, and reports the throughput and latency of each configuration.
+The database named by DATABASE_URI must be reachable.
+
+Usage:
+    python -m benchmarks.gunicorn_workers [SECONDS] [CLIENTS]
+"""
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from urllib.error import URLError
+
+PORT = 8099
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+# (label, worker class, workers, threads)
+CONFIGURATIONS = [
+    ("sync 3x1", "sync", 3, 1),
+    ("gthread 1x4", "gthread", 1, 4),
+    ("gthread 2x4", "gthread", 2, 4),
+    ("gevent 1x100", "gevent", 1, 1),
+]
+
+
+def start_server(worker_class, workers, threads):
+    """Starts gunicorn and waits until it answers the health check"""
+    env = dict(
+        os.environ,
+        GUNICORN_BIND=f"127.0.0.1:{PORT}",
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        ADMISSION_ENABLED="false",
+    )
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        ["gunicorn", "--config", "gunicorn.conf.py", "--log-level=warning", "service:app"],
+        env=env,
+    )
+    for _ in range(100):
+        try:
+            with urllib.request.urlopen(f"{BASE_URL}/health", timeout=1):
+                return server
+        except (URLError, ConnectionError):
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f"gunicorn did not start with {worker_class}")
+
+
+def seed(count=200):
+    """Creates promotions to read and returns their ids"""
+    ids = []
+    for i in range(count):
+        body = {
+            "name": f"bench {i}",
+            "description": "benchmark",
+            "products_type": "all",
+            "promotion_code": f"B{i}",
+            "require_code": True,
+            "start_date": "2023-01-01",
+            "end_date": "2030-01-01",
+            "is_active": True,
+        }
+        request = urllib.request.Request(
+            f"{BASE_URL}/api/promotions",
+            data=json.dumps(body).encode("utf8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            ids.append(response.headers["Location"].rsplit("/", 1)[-1])
+    return ids
+
+
+def client(ids, stop, latencies, errors):
+    """Alternates single reads and small lists until told to stop
+
+    A worker recycled by max_requests may drop a connection, which is
+    counted as an error rather than a latency.
+    """
+    i = 0
+    while not stop.is_set():
+        if i % 4:
+            url = f"{BASE_URL}/api/promotions/{ids[i % len(ids)]}"
+        else:
+            url = f"{BASE_URL}/api/promotions?name=bench {i % len(ids)}".replace(" ", "%20")
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url) as response:
+                response.read()
+            latencies.append(time.perf_counter() - start)
+        except (URLError, ConnectionError):
+            errors.append(url)
+        i += 1
+
+
+def measure(ids, seconds, clients):
+    """Returns (requests per second, p50 ms, p99 ms, errors) for a running server"""
+    stop = threading.Event()
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=client, args=(ids, stop, latencies, errors))
+        for _ in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return (
+        len(latencies) / seconds,
+        quantiles[49] * 1000,
+        quantiles[98] * 1000,
+        len(errors),
+    )
+
+
+def main():
+    """Runs the benchmark and prints a table of results"""
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    print(f"{clients} clients for {seconds:.0f}s per configuration\n")
+    print(f"{'configuration':<16}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    ids = None
+    for label, worker_class, workers, threads in CONFIGURATIONS:
+        if worker_class == "gevent" and not importlib.util.find_spec("gevent"):
+            print(f"{label:<16}{'gevent is not installed':>30}")
+            continue
+        server = start_server(worker_class, workers, threads)
+        try:
+            ids = ids or seed()
+            rate, p50, p99, errors = measure(ids, seconds, clients)
+            print(f"{label:<16}{rate:>10.0f}{p50:>10.1f}{p99:>10.1f}{errors:>8}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
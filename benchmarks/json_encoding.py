@@ -0,0 +1,42 @@
+"""
+Benchmark: JSON providers
+
+Encodes a list response of serialized promotions and decodes a single
+promotion request body with every available JSON provider.
+
+Usage:
+    python -m benchmarks.json_encoding [ROWS]
+"""
+import sys
+import timeit
+
+from service import app
+from service.common.json_provider import PROVIDERS
+from tests.factories import PromotionFactory
+
+ROUNDS = 50
+
+
+def measure(provider, promotions, body):
+    """Returns milliseconds per dumps and response, and microseconds per loads"""
+    dumps = timeit.timeit(lambda: provider.dumps(promotions), number=ROUNDS)
+    response = timeit.timeit(lambda: provider.response(promotions), number=ROUNDS)
+    loads = timeit.timeit(lambda: provider.loads(body), number=ROUNDS * 100)
+    return dumps * 1000 / ROUNDS, response * 1000 / ROUNDS, loads * 1e6 / (ROUNDS * 100)
+
+
+def main():
+    """Runs the benchmark and prints a table of results"""
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    promotions = [PromotionFactory().serialize() for _ in range(rows)]
+    body = PROVIDERS["stdlib"](app).dumps(promotions[0])
+    print(f"{rows} promotions per list response\n")
+    print(f"{'provider':<10}{'list dumps ms':>16}{'response ms':>14}{'loads us':>12}")
+    with app.app_context():
+        for name, provider_class in PROVIDERS.items():
+            dumps, response, loads = measure(provider_class(app), promotions, body)
+            print(f"{name:<10}{dumps:>16.2f}{response:>14.2f}{loads:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark: request validation
+
+Validates the body of a promotion POST the way the service used to, with
+Promotion.deserialize and the checks of create(), with the JSON Schema of
+the flask-restx model, and with the compiled validator, with and without
+building the Promotion. Reports the time per body for a valid body and for
+one with several errors.
+
+Usage:
+    python -m benchmarks.validation [ROUNDS]
+"""
+import sys
+import timeit
+
+from service.models import DataValidationError, Promotion
+from service.routes import create_model, validate_promotion
+from tests.factories import PromotionFactory
+
+
+def deserialize(data):
+    """The previous path: deserialize, then the checks of create()"""
+    promotion = Promotion().deserialize(data)
+    if not promotion.name or not promotion.products_type:
+        raise DataValidationError("missing name or products_type")
+    if Promotion.rule_violations(promotion):
+        raise DataValidationError("rules broken")
+    return promotion
+
+
+def json_schema(data):
+    """What @api.expect(create_model, validate=True) would check"""
+    create_model.validate(data)
+    return Promotion().deserialize(data)
+
+
+def compiled(data):
+    """The compiled validator, then the ORM instance"""
+    return Promotion().apply(validate_promotion(data))
+
+
+def measure(function, data, rounds):
+    """Returns the microseconds per call, errors included"""
+
+    def call():
+        try:
+            function(data)
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    return timeit.timeit(call, number=rounds) * 1e6 / rounds
+
+
+def main():
+    """Runs the benchmark and prints a table of results"""
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    valid = PromotionFactory(require_code=True).serialize()
+    invalid = dict(valid, name="", require_code="yes", end_date="2000-01-01")
+    print(f"{rounds} bodies per path\n")
+    print(f"{'path':<14}{'valid us':>10}{'invalid us':>12}")
+    for name, function in (
+        ("deserialize", deserialize),
+        ("json schema", json_schema),
+        ("compiled", compiled),
+        ("values only", validate_promotion),
+    ):
+        print(
+            f"{name:<14}{measure(function, valid, rounds):>10.2f}"
+            f"{measure(function, invalid, rounds):>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+gunicorn configuration
+
+Sizes the workers from the CPU quota and memory limit of the container
+cgroup instead of the CPU count of the node, which inside Kubernetes is far
+larger than what the pod may use. Every setting can be overridden with a
+GUNICORN_* environment variable.
+
+Usage:
+    gunicorn --config gunicorn.conf.py service:app
+"""
+import math
+import os
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+######################################################################
+# Container limits
+######################################################################
+def _read(path):
+    """Returns the stripped contents of a file, or None if it cannot be read"""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit(root=CGROUP_ROOT):
+    """Returns the CPUs the container may use, from the cgroup CPU quota"""
+    quota, period = None, None
+    cpu_max = _read(f"{root}/cpu.max")  # cgroup v2: "<quota> <period>"
+    if cpu_max:
+        quota, period = cpu_max.split()
+    else:  # cgroup v1
+        quota = _read(f"{root}/cpu/cpu.cfs_quota_us")
+        period = _read(f"{root}/cpu/cpu.cfs_period_us")
+    if quota and period and quota not in ("max", "-1"):
+        return int(quota) / int(period)
+    return float(len(os.sched_getaffinity(0)))
+
+
+def memory_limit_mb(root=CGROUP_ROOT):
+    """Returns the container memory limit in MiB, or None when unlimited"""
+    limit = _read(f"{root}/memory.max") or _read(f"{root}/memory/memory.limit_in_bytes")
+    if not limit or limit == "max" or int(limit) >= 2**60:
+        return None
+    return int(limit) // 2**20
+
+
+def worker_count(worker_type, cpus, memory_mb, worker_mb):
+    """Returns how many workers fit the CPU quota and the memory limit"""
+    if worker_type == "sync":
+        count = 2 * math.ceil(cpus) + 1
+    else:  # threads or an event loop use the CPU within every worker
+        count = math.ceil(cpus)
+    if memory_mb:
+        count = min(count, memory_mb // worker_mb)
+    return max(1, count)
+
+
+def worker_concurrency(worker_type, thread_count, connections):
+    """Returns how many requests one worker serves at once"""
+    if worker_type == "gthread":
+        return thread_count
+    if worker_type == "sync":
+        return 1
+    return connections  # an event loop takes up to worker_connections
+
+
+######################################################################
+# Settings
+######################################################################
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+
+# sync, gthread, or an async class such as gevent or eventlet
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", "0")) or worker_count(
+    worker_class,
+    cpu_limit(),
+    memory_limit_mb(),
+    int(os.getenv("GUNICORN_WORKER_MEMORY_MB", "48")),
+)
+threads = int(os.getenv("GUNICORN_THREADS", "4")) if worker_class == "gthread" else 1
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+
+# The app caps the change streams of a worker below this, so that a few
+# long-lived streams never hold every thread and starve /health
+os.environ.setdefault(
+    "WORKER_CONCURRENCY", str(worker_concurrency(worker_class, threads, worker_connections))
+)
+
+# Recycle workers after a number of requests so memory growth stays bounded
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# Load the app once in the master so the workers share its memory
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+
+######################################################################
+# Server hooks
+######################################################################
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Drops the database connections inherited from the master
+
+    A pooled connection must never be used by two processes. The master's
+    connections are left open for the master, and every worker opens its
+    own on first use.
+    """
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    server.log.info("Worker %s disposed the inherited database pool", worker.pid)
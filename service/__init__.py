@@ -9,7 +9,10 @@ from flask import Flask
 from flask_restx import Api
 
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, compression, json_provider, media_types
+from service.common import admission, notifications, change_stream, invalidation
+from service.common import coalescing, negative_cache, snapshot, profiling, slow_queries
+from service.common import tracing
 
 # Create Flask application
 app = Flask(__name__)
@@ -29,6 +32,12 @@ api = Api(
     prefix="/api",
 )
 
+# Encode and decode JSON with the fastest library available
+json_provider.init_json(app, api)
+
+# Also speak MessagePack to clients that ask for it
+media_types.init_media_types(api)
+
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
 from service import routes, models  # noqa: E402, E261
@@ -39,6 +48,35 @@ from service.common import error_handlers, cli_commands  # noqa: F401, E402
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
 
+# Trace the sampled requests through their handlers, models, SQL and encoding
+tracing.init_tracing(app, api, (models.Promotion, models.ArchivedPromotion, models.PromotionChange))
+
+# Profile the requests that are signed or sampled, from the first hook to the last
+profiling.init_profiling(app, notifications.notifications, "/api/diagnostics/profiles")
+
+# Log the slow SQL statements and the routes that ran them
+slow_queries.init_slow_queries(app)
+
+# Compress large responses for clients that accept it
+compression.init_compression(app)
+
+# Turn away floods of requests before they reach the database
+admission.init_admission(app)
+
+# Announce committed changes to the other workers and to stream subscribers
+notifications.init_notifications(app, models.db.session)
+change_stream.init_change_stream(app, notifications.notifications)
+invalidation.init_invalidation(app)
+
+# Share one query among identical reads in flight at once
+coalescing.init_coalescing(app, invalidation.invalidation_bus, models.db.session)
+
+# Answer lookups of ids and promotion codes that do not exist from memory
+negative_cache.init_negative_cache(app, invalidation.invalidation_bus, models.db.session)
+
+# Serve the active promotions from a snapshot shared by the workers of a node
+snapshot.init_snapshot(app, invalidation.invalidation_bus, models.db.session)
+
 app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
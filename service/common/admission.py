@@ -0,0 +1,126 @@
+"""
+Admission Control
+
+This module protects the workers and the database pool from request
+floods. Every client gets a token bucket that refills at a steady rate, and
+every class of route (writes, lists and single reads) gets a cap on the
+requests it may run at once. Requests over either limit are turned away
+straight away with a 429 or a 503 and a Retry-After header.
+
+Clients are told apart by their address. Behind the ingress that is the
+hop the outermost trusted proxy appended to X-Forwarded-For, since every
+hop to its left came from the client and can be forged.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from service.common.metrics import metrics
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class RateLimiter:
+    """Per-client token buckets, keeping at most max_clients of them"""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> (tokens, last refill)
+        self._lock = threading.Lock()
+
+    def acquire(self, client, now=None):
+        """Takes a token for the client
+
+        Returns 0 when the request is admitted, or else the number of seconds
+        until the client's next token.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)  # forget the idlest client
+        return wait
+
+
+class AdmissionControl:
+    """Rate limits and concurrency caps for the promotion routes"""
+
+    def __init__(self, app, prefix):
+        config = app.config
+        self.prefix = prefix
+        self.retry_after = config["ADMISSION_RETRY_AFTER"]
+        self.limiter = None
+        if config["RATE_LIMIT_PER_SECOND"] > 0:
+            self.limiter = RateLimiter(
+                config["RATE_LIMIT_PER_SECOND"], config["RATE_LIMIT_BURST"]
+            )
+        self.slots = {
+            "write": threading.BoundedSemaphore(config["MAX_CONCURRENT_WRITES"]),
+            "list": threading.BoundedSemaphore(config["MAX_CONCURRENT_LISTS"]),
+            "read": threading.BoundedSemaphore(config["MAX_CONCURRENT_READS"]),
+        }
+
+    def route_class(self):
+        """Returns the class of the current request, or None if it is exempt"""
+        if not request.path.startswith(self.prefix):
+            return None
+        if request.path == f"{self.prefix}/lookup":
+            return "list"  # a read that posts its ids
+        if request.method in WRITE_METHODS:
+            return "write"
+        if request.view_args and "promotion_id" in request.view_args:
+            return "read"
+        return "list"
+
+    def admit(self):
+        """Turns the current request away if it is over any limit"""
+        route_class = self.route_class()
+        if not route_class or not current_app.config["ADMISSION_ENABLED"]:
+            return
+        if self.limiter:
+            wait = self.limiter.acquire(request.remote_addr)
+            if wait:
+                metrics.increment("admission.rejected.rate_limited")
+                raise TooManyRequests(
+                    "Rate limit exceeded, slow down.", retry_after=math.ceil(wait)
+                )
+        if not self.slots[route_class].acquire(blocking=False):
+            metrics.increment(f"admission.rejected.overloaded.{route_class}")
+            raise ServiceUnavailable(
+                f"Too many concurrent {route_class} requests, try again later.",
+                retry_after=self.retry_after,
+            )
+        g.admission_slot = route_class
+
+    def release(self, exc=None):  # pylint: disable=unused-argument
+        """Frees the concurrency slot held by the current request"""
+        route_class = g.pop("admission_slot", None)
+        if route_class:
+            self.slots[route_class].release()
+
+
+def init_admission(app, prefix="/api/promotions"):
+    """Set up admission control for every route under the prefix"""
+    admission = AdmissionControl(app, prefix)
+    if app.config["TRUSTED_PROXIES"]:
+        # take the client address from the hops of the trusted proxies only
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+    app.before_request(admission.admit)
+    app.teardown_request(admission.release)
+    app.extensions["admission"] = admission
+    app.logger.info("Admission control established for %s", prefix)
+    return admission
@@ -0,0 +1,165 @@
+"""
+Change Stream
+
+This module pushes the Promotion change log to Server-Sent Events clients.
+Each worker keeps one buffer of recently rendered events shared by all of
+its subscribers. A notification on commit marks the buffer stale, and the
+first subscriber to wake up reads the new changes once for everybody.
+Subscribers that resume from further back than the buffer read the log
+themselves until they catch up.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from service.common.metrics import metrics
+from service.models import PromotionChange
+
+
+def render(change):
+    """Renders a serialized change as one Server-Sent Event"""
+    return (
+        f"id: {change['cursor']}\n"
+        f"event: {change['operation']}\n"
+        f"data: {json.dumps(change, separators=(',', ':'))}\n\n"
+    ).encode("utf8")
+
+
+class ChangeStream:
+    """Fans the change log out to every subscriber of a worker"""
+
+    def __init__(self, app, buffer_size=1000):
+        self.app = app
+        self.generation = 0
+        self.subscribers = 0
+        self._condition = threading.Condition()
+        self._refresh_lock = threading.Lock()
+        self._events = deque(maxlen=buffer_size)  # (cursor, rendered event)
+        self._floor = None  # the buffer holds every change after this cursor
+        self._cursor = None  # the last change read from the log
+        self._stale = True
+
+    def wake(self, payload=""):  # pylint: disable=unused-argument
+        """Tells the waiting subscribers that new changes were committed"""
+        with self._condition:
+            self._stale = True
+            self.generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """Waits for a change after the generation, False on timeout"""
+        with self._condition:
+            woken = self._condition.wait_for(
+                lambda: self.generation != generation, timeout
+            )
+            if not woken:
+                self._stale = True  # read the log anyway, a notification may be lost
+            return woken
+
+    def latest(self):
+        """Returns the cursor of the last change in the log"""
+        with self.app.app_context():
+            return PromotionChange.latest()
+
+    def events_after(self, cursor):
+        """Returns (cursor, rendered events) for the changes after cursor"""
+        self.refresh()
+        with self._condition:
+            if self._floor is not None and cursor >= self._floor:
+                events = [event for event in self._events if event[0] > cursor]
+                metrics.increment("stream.events.buffered", len(events))
+                return events
+        # too far behind the buffer, so read the log directly
+        with self.app.app_context():
+            changes = PromotionChange.since(cursor, self._events.maxlen)
+            events = [(change.id, render(change.serialize())) for change in changes]
+        metrics.increment("stream.events.replayed", len(events))
+        return events
+
+    def refresh(self):
+        """Reads the new changes into the buffer, once for all subscribers"""
+        with self._refresh_lock:
+            if not self._stale:
+                return
+            self._stale = False
+            with self.app.app_context():
+                if self._cursor is None:
+                    self._cursor = self._floor = PromotionChange.latest()
+                changes = PromotionChange.since(self._cursor, self._events.maxlen)
+                events = [(change.id, render(change.serialize())) for change in changes]
+            metrics.increment("stream.refreshes")
+            with self._condition:
+                for event in events:
+                    if len(self._events) == self._events.maxlen:
+                        self._floor = self._events[0][0]
+                    self._events.append(event)
+                    self._cursor = event[0]
+                if len(events) == self._events.maxlen:
+                    self._stale = True  # there may be more to read
+
+    def subscribe(self, cursor):
+        """Returns the events after cursor as they are committed
+
+        Raises ServiceUnavailable when the worker already serves as many
+        subscribers as it may. The stream ends after STREAM_MAX_SECONDS so
+        the client reconnects with Last-Event-ID and frees the worker thread.
+        """
+        config = self.app.config
+        if self.subscribers >= subscriber_limit(config):
+            metrics.increment("stream.rejected")
+            raise ServiceUnavailable(
+                "Too many change stream subscribers, try again later.",
+                retry_after=max(1, config["STREAM_RETRY_MS"] // 1000),
+            )
+        return self._stream(cursor, config)
+
+    def _stream(self, cursor, config):
+        """Yields the rendered events, and a comment when there are none
+
+        The subscriber is counted while the generator runs, so a client that
+        goes away before the first event is never counted at all.
+        """
+        self._count_subscriber(1)
+        ends = time.monotonic() + config["STREAM_MAX_SECONDS"]
+        try:
+            yield f"retry: {config['STREAM_RETRY_MS']}\n\n".encode("utf8")
+            while time.monotonic() < ends:
+                generation = self.generation
+                events = self.events_after(cursor)
+                for cursor, rendered in events:
+                    yield rendered
+                if not events and not self.wait(
+                    generation, config["STREAM_HEARTBEAT_SECONDS"]
+                ):
+                    yield b": keep-alive\n\n"
+        finally:
+            self._count_subscriber(-1)
+
+    def _count_subscriber(self, amount):
+        """Adds to the number of subscribers and reports it"""
+        with self._condition:
+            self.subscribers += amount
+            metrics.set("stream.subscribers", self.subscribers)
+
+
+def subscriber_limit(config):
+    """Returns how many subscribers a worker may stream to at once
+
+    Every subscriber holds a worker thread, so some are always left for
+    the other requests, health checks among them.
+    """
+    spare = config["WORKER_CONCURRENCY"] - config["STREAM_RESERVED_THREADS"]
+    return max(0, min(config["STREAM_MAX_SUBSCRIBERS"], spare))
+
+
+def init_change_stream(app, notifications):
+    """Set up the change stream of this worker"""
+    stream = ChangeStream(app)
+    notifications.subscribe(PromotionChange.CHANNEL, stream.wake)
+    notifications.on_listen(stream.wake)  # changes may have been missed
+    app.extensions["change_stream"] = stream
+    app.logger.info("Change stream established")
+    return stream
@@ -1,8 +1,22 @@
 """
 Flask CLI Command Extensions
 """
+import io
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import click
+from sqlalchemy import insert, text
+
 from service import app
-from service.models import db
+from service.common.invalidation import EVERYTHING, invalidation_bus
+from service.common.profiling import SIGNATURE_HEADER, sign
+from service.common.seeding import COLUMNS, SeedSpec, chunks, generate_chunk
+from service.models import db, Promotion, PromotionChange
 
 
 ######################################################################
@@ -19,3 +33,168 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to move expired promotions to the archive table
+# Usage:
+#   flask promotions-archive [--days N] [--batch-size N] [--max-batches N]
+######################################################################
+@app.cli.command("promotions-archive")
+@click.option(
+    "--days",
+    type=int,
+    default=None,
+    help="Archive promotions that ended more than this many days ago.",
+)
+@click.option(
+    "--batch-size", type=int, default=None, help="Rows moved per transaction."
+)
+@click.option(
+    "--max-batches", type=int, default=0, help="Stop after this many batches."
+)
+def promotions_archive(days, batch_size, max_batches):
+    """
+    Moves expired promotions out of the live table in bounded batches.
+    They can still be read with ?include_archived=true.
+    """
+    days = app.config["ARCHIVE_AFTER_DAYS"] if days is None else days
+    batch_size = batch_size or app.config["ARCHIVE_BATCH_SIZE"]
+    before = date.today() - timedelta(days=days)
+    archived = 0
+    batches = Promotion.archive_expired(before, batch_size)
+    for batch, count in enumerate(batches, start=1):
+        archived += count
+        click.echo(f"Batch {batch}: archived {count} promotions")
+        if batch == max_batches:
+            break
+    click.echo(f"Archived {archived} promotions that ended before {before.isoformat()}")
+
+
+######################################################################
+# Command to sign a request so that it is profiled
+# Usage:
+#   flask profile-signature METHOD PATH [--minutes N]
+######################################################################
+@app.cli.command("profile-signature")
+@click.argument("method")
+@click.argument("path")
+@click.option(
+    "--minutes", type=int, default=10, help="How long the signature works."
+)
+def profile_signature(method, path, minutes):
+    """
+    Prints the header that has requests for METHOD PATH profiled, or lets
+    them use the /api/diagnostics/profiles endpoints.
+    """
+    secret = app.config["PROFILE_SECRET"]
+    if not secret:
+        raise click.ClickException("PROFILE_SECRET is not set")
+    expires = int(time.time()) + minutes * 60
+    click.echo(f"{SIGNATURE_HEADER}: {sign(secret, method, path, expires)}")
+
+
+######################################################################
+# Command to fill the table with synthetic promotions for scale tests
+# Usage:
+#   flask promotions-seed --count N [--workers N] [--type-skew S] ...
+######################################################################
+def split_products_types(ctx, param, value):  # pylint: disable=unused-argument
+    """Returns the comma separated products types, of which there must be one"""
+    products_types = tuple(filter(None, (name.strip() for name in value.split(","))))
+    if not products_types:
+        raise click.BadParameter("must name at least one products type")
+    return products_types
+
+
+@app.cli.command("promotions-seed")
+@click.option("--count", type=click.IntRange(min=1), required=True, help="Promotions to add.")
+@click.option("--batch-size", type=click.IntRange(min=1), default=10000, help="Rows written per transaction.")
+@click.option("--workers", type=click.IntRange(min=1), default=None, help="Generator processes, one per CPU by default.")
+@click.option("--seed", type=int, default=None, help="Seed for reproducible rows.")
+@click.option(
+    "--products-types",
+    default=",".join(SeedSpec.products_types),
+    callback=split_products_types,
+    help="Products types, most common first.",
+)
+@click.option(
+    "--type-skew", type=click.FloatRange(min=0), default=1.0, help="Zipf exponent of the products types, 0 for uniform."
+)
+@click.option("--code-ratio", type=click.FloatRange(0, 1), default=0.5, help="Fraction that requires a code.")
+@click.option("--active-ratio", type=click.FloatRange(0, 1), default=0.5, help="Fraction that is active.")
+@click.option("--start-from", type=click.DateTime(["%Y-%m-%d"]), default="2008-01-01", help="Earliest start date.")
+@click.option("--start-to", type=click.DateTime(["%Y-%m-%d"]), default=None, help="Latest start date, today by default.")
+@click.option("--max-days", type=click.IntRange(min=0), default=90, help="Longest time from start to end date.")
+def promotions_seed(count, batch_size, workers, seed, **distribution):
+    """
+    Adds synthetic promotions in bulk and reports the rows per second.
+    The rows bypass the change log, which gets a reload marker instead.
+    """
+    spec = SeedSpec(
+        products_types=distribution["products_types"],
+        type_skew=distribution["type_skew"],
+        code_ratio=distribution["code_ratio"],
+        active_ratio=distribution["active_ratio"],
+        start_from=distribution["start_from"].date(),
+        start_to=(distribution["start_to"] or distribution["start_from"].today()).date(),
+        max_days=distribution["max_days"],
+    )
+    workers = workers or os.cpu_count() or 1
+    seed = random_seed() if seed is None else seed
+    use_copy = db.engine.dialect.name == "postgresql" and db.engine.driver == "psycopg2"
+    tasks = [(spec, size, chunk_seed, use_copy) for size, chunk_seed in chunks(count, batch_size, seed)]
+    started = time.perf_counter()
+    for rows in generated(tasks, workers):
+        if use_copy:
+            copy_promotions(rows)
+        else:
+            db.session.execute(insert(Promotion.__table__), rows)
+            db.session.commit()
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text(f"ANALYZE {Promotion.__tablename__}"))
+    PromotionChange.record_reload()
+    invalidation_bus.publish(db.session, [EVERYTHING])
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+    click.echo(
+        f"Seeded {count} promotions in {elapsed:.1f}s: {count / elapsed:,.0f} rows/second "
+        f"(writer={'COPY' if use_copy else 'executemany'}, workers={workers}, seed={seed})"
+    )
+
+
+def random_seed():
+    """Returns a seed to report, so that a run can be repeated"""
+    return int.from_bytes(os.urandom(4), "big")
+
+
+def generated(tasks, workers):
+    """Yields the generated chunks in order, a few at a time from a pool"""
+    if workers == 1:
+        yield from map(generate_chunk, tasks)
+        return
+    # fork, so the workers do not import the service again
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(generate_chunk, task))
+            if len(pending) >= 2 * workers:  # bounds the rows held in memory
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def copy_promotions(rows):
+    """Writes rows in CSV to the promotion table with COPY in one transaction"""
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {Promotion.__tablename__} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                io.StringIO(rows),
+            )
+        connection.commit()
+    finally:
+        connection.close()
@@ -0,0 +1,127 @@
+"""
+Request Coalescing
+
+This module lets identical reads that arrive together share one trip to
+the database. The first request for a key runs the query, and every
+request for the same key that arrives while it runs waits for that result
+instead of running the query again. A follower that waits too long, or
+past its own deadline, gives up and runs the query itself.
+
+A write forgets the reads in flight that depend on the keys it touches,
+so a request that arrives after a commit never joins a read that began
+before it. A read tagged with the keys it depends on, such as ("id", 5),
+is forgotten only by writes to those keys; an untagged read by any write.
+"""
+import threading
+
+from sqlalchemy import event
+
+from service.common.deadlines import remaining_milliseconds
+from service.common.invalidation import EVERYTHING, PUBLISHED
+from service.common.metrics import metrics
+
+
+class Flight:  # pylint: disable=too-few-public-methods
+    """One call in progress and the result its followers wait for"""
+
+    def __init__(self, tags=None):
+        self.tags = tags  # the keys the call depends on, None for any
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its result"""
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, timeout, tags=None):
+        """Returns function(), or the result of the same call in flight
+
+        Followers wait at most timeout seconds for the leader before they
+        call function themselves. An error of the leader is raised in its
+        followers too. Pass the keys the call depends on as tags, so only
+        writes to them forget it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight(frozenset(tags) if tags else None)
+        if leader:
+            return self._lead(key, flight, function)
+        metrics.increment(f"coalesce.{self.name}.waits")
+        if not flight.done.wait(timeout):
+            metrics.increment(f"coalesce.{self.name}.timeouts")
+            return function()
+        metrics.increment(f"coalesce.{self.name}.coalesced")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _lead(self, key, flight, function):
+        """Calls function for every follower of the flight"""
+        try:
+            metrics.increment(f"coalesce.{self.name}.calls")
+            flight.result = function()
+            return flight.result
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def evict(self, keys):
+        """Forgets the calls in flight that depend on the keys, so later
+        requests start new ones"""
+        keys = set(keys)
+        if not keys:
+            return 0
+        with self._lock:
+            forgotten = [
+                key for key, flight in self._flights.items()
+                if EVERYTHING in keys or flight.tags is None or not keys.isdisjoint(flight.tags)
+            ]
+            for key in forgotten:
+                del self._flights[key]
+        return len(forgotten)
+
+    def after_commit(self, session):
+        """Forgets the calls in flight on the keys this worker just wrote"""
+        self.evict(session.info.pop(PUBLISHED, ()))
+
+    def after_rollback(self, session):
+        """Forgets the keys of a transaction that rolled back"""
+        session.info.pop(PUBLISHED, None)
+
+    def __len__(self):
+        return len(self._flights)
+
+
+# The coalesced reads of the whole worker
+reads = SingleFlight("reads")
+
+
+def wait_timeout(app):
+    """Returns how long a follower may wait, within the request deadline"""
+    timeout = app.config["COALESCE_TIMEOUT_MS"]
+    milliseconds = remaining_milliseconds()
+    if milliseconds is not None:
+        timeout = min(timeout, milliseconds)
+    return max(0, timeout) / 1000
+
+
+def init_coalescing(app, bus, session):
+    """Forget the reads in flight whenever promotions change"""
+    bus.register(reads)
+    event.listen(session, "after_commit", reads.after_commit)
+    event.listen(session, "after_rollback", reads.after_rollback)
+    app.logger.info("Request coalescing established")
+    return reads
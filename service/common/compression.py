@@ -0,0 +1,157 @@
+"""
+Response Compression
+
+This module negotiates a Content-Encoding with the client and compresses
+responses that are large enough to benefit from it. gzip is always
+available; brotli and zstd are used when their libraries are installed.
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Media types worth compressing (images and the like are already compressed)
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/msgpack",
+    "application/x-msgpack",
+    "text/css",
+    "text/event-stream",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+
+######################################################################
+# Streaming encoders with a common compress / flush / finish interface
+######################################################################
+class GzipEncoder:
+    """Streaming gzip encoder"""
+
+    def __init__(self, level=6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """Compresses a chunk of data"""
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Emits everything compressed so far without ending the stream"""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """Ends the stream"""
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    """Streaming brotli encoder"""
+
+    def __init__(self, level=4):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        """Compresses a chunk of data"""
+        return self._compressor.process(data)
+
+    def flush(self):
+        """Emits everything compressed so far without ending the stream"""
+        return self._compressor.flush()
+
+    def finish(self):
+        """Ends the stream"""
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    """Streaming zstd encoder"""
+
+    def __init__(self, level=3):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        """Compresses a chunk of data"""
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Emits everything compressed so far without ending the stream"""
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        """Ends the stream"""
+        return self._compressor.flush()
+
+
+# Content-Encoding tokens mapped to the encoders that can produce them
+ENCODERS = {"gzip": GzipEncoder}
+if brotli:
+    ENCODERS["br"] = BrotliEncoder
+if zstandard:
+    ENCODERS["zstd"] = ZstdEncoder
+
+
+######################################################################
+# Response hook
+######################################################################
+def init_compression(app):
+    """Set up response compression from the app configuration"""
+    encodings = [
+        name.strip()
+        for name in app.config["COMPRESS_ALGORITHMS"].split(",")
+        if name.strip() in ENCODERS
+    ]
+    min_size = app.config["COMPRESS_MIN_SIZE"]
+
+    @app.after_request
+    def compress_response(response):  # pylint: disable=unused-variable
+        """Compresses the response with the best encoding the client accepts"""
+        if not is_compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        if not response.is_streamed and response.content_length < min_size:
+            return response
+        encoding = request.accept_encodings.best_match(encodings)
+        if not encoding:
+            return response
+
+        encoder = ENCODERS[encoding]()
+        if response.is_streamed:
+            response.response = compress_stream(encoder, response.iter_encoded())
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(encoder.compress(response.get_data()) + encoder.finish())
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    app.logger.info("Response compression established: %s", encodings)
+
+
+def is_compressible(response):
+    """Returns True if the response is a candidate for compression"""
+    return (
+        response.status_code >= 200
+        and response.status_code not in (204, 206, 304)
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSIBLE_TYPES
+        and "no-transform" not in response.headers.get("Cache-Control", "")
+    )
+
+
+def compress_stream(encoder, chunks):
+    """Compresses a streamed body, flushing after every chunk"""
+    for chunk in chunks:
+        data = encoder.compress(chunk) + encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
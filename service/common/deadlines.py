@@ -0,0 +1,82 @@
+"""
+Request Deadlines
+
+This module bounds how long a request may hold a worker. Each route
+declares which configured deadline applies to it. The time left before the
+deadline becomes the Postgres statement_timeout of every transaction the
+request opens, so a slow query is cancelled by the server. The request is
+then rolled back and answered with a 503.
+"""
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from werkzeug.exceptions import ServiceUnavailable
+
+from service.common.metrics import metrics
+from service.models import db
+
+QUERY_CANCELED = "57014"  # Postgres SQLSTATE for a cancelled statement
+
+
+class DeadlineExceeded(ServiceUnavailable):
+    """Used when a request runs past its deadline"""
+
+    description = "The request took too long and was cancelled."
+
+
+def deadline(config_key):
+    """Applies the deadline configured under config_key to a route"""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            milliseconds = current_app.config[config_key]
+            if not milliseconds:
+                return function(*args, **kwargs)
+            g.deadline = time.monotonic() + milliseconds / 1000
+            try:
+                return function(*args, **kwargs)
+            except (OperationalError, DeadlineExceeded) as error:
+                if not is_timeout(error):
+                    raise
+                db.session.rollback()
+                metrics.increment(f"deadline.exceeded.{request.endpoint}")
+                current_app.logger.warning("Deadline exceeded on %s", request.path)
+                raise DeadlineExceeded() from error
+            finally:
+                g.pop("deadline", None)
+
+        return wrapper
+
+    return decorator
+
+
+def is_timeout(error):
+    """Returns True if the error means the deadline has passed"""
+    if isinstance(error, OperationalError):
+        return getattr(error.orig, "pgcode", None) == QUERY_CANCELED
+    return True
+
+
+def remaining_milliseconds():
+    """Returns the time left before the deadline, or None without one"""
+    if not has_app_context() or "deadline" not in g:
+        return None
+    return (g.deadline - time.monotonic()) * 1000
+
+
+@event.listens_for(db.session, "after_begin")
+def apply_statement_timeout(session, transaction, connection):  # pylint: disable=unused-argument
+    """Bounds every statement of a new transaction by the request deadline"""
+    milliseconds = remaining_milliseconds()
+    if milliseconds is None:
+        return
+    if milliseconds <= 0:
+        raise DeadlineExceeded()
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(
+            f"SET LOCAL statement_timeout = {max(1, int(milliseconds))}"
+        )
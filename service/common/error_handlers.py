@@ -18,8 +18,9 @@
 Module: error_handlers
 """
 from flask import jsonify
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
 from service.models import DataValidationError
-from service import app
+from service import app, api
 from . import status
 
 
@@ -32,6 +33,20 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@api.errorhandler(DataValidationError)
+def api_validation_error(error):
+    """Handles Value Errors from bad data on the API routes
+
+    Errors from the validator also list the problem of every field.
+    """
+    message = str(error)
+    app.logger.warning(message)
+    body = {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": message}
+    if getattr(error, "errors", None):
+        body["errors"] = error.errors
+    return body, status.HTTP_400_BAD_REQUEST
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
@@ -101,6 +116,19 @@ def mediatype_not_supported(error):
     )
 
 
+@api.errorhandler(TooManyRequests)
+def too_many_requests(error):
+    """Handles rate limited requests with HTTP_429_TOO_MANY_REQUESTS
+
+    The API handles the HTTP errors of its own routes, so this is where
+    the Retry-After header is kept.
+    """
+    message = error.description
+    app.logger.warning(message)
+    body = {"status": status.HTTP_429_TOO_MANY_REQUESTS, "error": "Too Many Requests", "message": message}
+    return body, status.HTTP_429_TOO_MANY_REQUESTS, retry_after_header(error)
+
+
 @app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
@@ -114,3 +142,20 @@ def internal_server_error(error):
         ),
         status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
+
+
+@api.errorhandler(ServiceUnavailable)
+def service_unavailable(error):
+    """Handles overloaded services with HTTP_503_SERVICE_UNAVAILABLE"""
+    message = error.description
+    app.logger.warning(message)
+    body = {"status": status.HTTP_503_SERVICE_UNAVAILABLE, "error": "Service Unavailable", "message": message}
+    return body, status.HTTP_503_SERVICE_UNAVAILABLE, retry_after_header(error)
+
+
+def retry_after_header(error):
+    """Returns the Retry-After header carried by the error, if any"""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is None:
+        return {}
+    return {"Retry-After": str(retry_after)}
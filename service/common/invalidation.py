@@ -0,0 +1,76 @@
+"""
+Cache Invalidation
+
+This module keeps the in-process caches of every worker consistent. Writes
+to a Promotion publish the keys they touch, such as ("id", 5) or
+("products_type", "Toys"), through the commit notifications. Every worker
+hears them and evicts the matching entries from the caches registered
+here. The delay between the publishing and the eviction is recorded as the
+invalidation lag metric. Whenever the listener (re)connects, keys may have
+been missed in between, so everything is evicted.
+"""
+import json
+import time
+
+from service.common.metrics import metrics
+from service.common.notifications import notifications
+
+CHANNEL = "promotion_invalidations"
+EVERYTHING = ("all", "*")  # evicts every entry of every cache
+PUBLISHED = "invalidation.published"  # session.info key of the keys published
+
+
+class InvalidationBus:
+    """Carries invalidated keys from the writing worker to every worker"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.caches = []
+        transport.subscribe(CHANNEL, self.receive)
+        transport.on_listen(self.resync)
+
+    def register(self, cache):
+        """Calls cache.evict(keys) whenever keys are invalidated"""
+        self.caches.append(cache)
+        return cache
+
+    def publish(self, session, keys):
+        """Invalidates the keys once the session's transaction commits
+
+        The keys are also noted in the session, so the caches of the writing
+        worker can evict them as soon as it commits.
+        """
+        session.info.setdefault(PUBLISHED, set()).update(tuple(key) for key in keys)
+        payload = json.dumps({"at": time.time(), "keys": sorted(keys)})
+        self.transport.publish(session, CHANNEL, payload)
+
+    def receive(self, payload):
+        """Evicts the invalidated keys from every registered cache"""
+        message = json.loads(payload)
+        keys = {tuple(key) for key in message["keys"]}
+        for cache in self.caches:
+            cache.evict(keys)
+        lag = max(0.0, time.time() - message["at"])
+        metrics.observe("invalidation.lag_seconds", lag)
+        metrics.increment("invalidation.received")
+
+    def resync(self):
+        """Evicts everything from every registered cache"""
+        for cache in self.caches:
+            cache.evict({EVERYTHING})
+        metrics.increment("invalidation.resyncs")
+
+
+# The invalidation bus shared by the whole service
+invalidation_bus = InvalidationBus(notifications)
+
+
+def init_invalidation(app):
+    """Start listening for invalidations from the first request
+
+    The first request comes after gunicorn forked the worker, so the
+    listener thread runs in the worker rather than in the master.
+    """
+    app.before_request(notifications.start)
+    app.logger.info("Cache invalidation established")
+    return invalidation_bus
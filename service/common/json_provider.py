@@ -0,0 +1,102 @@
+"""
+JSON Providers
+
+This module selects the JSON library used to encode responses and decode
+requests, for both Flask and flask-restx. orjson is used when it is
+installed, with the standard library json module as the fallback. Both
+write dates in ISO 8601 format, so the wire format does not depend on
+which one is active.
+"""
+import dataclasses
+import decimal
+import uuid
+from datetime import date
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj):
+    """Encodes the types neither JSON library handles natively"""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """JSON provider using the standard library json module"""
+
+    default = staticmethod(_default)
+    sort_keys = False
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider using orjson, which encodes dates natively"""
+
+    default = staticmethod(_default)
+    sort_keys = False
+
+    def _options(self):
+        """Returns the orjson options matching the provider settings"""
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        """Serializes data as a JSON string"""
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserializes data from a JSON string or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Serializes the arguments straight to the bytes of a JSON response"""
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(
+            obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE
+        )
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+PROVIDERS = {"stdlib": StdlibJSONProvider}
+if orjson:
+    PROVIDERS["orjson"] = OrjsonProvider
+
+
+######################################################################
+# Set up the providers
+######################################################################
+def init_json(app, api):
+    """Install the configured JSON provider on the app and the api"""
+    name = app.config["JSON_PROVIDER"]
+    if name == "auto":
+        name = "orjson" if "orjson" in PROVIDERS else "stdlib"
+    if name not in PROVIDERS:
+        app.logger.warning("JSON provider %s is not available, using stdlib", name)
+        name = "stdlib"
+    app.json = PROVIDERS[name](app)
+    api.representations["application/json"] = output_json
+    app.logger.info("JSON provider established: %s", name)
+
+
+def output_json(data, code, headers=None):
+    """Makes a flask-restx response with the app's JSON provider"""
+    resp = current_app.json.response(data)
+    resp.status_code = code
+    resp.headers.extend(headers or {})
+    return resp
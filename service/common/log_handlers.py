@@ -19,8 +19,28 @@ Log Handlers
 
 This module contains utility functions to set up logging
 consistently
+
+With LOG_FORMAT=json every record is written as one JSON object, and the
+writing happens on a listener thread: the request thread only puts the
+record on a bounded queue, and drops it rather than wait when the queue is
+full. Every record carries the id of the request that logged it, and info
+lines of busy loggers can be sampled with LOG_SAMPLE_RATES.
 """
+import json
 import logging
+import os
+import queue
+import random
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+from service.common.metrics import metrics
+
+REQUEST_ID_HEADER = "X-Request-ID"
 
 
 def init_logging(app, logger_name: str):
@@ -30,7 +50,166 @@ def init_logging(app, logger_name: str):
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
+    if app.config["LOG_FORMAT"] == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
     for handler in app.logger.handlers:
         handler.setFormatter(formatter)
+    if app.config["LOG_FORMAT"] == "json":
+        handler = ListenerQueueHandler(app.logger.handlers, app.config["LOG_QUEUE_SIZE"])
+        handler.addFilter(SamplingFilter(parse_sample_rates(app.config["LOG_SAMPLE_RATES"])))
+        app.logger.handlers = [handler]
+    for handler in app.logger.handlers:
+        handler.addFilter(RequestIdFilter())
+    app.before_request(assign_request_id)
+    app.after_request(add_request_id_header)
     app.logger.info("Logging handler established")
+
+
+######################################################################
+# Request ids
+######################################################################
+def assign_request_id():
+    """Takes the request id from the caller, or makes a new one"""
+    given = request.headers.get(REQUEST_ID_HEADER, "")
+    g.request_id = given[:64] if given.isprintable() and given else uuid.uuid4().hex
+
+
+def add_request_id_header(response):
+    """Tells the caller the id its request was logged under"""
+    if "request_id" in g:
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+class RequestIdFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Adds the id of the current request to every record"""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = g.get("request_id") if has_request_context() else None
+        return True
+
+
+######################################################################
+# Sampling
+######################################################################
+def parse_sample_rates(setting):
+    """Returns {logger name: rate} from a setting like flask.app.models=0.1"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in setting.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Keeps only a fraction of the info and debug lines of some loggers
+
+    The rate of the most specific configured logger applies, so
+    "flask.app=0.5" also samples "flask.app.models". Warnings and errors
+    are always kept.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._rates = {}  # logger name -> rate, resolved once per name
+
+    def rate(self, name):
+        """Returns the fraction of the lines of a logger to keep"""
+        if name not in self._rates:
+            rate, candidate = 1.0, name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._rates[name] = rate
+        return self._rates[name]
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not self.rates:
+            return True
+        if random.random() < self.rate(record.name):
+            return True
+        metrics.increment("logging.sampled_out")
+        return False
+
+
+######################################################################
+# Structured records off the request thread
+######################################################################
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ListenerQueueHandler(QueueHandler):
+    """Queues records for a listener thread that writes them to handlers
+
+    The listener is started in each process on its first record, so a
+    gunicorn worker forked from a preloaded master gets its own.
+    """
+
+    def __init__(self, handlers, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.handlers = list(handlers)
+        self.maxsize = maxsize
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        """Renders only the message on the request thread, so that mutable
+        arguments are captured, and leaves the formatting to the listener"""
+        record = logging.makeLogRecord(record.__dict__)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        """Queues a record without waiting, dropping it when the queue is full"""
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("logging.dropped")
+
+    def start(self):
+        """Starts the listener of this process"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.queue = queue.Queue(self.maxsize)  # the parent's may be mid-use
+            self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+
+    def close(self):
+        """Writes out the queued records before closing"""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        super().close()
@@ -0,0 +1,50 @@
+"""
+Media Types
+
+This module lets the API speak MessagePack as well as JSON. Responses are
+negotiated through the Accept header, and request bodies are decoded
+according to their Content-Type. JSON stays the default for both.
+"""
+from datetime import date
+
+from flask import make_response, request
+from werkzeug.exceptions import BadRequest
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def init_media_types(api):
+    """Register the MessagePack representation on the api"""
+    if not msgpack:  # pragma: no cover
+        return
+    for mediatype in MSGPACK_TYPES:
+        api.representations[mediatype] = output_msgpack
+
+
+def _default(obj):
+    """Encodes the types MessagePack does not handle natively"""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def output_msgpack(data, code, headers=None):
+    """Makes a flask-restx response with a MessagePack encoded body"""
+    resp = make_response(msgpack.packb(data, default=_default), code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def get_payload():
+    """Returns the decoded request body for either JSON or MessagePack"""
+    if msgpack and request.mimetype in MSGPACK_TYPES:
+        try:
+            return msgpack.unpackb(request.get_data())
+        except ValueError as error:
+            raise BadRequest(f"Failed to decode MessagePack object: {error}") from error
+    return request.get_json()
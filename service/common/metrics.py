@@ -0,0 +1,59 @@
+"""
+Metrics
+
+This module keeps simple in-process counters, gauges and summaries for the
+service. They are per process, so every gunicorn worker reports its own.
+"""
+import threading
+
+
+class Metrics:
+    """A thread-safe registry of named counters, gauges and summaries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def increment(self, name, amount=1):
+        """Adds to a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        """Sets a gauge to its latest value"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        """Records one observation, such as a duration, in a summary"""
+        with self._lock:
+            summary = self._summaries.setdefault(
+                name, {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            summary["count"] += 1
+            summary["total"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def snapshot(self):
+        """Returns a copy of every metric"""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {
+                    name: dict(summary) for name, summary in self._summaries.items()
+                },
+            }
+
+    def reset(self):
+        """Clears every metric"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+
+# The registry shared by the whole service
+metrics = Metrics()
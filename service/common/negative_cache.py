@@ -0,0 +1,265 @@
+"""
+Negative Cache
+
+This module answers lookups for ids and promotion codes that certainly do
+not exist without asking the database. Every worker keeps a Bloom filter
+of the ids and promotion codes in the Promotion table. A value the filter
+has never seen is a definite miss. A value it has seen may still be
+missing, so it goes to the database as before.
+
+The filter is rebuilt from the table every NEGATIVE_CACHE_REBUILD_SECONDS
+on a background thread, which streams the rows into the new filter while
+requests keep using the old one. Between rebuilds the keys of every write
+arrive through the invalidation bus and are added to it. A Bloom filter
+cannot forget a value, so deleted promotions stay in it until the next
+rebuild, which costs a database lookup but never a wrong answer. A worker
+adds the keys of its own writes as soon as they commit. Ids above the
+largest one the worker has seen are always looked up, so a promotion
+another worker has just created is found before its invalidation arrives.
+Invalidations may come late, or be missed while the listener reconnects,
+so before excluding a promotion code the filter catches up with the change
+log, from the cursor it was built at to the latest change.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from sqlalchemy import event
+
+from service.common.invalidation import EVERYTHING
+from service.common.metrics import metrics
+from service.models import Promotion, PromotionChange
+
+COLUMNS = ("id", "promotion_code")  # the lookups answered by the filter
+BATCH_SIZE = 1000  # rows fetched at a time by a rebuild
+CATCH_UP_LIMIT = 100  # the most changes a lookup adds before a rebuild must
+WRITTEN = "negative_cache.written"  # session.info key of the keys flushed
+
+
+class BloomFilter:
+    """A set that may report false positives but never false negatives"""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        """Returns the bits of value, by double hashing one digest"""
+        digest = hashlib.blake2b(value.encode("utf8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        """Adds a value to the set"""
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+    def false_positive_rate(self):
+        """Returns the expected false positive rate at the current count"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class NegativeCache:
+    """Keeps a worker's filter of existing ids and promotion codes"""
+
+    def __init__(self, app):
+        self.app = app
+        self.filter = None
+        self.max_id = 0
+        self.cursor = None  # the last change in the filter, None if unknown
+        self.built_at = None
+        self.rebuilder = None  # the thread of the latest rebuild
+        self._pending = None  # keys written while a rebuild reads the table
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+
+    def excludes(self, column, value):
+        """Returns True if no promotion can have the value in the column"""
+        self.rebuild_if_due()
+        bloom = self.filter
+        if bloom is None:
+            return False
+        if column == "id" and value > self.max_id:
+            return False
+        if column == "promotion_code" and not self.catch_up():
+            return False
+        if f"{column}:{value}" in bloom:
+            return False
+        metrics.increment("negative_cache.hits")
+        return True
+
+    def catch_up(self):
+        """Adds the changes logged since the filter's cursor, and returns
+        False if the filter cannot be trusted until the next rebuild
+
+        A promotion code another worker has just written would otherwise be
+        excluded until its invalidation arrives. Bulk loads and long gaps
+        are left to a rebuild.
+        """
+        cursor = self.cursor
+        if cursor is None:
+            return False
+        if PromotionChange.latest() <= cursor:
+            return True
+        changes = PromotionChange.since(cursor, CATCH_UP_LIMIT + 1)
+        if len(changes) > CATCH_UP_LIMIT or any(
+            change.operation == PromotionChange.RELOAD for change in changes
+        ):
+            with self._lock:
+                self.cursor = None
+                self.built_at = None
+            self.rebuild_if_due()
+            return False
+        keys = [("id", change.promotion_id) for change in changes]
+        keys += [
+            ("promotion_code", change.data["promotion_code"]) for change in changes
+            if change.data and change.data.get("promotion_code") is not None
+        ]
+        self.evict(keys)
+        with self._lock:
+            if self.cursor is not None:
+                self.cursor = max(self.cursor, changes[-1].id)
+        metrics.increment("negative_cache.catch_ups")
+        return True
+
+    def record_false_positive(self, column, value):
+        """Counts a value the filter let through that the database lacked"""
+        if self.filter is not None and not (column == "id" and value > self.max_id):
+            metrics.increment("negative_cache.false_positives")
+
+    def evict(self, keys):
+        """Adds the keys of a write to the filter"""
+        keys = [
+            (column, value) for column, value in keys
+            if column in COLUMNS or (column, value) == EVERYTHING
+        ]
+        with self._lock:
+            if self._pending is not None:
+                self._pending += keys
+            self._add(keys)
+        return 0
+
+    def _add(self, keys):
+        """Adds keys to the filter, holding the lock"""
+        for column, value in keys:
+            if (column, value) == EVERYTHING:
+                self.built_at = None  # rows left in bulk, so rebuild soon
+            elif self.filter is not None:
+                self.filter.add(f"{column}:{value}")
+                if column == "id":
+                    self.max_id = max(self.max_id, int(value))
+        if self.filter is not None:
+            if self.filter.count > self.filter.capacity:
+                self.built_at = None  # too full to stay accurate
+            metrics.set("negative_cache.false_positive_rate", self.filter.false_positive_rate())
+
+    def after_flush(self, session, flush_context):  # pylint: disable=unused-argument
+        """Notes the ids and promotion codes a transaction writes"""
+        written = session.info.setdefault(WRITTEN, set())
+        for instance in (*session.new, *session.dirty):
+            if isinstance(instance, Promotion):
+                written.add(("id", instance.id))
+                if instance.promotion_code is not None:
+                    written.add(("promotion_code", instance.promotion_code))
+
+    def after_commit(self, session):
+        """Adds the keys of this worker's writes as soon as they commit
+
+        Invalidations from Postgres arrive a moment later on the listener
+        thread, and until then a new promotion code would be excluded.
+        """
+        self.evict(session.info.pop(WRITTEN, ()))
+
+    def after_rollback(self, session):
+        """Forgets the keys of a transaction that rolled back"""
+        session.info.pop(WRITTEN, None)
+
+    def rebuild_if_due(self):
+        """Starts a rebuild when the filter is missing or too old
+
+        The rebuild runs on a thread of its own, one at a time, and the
+        old filter answers until it is done.
+        """
+        interval = self.app.config["NEGATIVE_CACHE_REBUILD_SECONDS"]
+        if self.built_at is not None and time.monotonic() - self.built_at < interval:
+            return
+        if not self._rebuild_lock.acquire(blocking=False):
+            return  # another thread is rebuilding, keep using the old filter
+        self.rebuilder = threading.Thread(
+            target=self._rebuild_in_background, name="negative-cache", daemon=True
+        )
+        self.rebuilder.start()
+
+    def _rebuild_in_background(self):
+        """Rebuilds the filter, logging a failure rather than raising it"""
+        try:
+            self.rebuild()
+        except Exception:  # pylint: disable=broad-except
+            self.app.logger.exception("Could not rebuild the negative cache")
+        finally:
+            self._rebuild_lock.release()
+
+    def rebuild(self):
+        """Replaces the filter with one built from the Promotion table
+
+        The rows are streamed in batches straight into the new filter, so
+        the table is never held in memory.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._pending = []
+        try:
+            rows = max_id = 0
+            with self.app.app_context():
+                cursor = PromotionChange.latest()  # read first, so it is never ahead
+                # room to grow by writes until the next rebuild
+                expected = Promotion.estimate_count() or Promotion.count()
+                bloom = BloomFilter(
+                    max(1024, 2 * expected), self.app.config["NEGATIVE_CACHE_ERROR_RATE"]
+                )
+                query = Promotion.query.with_entities(Promotion.id, Promotion.promotion_code)
+                for promotion_id, code in query.yield_per(BATCH_SIZE):
+                    bloom.add(f"id:{promotion_id}")
+                    if code is not None:
+                        bloom.add(f"promotion_code:{code}")
+                    max_id = max(max_id, promotion_id)
+                    rows += 1
+            with self._lock:
+                self.filter = bloom
+                self.max_id = max_id
+                self.cursor = cursor
+                self.built_at = time.monotonic()
+                self._add(self._pending)  # written while the table was read
+        finally:
+            with self._lock:
+                self._pending = None
+        metrics.increment("negative_cache.rebuilds")
+        metrics.observe("negative_cache.rebuild_seconds", time.perf_counter() - start)
+        metrics.set("negative_cache.false_positive_rate", bloom.false_positive_rate())
+        self.app.logger.info("Negative cache rebuilt with %s promotions", rows)
+
+
+def init_negative_cache(app, bus, session):
+    """Set up the negative cache when NEGATIVE_CACHE_ENABLED is set"""
+    cache = NegativeCache(app) if app.config["NEGATIVE_CACHE_ENABLED"] else None
+    if cache:
+        bus.register(cache)
+        event.listen(session, "after_flush", cache.after_flush)
+        event.listen(session, "after_commit", cache.after_commit)
+        event.listen(session, "after_rollback", cache.after_rollback)
+        app.logger.info("Negative cache established")
+    app.extensions["negative_cache"] = cache
+    return cache
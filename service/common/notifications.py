@@ -0,0 +1,185 @@
+"""
+Notifications
+
+This module carries notifications between the workers of the service. A
+notification published inside a transaction is delivered only once the
+transaction commits, and is dropped if it rolls back. On Postgres the
+notifications travel through LISTEN/NOTIFY, so every worker and replica
+attached to the database receives them. Elsewhere an in-process stand-in
+delivers them to the publishing worker only.
+
+Notifications sent while a listener is disconnected are lost, so every
+time it starts listening it tells the handlers registered with on_listen
+that they may have missed some.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, func
+from sqlalchemy import select as sql_select
+
+logger = logging.getLogger("flask.app.notifications")
+
+PENDING = "notifications"  # session.info key of the notifications to send
+
+
+def is_postgres(bind):
+    """Returns True if the engine or connection talks to Postgres"""
+    return bind.dialect.name == "postgresql"
+
+
+class Notifications:
+    """Publishes notifications on commit and dispatches them to handlers"""
+
+    RECONNECT_DELAY = 1.0  # seconds between the attempts to listen again
+
+    def __init__(self):
+        self._handlers = defaultdict(list)
+        self._listen_handlers = []
+        self._lock = threading.Lock()
+        self._listener = None
+        self._pid = None
+        self.app = None
+        self.engine = None
+
+    def subscribe(self, channel, handler):
+        """Calls handler(payload) for every notification on the channel"""
+        with self._lock:
+            self._handlers[channel].append(handler)
+
+    def on_listen(self, handler):
+        """Calls handler() every time the listener starts listening, as
+        notifications sent while it was not may have been missed"""
+        with self._lock:
+            self._listen_handlers.append(handler)
+
+    def publish(self, session, channel, payload=""):
+        """Queues a notification until the session's transaction commits"""
+        pending = session.info.setdefault(PENDING, {})
+        pending[(channel, payload)] = None  # keeps the order, drops repeats
+
+    def dispatch(self, channel, payload):
+        """Hands a notification that arrived to every handler of the channel"""
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                handler(payload)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Notification handler failed on %s", channel)
+
+    ######################################################################
+    # Session hooks
+    ######################################################################
+    def watch(self, session):
+        """Sends the notifications published in the session when it commits"""
+        event.listen(session, "before_commit", self.before_commit)
+        event.listen(session, "after_commit", self.after_commit)
+        event.listen(session, "after_rollback", self.after_rollback)
+
+    def before_commit(self, session):
+        """Sends the queued notifications inside the transaction on Postgres
+
+        Postgres holds a NOTIFY back until the transaction commits, so
+        listeners never hear about changes that were rolled back.
+        """
+        pending = session.info.get(PENDING)
+        if pending and is_postgres(session.get_bind()):
+            session.info.pop(PENDING)
+            session.execute(
+                sql_select(
+                    *[func.pg_notify(channel, payload) for channel, payload in pending]
+                )
+            )
+
+    def after_commit(self, session):
+        """Delivers the queued notifications in process when not on Postgres"""
+        for channel, payload in session.info.pop(PENDING, {}):
+            self.dispatch(channel, payload)
+
+    def after_rollback(self, session):
+        """Forgets the notifications of a transaction that rolled back"""
+        session.info.pop(PENDING, None)
+
+    ######################################################################
+    # Postgres listener
+    ######################################################################
+    @property
+    def listening(self):
+        """Returns True if this process is listening on Postgres"""
+        return self._listener is not None and self._listener.is_alive()
+
+    def start(self):
+        """Starts listening on Postgres once per process
+
+        The listener runs in a daemon thread, so it must be started by a
+        worker after the fork rather than by the preloaded master. It does
+        nothing on other databases, where notifications stay in process.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            with self.app.app_context():
+                self.engine = self.app.extensions["sqlalchemy"].engine
+            if not is_postgres(self.engine):
+                return
+            self._listener = threading.Thread(
+                target=self.listen, name="notifications", daemon=True
+            )
+            self._listener.start()
+
+    def listen(self):
+        """Receives notifications forever, reconnecting after failures"""
+        while self._pid == os.getpid():
+            try:
+                self._receive()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Notification listener lost its connection")
+                time.sleep(self.RECONNECT_DELAY)
+
+    def _listening(self):
+        """Tells the on_listen handlers that notifications may have been missed"""
+        for handler in list(self._listen_handlers):
+            try:
+                handler()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Listen handler failed")
+
+    def _receive(self):
+        """LISTENs to every channel on a connection outside the pool"""
+        connection = self.engine.raw_connection()
+        driver = connection.driver_connection
+        connection.detach()  # a listener keeps its connection for good
+        try:
+            driver.autocommit = True
+            with driver.cursor() as cursor:
+                for channel in list(self._handlers):
+                    cursor.execute(f'LISTEN "{channel}"')
+            logger.info("Listening for notifications on %s", list(self._handlers))
+            self._listening()
+            while self._pid == os.getpid():
+                if select.select([driver], [], [], 5) == ([], [], []):
+                    continue
+                driver.poll()
+                while driver.notifies:
+                    notify = driver.notifies.pop(0)
+                    self.dispatch(notify.channel, notify.payload)
+        finally:
+            driver.close()
+
+
+# The notifications shared by the whole service
+notifications = Notifications()
+
+
+def init_notifications(app, session):
+    """Deliver the notifications published in the session on commit"""
+    notifications.app = app
+    notifications.watch(session)
+    app.logger.info("Notifications established")
+    return notifications
@@ -0,0 +1,199 @@
+"""
+Request Profiling
+
+This module profiles single requests in production. A request is profiled
+when it carries a signature made with PROFILE_SECRET, or when profiling is
+switched on and the request falls in the sampled fraction. Each profile is
+a cProfile dump in PROFILE_DIR, which keeps only the newest
+PROFILE_MAX_FILES of them, and can be opened with pstats or snakeviz.
+Switching sampling on or off is broadcast to every worker through the
+notifications, and the requests for the profiles themselves are never
+profiled.
+
+Without a PROFILE_DIR nothing is installed, so requests pay nothing.
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, g, request
+
+from service.common.metrics import metrics
+
+SIGNATURE_HEADER = "X-Profile-Signature"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_NAME = re.compile(r"^(\d+)-(\d+)-([A-Z]+)-(\w+)\.prof$")
+CHANNEL = "profiling"  # notified when sampling is switched on or off
+
+
+def sign(secret, method, path, expires):
+    """Returns the signature that has a request profiled until expires
+
+    Args:
+        secret (str): the PROFILE_SECRET of the service
+        method (str): the HTTP method of the request
+        path (str): the path of the request, without the query string
+        expires (int): the Unix time the signature stops working
+    """
+    message = f"{method.upper()} {path} {int(expires)}".encode()
+    digest = hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+    return f"{int(expires)}.{digest}"
+
+
+class Profiler:
+    """Profiles the sampled and the signed requests into a directory"""
+
+    def __init__(self, app, bus=None, exempt=None):
+        config = app.config
+        self.bus = bus
+        self.exempt = exempt  # path prefix of the requests never profiled
+        self.directory = config["PROFILE_DIR"]
+        self.max_files = max(1, config["PROFILE_MAX_FILES"])
+        self.secret = config["PROFILE_SECRET"]
+        self.enabled = config["PROFILE_SAMPLE_RATE"] > 0
+        self.sample_rate = config["PROFILE_SAMPLE_RATE"]
+        os.makedirs(self.directory, exist_ok=True)
+        if bus:
+            bus.subscribe(CHANNEL, self.receive)
+
+    def toggle(self, enabled, sample_rate=None):
+        """Switches sampling on or off in this worker"""
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self.enabled = enabled
+
+    def broadcast(self, session, enabled, sample_rate=None):
+        """Switches sampling on or off here now, and in every worker once
+        the session's transaction commits"""
+        self.toggle(enabled, sample_rate)
+        if self.bus:
+            payload = json.dumps({"enabled": enabled, "sample_rate": sample_rate})
+            self.bus.publish(session, CHANNEL, payload)
+
+    def receive(self, payload):
+        """Applies a switch broadcast by any worker"""
+        values = json.loads(payload)
+        self.toggle(values["enabled"], values["sample_rate"])
+
+    def is_signed(self):
+        """Returns True if the current request carries a valid signature"""
+        value = request.headers.get(SIGNATURE_HEADER, "")
+        expires, _, _ = value.partition(".")
+        if not self.secret or not expires.isdigit() or int(expires) < time.time():
+            return False
+        expected = sign(self.secret, request.method, request.path, int(expires))
+        return hmac.compare_digest(value, expected)
+
+    def start(self):
+        """Starts profiling the current request if it is signed or sampled"""
+        if not self.enabled and SIGNATURE_HEADER not in request.headers:
+            return
+        if self.exempt and request.path.startswith(self.exempt):
+            return
+        if not self.is_signed() and not (self.enabled and random.random() < self.sample_rate):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is running on this thread
+            return
+        g.profile = profile
+
+    def finish(self, response):
+        """Saves the profile of the current request and names it in a header"""
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        profile.disable()
+        endpoint = re.sub(r"\W", "_", request.endpoint or "unknown")
+        name = f"{time.time_ns()}-{os.getpid()}-{request.method}-{endpoint}.prof"
+        try:
+            self.save(profile, name)
+        except OSError as error:
+            metrics.increment("profiling.errors")
+            current_app.logger.warning("Cannot save profile %s: %s", name, error)
+            return response
+        metrics.increment("profiling.captured")
+        response.headers[PROFILE_ID_HEADER] = name
+        return response
+
+    def stop(self, exc=None):  # pylint: disable=unused-argument
+        """Stops a profile left running by a request that failed"""
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile.disable()
+
+    def save(self, profile, name):
+        """Writes a profile into the directory, then drops the oldest ones"""
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(handle)
+        try:
+            profile.dump_stats(temporary)
+            os.replace(temporary, os.path.join(self.directory, name))
+        except OSError:
+            os.unlink(temporary)
+            raise
+        for old in self.names()[self.max_files:]:
+            try:
+                os.unlink(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass  # another worker removed it first
+
+    def names(self):
+        """Returns the names of the saved profiles, newest first"""
+        names = [name for name in os.listdir(self.directory) if PROFILE_NAME.match(name)]
+        return sorted(names, key=lambda name: int(name.split("-")[0]), reverse=True)
+
+    def profiles(self):
+        """Returns a description of every saved profile, newest first"""
+        results = []
+        for name in self.names():
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            created, pid, method, endpoint = PROFILE_NAME.match(name).groups()
+            results.append(
+                {
+                    "name": name,
+                    "created": datetime.fromtimestamp(int(created) / 1e9, timezone.utc).isoformat(),
+                    "pid": int(pid),
+                    "method": method,
+                    "endpoint": endpoint,
+                    "size": size,
+                }
+            )
+        return results
+
+    def path(self, name):
+        """Returns the path of a saved profile, or None if there is none"""
+        if not PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.exists(path) else None
+
+
+def init_profiling(app, bus=None, exempt=None):
+    """Set up request profiling if PROFILE_DIR is configured
+
+    Args:
+        bus (Notifications): carries the switches to every worker
+        exempt (str): path prefix of the requests never profiled
+    """
+    if not app.config["PROFILE_DIR"]:
+        app.extensions["profiler"] = None
+        return None
+    profiler = Profiler(app, bus, exempt)
+    app.before_request(profiler.start)
+    app.after_request(profiler.finish)
+    app.teardown_request(profiler.stop)
+    app.extensions["profiler"] = profiler
+    app.logger.info("Request profiling established in %s", profiler.directory)
+    return profiler
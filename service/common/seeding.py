@@ -0,0 +1,118 @@
+"""
+Seeding
+
+This module generates synthetic Promotions for scale testing, like those
+of the test factory but with a controllable distribution: how skewed the
+products types are, what fraction requires a code or is active, and how
+the dates spread. Rows are generated in chunks, each from its own seed, so
+chunks can be generated by parallel processes and still be reproducible.
+"""
+import csv
+import io
+import random
+import string
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+NAMES = (
+    "First time Shopper Discount",
+    "Limited Time Offers",
+    "Buy One, Get One Free",
+    "Clearance Sales",
+    "Member-Only Discounts",
+)
+DESCRIPTIONS = (
+    "Offer a special discount for first-time customers",
+    "Create urgency with time limited promotions",
+    "Introduce buy-one-get-one promotions",
+    "clearance section to clear out excess inventory",
+    "Provide exclusive discounts for members",
+)
+COLUMNS = (
+    "name",
+    "description",
+    "products_type",
+    "promotion_code",
+    "require_code",
+    "start_date",
+    "end_date",
+    "is_active",
+)
+CODE_CHARACTERS = string.ascii_uppercase + string.digits
+
+
+@dataclass(frozen=True)
+class SeedSpec:  # pylint: disable=too-many-instance-attributes
+    """The distribution of the generated Promotions"""
+
+    products_types: tuple = ("all_types", "Electronics", "clothing", "Toys")
+    type_skew: float = 1.0  # Zipf exponent over products_types, 0 for uniform
+    code_ratio: float = 0.5
+    active_ratio: float = 0.5
+    start_from: date = date(2008, 1, 1)
+    start_to: date = date.today()
+    max_days: int = 90
+
+    def type_weights(self):
+        """Returns the weight of every products type, the first the heaviest"""
+        return [1 / rank**self.type_skew for rank in range(1, len(self.products_types) + 1)]
+
+
+def generate(spec, count, seed):
+    """Returns count Promotions as tuples of COLUMNS
+
+    Args:
+        spec (SeedSpec): the distribution of the Promotions
+        count (int): how many to generate
+        seed (int): the seed of the random numbers, for reproducible rows
+    """
+    rng = random.Random(seed)
+    types = rng.choices(spec.products_types, weights=spec.type_weights(), k=count)
+    start_days = max(0, (spec.start_to - spec.start_from).days)
+    rows = []
+    for products_type in types:
+        require_code = rng.random() < spec.code_ratio
+        start_date = spec.start_from + timedelta(days=rng.randint(0, start_days))
+        rows.append(
+            (
+                rng.choice(NAMES),
+                rng.choice(DESCRIPTIONS),
+                products_type,
+                "".join(rng.choices(CODE_CHARACTERS, k=10)) if require_code else None,
+                require_code,
+                start_date,
+                start_date + timedelta(days=rng.randint(0, spec.max_days)),
+                rng.random() < spec.active_ratio,
+            )
+        )
+    return rows
+
+
+def generate_csv(spec, count, seed):
+    """Returns the rows of generate() as CSV for COPY, NULL left empty"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in generate(spec, count, seed):
+        writer.writerow(
+            "" if value is None else ("t" if value else "f") if isinstance(value, bool) else value
+            for value in row
+        )
+    return buffer.getvalue()
+
+
+def generate_chunk(task):
+    """Generates one chunk in a worker process
+
+    Args:
+        task (tuple): (spec, count, seed, as_csv)
+    """
+    spec, count, seed, as_csv = task
+    if as_csv:
+        return generate_csv(spec, count, seed)
+    return [dict(zip(COLUMNS, row)) for row in generate(spec, count, seed)]
+
+
+def chunks(count, batch_size, seed):
+    """Yields (size, seed) of the chunks that make up count rows"""
+    for number, start in enumerate(range(0, count, batch_size)):
+        yield min(batch_size, count - start), seed * 1_000_003 + number
@@ -0,0 +1,250 @@
+"""
+Slow Query Log
+
+This module times every SQL statement the service runs. Statements slower
+than SLOW_QUERY_MS are logged with their normalized text, the shape of their
+parameters (never their values) and the route that ran them, and are added
+up by fingerprint, so the worst offenders by total time can be listed.
+
+A SLOW_QUERY_EXPLAIN_RATE fraction of the slow SELECTs is explained on
+Postgres with EXPLAIN (ANALYZE, BUFFERS). That runs the statement again, on
+another connection and in a background thread, so the request that was
+slow does not wait for it. Only plain reads of the promotion tables are
+run again: SELECTs that lock rows or call functions such as
+pg_advisory_xact_lock() or pg_notify() are never explained.
+"""
+import hashlib
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from service.common.metrics import metrics
+
+logger = logging.getLogger("flask.app.slow_queries")
+
+LOG_OPTION = "slow_query_log"  # execution option that turns the log off
+STARTED = "slow_query_started"  # execution context attribute of the start
+
+# What normalize() replaces, in order
+NORMALIZATIONS = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),  # string literals
+    (re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+"), "?"),  # bind parameters
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b"), "?"),  # numbers
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?, ...)"),  # IN lists
+    (re.compile(r"\s+"), " "),
+)
+
+# What a statement must read, and must not do, to be run again by EXPLAIN ANALYZE
+READS_PROMOTIONS = re.compile(
+    r'\b(?:FROM|JOIN)\s+"?(?:promotion|promotion_change|promotion_archive\w*)\b"?', re.IGNORECASE
+)
+NOT_PLAIN_READS = re.compile(
+    r"\bFOR\s+(?:UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b"  # row locks
+    r"|\b(?:pg_\w+|nextval|setval|set_config)\s*\(",  # functions with side effects
+    re.IGNORECASE,
+)
+
+
+def normalize(statement):
+    """Returns the statement with its values and spacing made uniform"""
+    for pattern, replacement in NORMALIZATIONS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def fingerprint(normalized):
+    """Returns a short stable id of a normalized statement"""
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+
+def parameter_shape(parameters, executemany=False):
+    """Describes the parameters of a statement without their values"""
+    if executemany:
+        rows = list(parameters)
+        shape = parameter_shape(rows[0]) if rows else {"count": 0, "types": []}
+        return dict(shape, rows=len(rows))
+    values = parameters.values() if isinstance(parameters, dict) else parameters or ()
+    return {
+        "count": len(values),
+        "types": sorted({type(value).__name__ for value in values}),
+    }
+
+
+def is_plain_read(normalized):
+    """Returns True if running the statement again only reads promotions"""
+    return (
+        normalized[:6].upper() == "SELECT"
+        and READS_PROMOTIONS.search(normalized) is not None
+        and NOT_PLAIN_READS.search(normalized) is None
+    )
+
+
+def current_route():
+    """Returns the method and endpoint of the request running the statement"""
+    if has_request_context():
+        return f"{request.method} {request.endpoint or request.path}"
+    return "-"
+
+
+class SlowQueryLog:
+    """Times statements and keeps the slow ones by fingerprint"""
+
+    def __init__(self, app):
+        config = app.config
+        self.threshold = config["SLOW_QUERY_MS"] / 1000
+        self.explain_rate = config["SLOW_QUERY_EXPLAIN_RATE"]
+        self.explain_timeout = config["SLOW_QUERY_EXPLAIN_TIMEOUT_MS"]
+        self.max_fingerprints = config["SLOW_QUERY_MAX_FINGERPRINTS"]
+        self.statements = {}  # fingerprint -> aggregate of its slow runs
+        self._lock = threading.Lock()
+        self._explains = queue.Queue(maxsize=16)
+        self._explainer = None
+        self._pid = None
+
+    def attach(self, target=Engine):
+        """Times the statements of an engine, or of every engine"""
+        event.listen(target, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self.after_cursor_execute)
+
+    def detach(self, target=Engine):
+        """Stops timing the statements of the engine"""
+        event.remove(target, "before_cursor_execute", self.before_cursor_execute)
+        event.remove(target, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_cursor_execute(  # pylint: disable=too-many-arguments
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        """Notes when the statement started"""
+        setattr(context, STARTED, time.perf_counter())
+
+    def after_cursor_execute(  # pylint: disable=too-many-arguments
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        """Records the statement if it was slow"""
+        started = getattr(context, STARTED, None)
+        if started is None or not context.execution_options.get(LOG_OPTION, True):
+            return
+        duration = time.perf_counter() - started
+        if duration < self.threshold:
+            return
+        normalized = normalize(statement)
+        key = fingerprint(normalized)
+        shape = parameter_shape(parameters, executemany)
+        route = current_route()
+        milliseconds = duration * 1000
+        logger.warning(
+            "Slow query %s took %.1f ms on %s: %s parameters=%s",
+            key, milliseconds, route, normalized, shape,
+        )
+        metrics.increment("slow_queries.recorded")
+        self.record(key, normalized, shape, route, milliseconds)
+        if self.explain_due(conn, normalized):
+            self.queue_explain(conn.engine, key, statement, parameters)
+
+    def record(self, key, normalized, shape, route, milliseconds):  # pylint: disable=too-many-arguments
+        """Adds one slow run to the aggregate of its fingerprint"""
+        with self._lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                if len(self.statements) >= self.max_fingerprints:
+                    cheapest = min(self.statements, key=lambda k: self.statements[k]["total_ms"])
+                    del self.statements[cheapest]
+                entry = self.statements[key] = {
+                    "fingerprint": key,
+                    "statement": normalized,
+                    "calls": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "routes": {},
+                    "parameters": shape,
+                    "plan": None,
+                }
+            entry["calls"] += 1
+            entry["total_ms"] += milliseconds
+            entry["max_ms"] = max(entry["max_ms"], milliseconds)
+            entry["routes"][route] = entry["routes"].get(route, 0) + 1
+            entry["parameters"] = shape
+
+    def top(self, limit=20):
+        """Returns the slow statements with the most total time first"""
+        with self._lock:
+            entries = [
+                dict(entry, routes=dict(entry["routes"]), mean_ms=entry["total_ms"] / entry["calls"])
+                for entry in self.statements.values()
+            ]
+        return sorted(entries, key=lambda entry: entry["total_ms"], reverse=True)[:limit]
+
+    def reset(self):
+        """Forgets every slow statement"""
+        with self._lock:
+            self.statements.clear()
+
+    ######################################################################
+    # EXPLAIN (ANALYZE, BUFFERS) off the request thread
+    ######################################################################
+    def explain_due(self, conn, normalized):
+        """Returns True if this slow statement should be explained"""
+        return (
+            self.explain_rate > 0
+            and conn.dialect.name == "postgresql"
+            and is_plain_read(normalized)
+            and random.random() < self.explain_rate
+        )
+
+    def queue_explain(self, engine, key, statement, parameters):
+        """Hands a statement to the explaining thread, unless it is busy"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._explains = queue.Queue(maxsize=16)
+            self._explainer = threading.Thread(target=self.run_explains, daemon=True)
+            self._explainer.start()
+        try:
+            self._explains.put_nowait((engine, key, statement, parameters))
+        except queue.Full:
+            metrics.increment("slow_queries.explains_dropped")
+
+    def run_explains(self):
+        """Explains the queued statements one at a time"""
+        explains = self._explains
+        while True:
+            self.explain(*explains.get())
+
+    def explain(self, engine, key, statement, parameters):
+        """Runs EXPLAIN (ANALYZE, BUFFERS) and keeps the plan with the statement"""
+        try:
+            with engine.connect().execution_options(**{LOG_OPTION: False}) as connection:
+                connection.exec_driver_sql(
+                    f"SET LOCAL statement_timeout = {int(self.explain_timeout)}"
+                )
+                rows = connection.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters
+                ).all()
+                connection.rollback()
+            plan = "\n".join(row[0] for row in rows)
+            metrics.increment("slow_queries.explained")
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Cannot explain slow query %s: %s", key, error)
+            plan = f"EXPLAIN failed: {error}"
+        with self._lock:
+            if key in self.statements:
+                self.statements[key]["plan"] = plan
+
+
+def init_slow_queries(app):
+    """Set up the slow query log on every engine, unless SLOW_QUERY_MS <= 0"""
+    if app.config["SLOW_QUERY_MS"] <= 0:
+        app.extensions["slow_queries"] = None
+        return None
+    slow_queries = SlowQueryLog(app)
+    slow_queries.attach()
+    app.extensions["slow_queries"] = slow_queries
+    app.logger.info("Slow query log established over %s ms", app.config["SLOW_QUERY_MS"])
+    return slow_queries
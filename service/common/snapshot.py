@@ -0,0 +1,339 @@
+"""
+Snapshot of Active Promotions
+
+This module keeps the active promotions in one immutable file that every
+worker on the node maps into memory, so they share a single copy through
+the page cache instead of caching their own.
+
+The file is columnar: each column is an array with one fixed-width value
+per promotion, sorted by id, and strings are stored once in a string table
+and referred to by their index. A permutation sorted by products_type makes
+lookups by type a slice. The file also records the change log cursor it was
+built at. When an invalidation arrives, the next reader compares that
+cursor with the log and either maps the newer file another worker wrote, or
+starts rebuilding it on a thread of its own, under a file lock, and renames
+it into place atomically. Readers go to the database until it is done. The
+rebuild streams the rows in batches straight into the columns.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date
+
+from sqlalchemy import event
+
+from service.common.metrics import metrics
+from service.models import Promotion, PromotionChange
+
+MAGIC = b"PSNP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIqII")  # magic, version, pad, rows, cursor, strings, types
+NULL = 0xFFFFFFFF  # string index of a missing value
+REQUIRE_CODE, IS_ACTIVE = 1, 2  # bits of the flags column
+BATCH_SIZE = 1000  # rows read from the database at a time
+
+# the Promotion columns of every row to encode, in order
+FIELDS = (
+    "id",
+    "name",
+    "description",
+    "products_type",
+    "promotion_code",
+    "require_code",
+    "start_date",
+    "end_date",
+    "is_active",
+)
+
+# (name, array typecode) of every column, in file order
+COLUMNS = (
+    ("id", "i"),
+    ("name", "I"),
+    ("description", "I"),
+    ("products_type", "I"),
+    ("promotion_code", "I"),
+    ("start_date", "i"),
+    ("end_date", "i"),
+    ("by_type", "I"),
+)
+
+
+######################################################################
+# Encoding
+######################################################################
+def encode(rows, cursor):
+    """Returns the snapshot file contents for the rows, tuples of the FIELDS
+    sorted by id"""
+    strings = {}
+
+    def intern(value):
+        if value is None:
+            return NULL
+        return strings.setdefault(value, len(strings))
+
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    flags = bytearray()
+    for row in rows:
+        (promotion_id, name, description, products_type, promotion_code,
+         require_code, start_date, end_date, is_active) = row
+        columns["id"].append(promotion_id)
+        columns["name"].append(intern(name))
+        columns["description"].append(intern(description))
+        columns["products_type"].append(intern(products_type))
+        columns["promotion_code"].append(intern(promotion_code))
+        columns["start_date"].append(start_date.toordinal())
+        columns["end_date"].append(end_date.toordinal())
+        flags.append((REQUIRE_CODE if require_code else 0) | (IS_ACTIVE if is_active else 0))
+    count = len(flags)
+
+    # rows grouped by products_type, and where each type's group starts and ends
+    types = columns["products_type"]
+    columns["by_type"].extend(sorted(range(count), key=types.__getitem__))
+    groups = array("I")
+    for row, group in enumerate(columns["by_type"]):
+        if not groups or types[group] != groups[-3]:
+            groups.extend((types[group], row, row))
+        groups[-1] = row + 1
+
+    blobs = [value.encode("utf8") for value in strings]
+    offsets = array("I", [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+
+    sections = [HEADER.pack(MAGIC, VERSION, 0, count, cursor, len(blobs), len(groups) // 3)]
+    sections += [columns[name].tobytes() for name, _ in COLUMNS]
+    sections += [groups.tobytes(), offsets.tobytes(), pad(bytes(flags)), b"".join(blobs)]
+    return b"".join(sections)
+
+
+def pad(data):
+    """Pads data to a multiple of 4 bytes so the next array stays aligned"""
+    return data + b"\0" * (-len(data) % 4)
+
+
+######################################################################
+# Decoding
+######################################################################
+class Snapshot:
+    """A read-only view of the snapshot in a buffer, such as an mmap"""
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        magic, version, _, rows, cursor, strings, types = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a promotion snapshot")
+        self.rows = rows
+        self.cursor = cursor
+        position = HEADER.size
+        self.columns = {}
+        for name, typecode in COLUMNS:
+            self.columns[name], position = section(view, position, typecode, rows)
+        self.groups, position = section(view, position, "I", types * 3)
+        self.offsets, position = section(view, position, "I", strings + 1)
+        self.flags = view[position:position + rows]
+        self.strings = view[position + len(pad(bytes(rows))):]
+
+    def __len__(self):
+        return self.rows
+
+    def string(self, index):
+        """Returns the string at an index of the string table"""
+        if index == NULL:
+            return None
+        return bytes(self.strings[self.offsets[index]:self.offsets[index + 1]]).decode("utf8")
+
+    def row(self, row):
+        """Returns a row serialized like Promotion.serialize()"""
+        columns = self.columns
+        return {
+            "name": self.string(columns["name"][row]),
+            "description": self.string(columns["description"][row]),
+            "products_type": self.string(columns["products_type"][row]),
+            "promotion_code": self.string(columns["promotion_code"][row]),
+            "require_code": bool(self.flags[row] & REQUIRE_CODE),
+            "start_date": date.fromordinal(columns["start_date"][row]).isoformat(),
+            "end_date": date.fromordinal(columns["end_date"][row]).isoformat(),
+            "is_active": bool(self.flags[row] & IS_ACTIVE),
+            "_id": columns["id"][row],
+        }
+
+    def all(self):
+        """Returns every promotion in the snapshot, by id"""
+        return [self.row(row) for row in range(self.rows)]
+
+    def find(self, promotion_id):
+        """Returns the promotion with the id, or None"""
+        ids = self.columns["id"]
+        row = bisect_left(ids, promotion_id)
+        if row < self.rows and ids[row] == promotion_id:
+            return self.row(row)
+        return None
+
+    def find_by_products_type(self, products_type):
+        """Returns the promotions of a products_type, by id"""
+        for group in range(0, len(self.groups), 3):
+            if self.string(self.groups[group]) == products_type:
+                start, end = self.groups[group + 1], self.groups[group + 2]
+                return [self.row(row) for row in self.columns["by_type"][start:end]]
+        return []
+
+
+def section(view, position, typecode, count):
+    """Returns the array of count values at position, and where it ends"""
+    size = array(typecode).itemsize * count
+    return view[position:position + size].cast(typecode), position + size
+
+
+######################################################################
+# Shared file
+######################################################################
+class SnapshotStore:
+    """Keeps a worker's map of the snapshot file in step with the data"""
+
+    def __init__(self, app, path):
+        self.app = app
+        self.path = path
+        self.snapshot = None
+        self.dirty = True
+        self.rebuilder = None
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def evict(self, keys):  # pylint: disable=unused-argument
+        """Marks the snapshot as possibly stale after any write"""
+        self.dirty = True
+        return 0
+
+    def after_commit(self, session):  # pylint: disable=unused-argument
+        """Marks the snapshot stale as soon as this worker commits
+
+        Invalidations from Postgres arrive a moment later on the listener
+        thread, and a client must read its own writes before that.
+        """
+        self.dirty = True
+
+    def current(self):
+        """Returns the up to date snapshot, or None if it is unavailable or
+        still being rebuilt"""
+        if self.dirty:
+            try:
+                self.refresh()
+            except (OSError, ValueError) as error:
+                self.app.logger.warning("Promotion snapshot unavailable: %s", error)
+                self.snapshot = None
+        return self.snapshot
+
+    def refresh(self):
+        """Maps the latest snapshot file, or starts rebuilding it if it is behind"""
+        with self._lock:
+            if not self.dirty:
+                return
+            self.dirty = False  # an invalidation from now on needs another look
+            with self.app.app_context():
+                latest = PromotionChange.latest()
+            snapshot = self.open()
+            if snapshot is None or snapshot.cursor != latest:
+                self.snapshot = None
+                self.rebuild_in_background()
+                return
+            self.snapshot = snapshot
+            metrics.set("snapshot.rows", len(snapshot))
+
+    def rebuild_in_background(self):
+        """Starts rebuilding the file on a thread of its own, one at a time"""
+        if self.rebuilder is not None and self.rebuilder.is_alive():
+            return
+        self.rebuilder = threading.Thread(
+            target=self._rebuild_in_background, name="snapshot", daemon=True
+        )
+        self.rebuilder.start()
+
+    def _rebuild_in_background(self):
+        """Rebuilds the file unless another worker did, then has it mapped"""
+        try:
+            with open(f"{self.path}.lock", "a", encoding="utf8") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # one rebuild per node
+                with self.app.app_context():
+                    latest = PromotionChange.latest()
+                if file_cursor(self.path) != latest:  # another worker may have rebuilt it
+                    self.rebuild()
+            self.dirty = True  # the next reader maps the new file
+        except (OSError, ValueError) as error:
+            self.app.logger.warning("Promotion snapshot unavailable: %s", error)
+        except Exception:  # pylint: disable=broad-except
+            self.app.logger.exception("Could not rebuild the promotion snapshot")
+
+    def open(self):
+        """Maps the snapshot file, reusing the current map if it is unchanged"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        if self.snapshot is not None and stat.st_ino == self._inode:
+            return self.snapshot
+        with open(self.path, "rb") as file:
+            mapped = mmap_file(file)
+        self._inode = stat.st_ino
+        return Snapshot(mapped)
+
+    def rebuild(self):
+        """Writes a new snapshot file and renames it over the old one"""
+        start = time.perf_counter()
+        with self.app.app_context():
+            cursor = PromotionChange.latest()  # read first, so it is never ahead
+            rows = (
+                Promotion.find_by_filters(is_active=True)
+                .with_entities(*[getattr(Promotion, field) for field in FIELDS])
+                .order_by(Promotion.id)
+                .yield_per(BATCH_SIZE)
+            )
+            data = encode(rows, cursor)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+            try:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+                os.replace(file.name, self.path)
+            except OSError:
+                os.unlink(file.name)
+                raise
+        metrics.increment("snapshot.rebuilds")
+        metrics.observe("snapshot.rebuild_seconds", time.perf_counter() - start)
+        _, _, _, rows, *_ = HEADER.unpack_from(data)
+        self.app.logger.info("Promotion snapshot rebuilt with %s rows", rows)
+
+
+def file_cursor(path):
+    """Returns the cursor a snapshot file was built at, or None without one"""
+    try:
+        with open(path, "rb") as file:
+            magic, version, _, _, cursor, _, _ = HEADER.unpack(file.read(HEADER.size))
+    except (FileNotFoundError, struct.error):
+        return None
+    return cursor if magic == MAGIC and version == VERSION else None
+
+
+def mmap_file(file):
+    """Maps a whole file read-only, or returns its bytes when it is empty"""
+    if os.fstat(file.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def init_snapshot(app, bus, session):
+    """Set up the shared snapshot when SNAPSHOT_PATH is configured"""
+    path = app.config["SNAPSHOT_PATH"]
+    store = SnapshotStore(app, path) if path else None
+    if store:
+        bus.register(store)
+        event.listen(session, "after_commit", store.after_commit)
+        app.logger.info("Promotion snapshot established at %s", path)
+    app.extensions["snapshot"] = store
+    return store
@@ -0,0 +1,357 @@
+"""
+Tracing
+
+This module breaks the time of a request down into spans: the request
+itself, its route handler, the model methods it calls, every SQL statement
+and the encoding of its response. A request continues the trace of a W3C
+traceparent header when it has one, and otherwise starts a new trace for a
+TRACE_SAMPLE_RATE fraction of the requests.
+
+Finished spans are queued for a background thread, which appends them in
+batches to TRACE_EXPORT_PATH as OTLP JSON lines, the format the
+OpenTelemetry Collector's otlpjsonfile receiver reads. Untraced requests
+only pay for a context variable lookup at each instrumented call.
+"""
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from service.common.metrics import metrics
+from service.common.slow_queries import normalize
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+INTERNAL, SERVER, CLIENT = 1, 2, 3  # OTLP span kinds
+ERROR = 2  # OTLP status code
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:  # pylint: disable=too-few-public-methods
+    """A timed operation of a trace"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "error")
+
+    def __init__(self, name, kind, trace_id, parent_id, attributes=None):  # pylint: disable=too-many-arguments
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64) or 1:016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def to_otlp(self):
+        """Returns the span in OTLP JSON"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [
+                {"key": key, "value": otlp_value(value)} for key, value in self.attributes.items()
+            ],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error:
+            span["status"] = {"code": ERROR, "message": self.error}
+        return span
+
+
+def otlp_value(value):
+    """Returns an attribute value in OTLP JSON"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def parse_traceparent(header):
+    """Returns (trace id, parent span id, sampled) of a traceparent, or None"""
+    match = TRACEPARENT.match(header or "")
+    if not match or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+class BatchExporter:
+    """Writes finished spans to a file in batches from a background thread"""
+
+    def __init__(self, path, batch_size, interval, maxsize):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.maxsize = maxsize
+        self.resource = {"attributes": [{"key": "service.name", "value": otlp_value("promotions")}]}
+        self.queue = queue.Queue(maxsize)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        """Queues a finished span, dropping it if the queue is full"""
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            metrics.increment("tracing.dropped")
+
+    def start(self):
+        """Starts the exporting thread of this process"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.queue = queue.Queue(self.maxsize)  # the parent's may be mid-use
+            threading.Thread(target=self.run, args=(self.queue,), daemon=True).start()
+
+    def run(self, spans):
+        """Writes a batch whenever it is full or the interval has passed"""
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(spans.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch:
+                self.write(batch)
+
+    def flush(self):
+        """Writes every queued span now"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        """Appends one batch of spans as a line of OTLP JSON"""
+        line = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": self.resource,
+                        "scopeSpans": [
+                            {"scope": {"name": "service"}, "spans": [span.to_otlp() for span in batch]}
+                        ],
+                    }
+                ]
+            },
+            separators=(",", ":"),
+        )
+        try:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+            metrics.increment("tracing.exported", len(batch))
+        except OSError:
+            metrics.increment("tracing.dropped", len(batch))
+
+
+class Tracer:
+    """Starts and finishes the spans of the sampled requests"""
+
+    def __init__(self, app, exporter):
+        self.sample_rate = app.config["TRACE_SAMPLE_RATE"]
+        self.exporter = exporter
+
+    def start_span(self, name, kind=INTERNAL, attributes=None):
+        """Starts a child of the current span, or returns None outside a trace"""
+        parent = current_span.get()
+        if parent is None:
+            return None
+        return Span(name, kind, parent.trace_id, parent.span_id, attributes)
+
+    def finish(self, span, error=None):
+        """Ends a span and hands it to the exporter"""
+        span.end = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        self.exporter.export(span)
+
+    def traced(self, name, kind=INTERNAL):
+        """Decorates a function to run in a span of its own when traced"""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                span = self.start_span(name, kind)
+                if span is None:
+                    return function(*args, **kwargs)
+                token = current_span.set(span)
+                try:
+                    result = function(*args, **kwargs)
+                except Exception as error:
+                    self.finish(span, error)
+                    raise
+                finally:
+                    current_span.reset(token)
+                self.finish(span)
+                return result
+
+            return wrapper
+
+        return decorator
+
+    ######################################################################
+    # Requests
+    ######################################################################
+    def start_request(self):
+        """Starts the server span of a request that is sampled"""
+        parent = parse_traceparent(request.headers.get("traceparent"))
+        if parent:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = f"{random.getrandbits(128) or 1:032x}", None
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            return
+        route = request.url_rule.rule if request.url_rule else "unknown route"
+        span = Span(
+            f"{request.method} {route}",
+            SERVER,
+            trace_id,
+            parent_id,
+            {"http.method": request.method, "http.route": route, "http.target": request.full_path},
+        )
+        g.tracing_token = current_span.set(span)
+        g.tracing_span = span
+
+    def finish_response(self, response):
+        """Notes the status of the response on the server span"""
+        span = g.get("tracing_span")
+        if span is not None:
+            span.attributes["http.status_code"] = response.status_code
+            response.headers["traceresponse"] = f"00-{span.trace_id}-{span.span_id}-01"
+        return response
+
+    def finish_request(self, exc=None):
+        """Ends the server span of the request"""
+        span = g.pop("tracing_span", None)
+        if span is None:
+            return
+        current_span.reset(g.pop("tracing_token"))
+        if exc is None and span.attributes.get("http.status_code", 200) >= 500:
+            span.error = f"HTTP {span.attributes['http.status_code']}"
+        self.finish(span, exc)
+
+    ######################################################################
+    # SQL statements
+    ######################################################################
+    def attach(self, target=Engine):
+        """Traces the statements of an engine, or of every engine"""
+        event.listen(target, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(target, "handle_error", self.handle_error)
+
+    def detach(self, target=Engine):
+        """Stops tracing the statements of the engine"""
+        event.remove(target, "before_cursor_execute", self.before_cursor_execute)
+        event.remove(target, "after_cursor_execute", self.after_cursor_execute)
+        event.remove(target, "handle_error", self.handle_error)
+
+    def before_cursor_execute(  # pylint: disable=too-many-arguments
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        """Starts the span of a statement"""
+        span = self.start_span(statement.split(None, 1)[0].upper() if statement else "SQL", CLIENT)
+        if span is not None:
+            span.attributes["db.system"] = conn.dialect.name
+            span.attributes["db.statement"] = normalize(statement)
+            context.tracing_span = span
+
+    def after_cursor_execute(  # pylint: disable=too-many-arguments
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        """Ends the span of a statement"""
+        span = getattr(context, "tracing_span", None)
+        if span is not None:
+            self.finish(span)
+
+    def handle_error(self, exception_context):
+        """Ends the span of a statement that failed"""
+        context = exception_context.execution_context
+        span = getattr(context, "tracing_span", None)
+        if span is not None:
+            self.finish(span, exception_context.original_exception)
+
+    ######################################################################
+    # Instrumentation
+    ######################################################################
+    def instrument_class(self, cls):
+        """Traces the public methods a class defines"""
+        for name, attribute in list(vars(cls).items()):
+            if name.startswith("_"):
+                continue
+            if isinstance(attribute, (classmethod, staticmethod)):
+                function = attribute.__func__
+            elif inspect.isfunction(attribute):
+                function = attribute
+            else:
+                continue
+            if inspect.isgeneratorfunction(function):
+                continue  # its work happens after it returns
+            wrapped = self.traced(f"{cls.__name__}.{name}")(function)
+            setattr(cls, name, type(attribute)(wrapped) if function is not attribute else wrapped)
+
+    def instrument_views(self, app):
+        """Traces the route handlers of the app"""
+        for endpoint, view in list(app.view_functions.items()):
+            if endpoint != "static":
+                app.view_functions[endpoint] = self.traced(f"handler {endpoint}")(view)
+
+    def instrument_representations(self, api):
+        """Traces the encoding of the responses of the API"""
+        for mediatype, represent in list(api.representations.items()):
+            api.representations[mediatype] = self.traced(f"encode {mediatype}")(represent)
+
+
+def init_tracing(app, api, model_classes):
+    """Set up tracing if TRACE_EXPORT_PATH is configured"""
+    config = app.config
+    if not config["TRACE_EXPORT_PATH"]:
+        app.extensions["tracer"] = None
+        return None
+    exporter = BatchExporter(
+        config["TRACE_EXPORT_PATH"],
+        config["TRACE_BATCH_SIZE"],
+        config["TRACE_EXPORT_INTERVAL_MS"] / 1000,
+        config["TRACE_QUEUE_SIZE"],
+    )
+    tracer = Tracer(app, exporter)
+    app.before_request(tracer.start_request)
+    app.after_request(tracer.finish_response)
+    app.teardown_request(tracer.finish_request)
+    tracer.attach()
+    tracer.instrument_views(app)
+    tracer.instrument_representations(api)
+    for cls in model_classes:
+        tracer.instrument_class(cls)
+    atexit.register(exporter.flush)
+    app.extensions["tracer"] = tracer
+    app.logger.info("Tracing established to %s", config["TRACE_EXPORT_PATH"])
+    return tracer
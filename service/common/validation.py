@@ -0,0 +1,153 @@
+"""
+Request Validation
+
+This module compiles a flask-restx model into a validator for request
+bodies. The model's fields are turned into a flat list of checks once, at
+import, so validating a body is one pass over that list. Every error is
+collected before anything is reported, and a valid body comes back as an
+immutable value object with the converted values, before any ORM instance
+is built. Strings are bounded by the length of the column they are stored
+in, so an overlong value is a 400 rather than an error from the database.
+"""
+import dataclasses
+from datetime import date
+
+from flask_restx import fields
+
+from service.models import DataValidationError
+
+
+class ValidationError(DataValidationError):
+    """Used when a request body breaks one or more rules of its model"""
+
+    def __init__(self, name, errors):
+        self.errors = errors
+        problems = "; ".join(f"{field} {message}" for field, message in errors.items())
+        super().__init__(f"Invalid {name}: {problems}")
+
+
+def check_string(value):
+    """Returns value if it is a string"""
+    if not isinstance(value, str):
+        raise ValueError("must be a string")
+    return value
+
+
+def check_boolean(value):
+    """Returns value if it is true or false"""
+    if not isinstance(value, bool):
+        raise ValueError("must be true or false")
+    return value
+
+
+def check_integer(value):
+    """Returns value if it is an integer"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("must be an integer")
+    return value
+
+
+def check_number(value):
+    """Returns value as a float if it is a number"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("must be a number")
+    return float(value)
+
+
+def check_date(value):
+    """Returns the date of an ISO 8601 string"""
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("must be a date as YYYY-MM-DD") from error
+
+
+def check_max_length(check, max_length):
+    """Returns a check that also rejects strings longer than max_length"""
+
+    def check_string_length(value):
+        value = check(value)
+        if len(value) > max_length:
+            raise ValueError(f"must be at most {max_length} characters")
+        return value
+
+    return check_string_length
+
+
+def column_length(columns, name):
+    """Returns the length of the named String column, or None"""
+    column = columns.get(name) if columns is not None else None
+    return getattr(column.type, "length", None) if column is not None else None
+
+
+# The check of every field type a model may use, most specific first
+CHECKS = (
+    (fields.Date, check_date),
+    (fields.Boolean, check_boolean),
+    (fields.Integer, check_integer),
+    (fields.Float, check_number),
+    (fields.String, check_string),
+)
+
+
+class Validator:
+    """Validates request bodies against a flask-restx model"""
+
+    def __init__(self, model, rules=None, columns=None):
+        """Compiles the checks of every writable field of the model
+
+        Args:
+            model (Model): the flask-restx model of the request body
+            rules (function): returns {field: message} for the rules across
+                fields that the value object breaks
+            columns (ColumnCollection): the columns the values are stored
+                in, whose lengths become the maxLength of their strings
+        """
+        self.name = model.name
+        self.rules = rules
+        self.checks = []
+        for name, field in model.items():
+            if field.readonly:
+                continue
+            check = next(check for kind, check in CHECKS if isinstance(field, kind))
+            if isinstance(field, fields.String):
+                lengths = [length for length in (field.max_length, column_length(columns, name)) if length]
+                if lengths:
+                    field.max_length = min(lengths)  # shown in the docs too
+                    check = check_max_length(check, field.max_length)
+            self.checks.append((name, bool(field.required), check))
+        self.value_type = dataclasses.make_dataclass(
+            f"{model.name}Values",
+            [name for name, _, _ in self.checks],
+            frozen=True,
+            slots=True,
+        )
+
+    def __call__(self, data):
+        """Returns the value object of a valid body
+
+        Raises ValidationError listing every problem of an invalid body.
+        """
+        if not isinstance(data, dict):
+            raise ValidationError(self.name, {"body": "must be an object"})
+        values = {}
+        errors = {}
+        for name, required, check in self.checks:
+            value = data.get(name)
+            if value is None or (required and value == ""):
+                if required:
+                    errors[name] = "is required"
+                values[name] = None
+                continue
+            try:
+                values[name] = check(value)
+            except ValueError as error:
+                errors[name] = str(error)
+                values[name] = None
+        result = self.value_type(**values)
+        if self.rules:
+            for name, message in self.rules(result).items():
+                errors.setdefault(name, message)
+        if errors:
+            raise ValidationError(self.name, errors)
+        return result
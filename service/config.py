@@ -12,5 +12,107 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Maximum number of promotions returned by a ?q= search
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "50"))
+
+# Response compression, in order of preference when the client accepts several
+COMPRESS_ALGORITHMS = os.getenv("COMPRESS_ALGORITHMS", "br,zstd,gzip")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+# JSON library for requests and responses: auto, orjson or stdlib
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "auto")
+
+# Admission control: per-client token buckets and per route class
+# concurrency caps for the promotion routes (write, list and single read)
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "50"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "100"))
+# Number of proxies in front of the service, such as the ingress, whose
+# X-Forwarded-For hops are trusted. Clients are keyed by the hop the
+# outermost of them appended. When 0 the peer address is used.
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+MAX_CONCURRENT_WRITES = int(os.getenv("MAX_CONCURRENT_WRITES", "4"))
+MAX_CONCURRENT_LISTS = int(os.getenv("MAX_CONCURRENT_LISTS", "4"))
+MAX_CONCURRENT_READS = int(os.getenv("MAX_CONCURRENT_READS", "16"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# Request deadlines in milliseconds (0 disables them). The time left is also
+# the Postgres statement_timeout of every transaction in the request.
+DEADLINE_READ_MS = int(os.getenv("DEADLINE_READ_MS", "1000"))
+DEADLINE_LIST_MS = int(os.getenv("DEADLINE_LIST_MS", "5000"))
+DEADLINE_WRITE_MS = int(os.getenv("DEADLINE_WRITE_MS", "2000"))
+
+# Most changes returned by one page of GET /api/promotions/changes
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "500"))
+
+# GET /api/promotions/stream holds a worker thread per subscriber, so run an
+# async worker class such as gevent to serve many. A worker takes at most
+# STREAM_MAX_SUBSCRIBERS, and never more than its WORKER_CONCURRENCY (set by
+# gunicorn.conf.py) less STREAM_RESERVED_THREADS kept for other requests.
+# Streams end after STREAM_MAX_SECONDS and clients resume with Last-Event-ID.
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+STREAM_RESERVED_THREADS = int(os.getenv("STREAM_RESERVED_THREADS", "2"))
+STREAM_MAX_SUBSCRIBERS = int(os.getenv("STREAM_MAX_SUBSCRIBERS", "100"))
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", "300"))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+STREAM_RETRY_MS = int(os.getenv("STREAM_RETRY_MS", "3000"))
+
+# flask promotions-archive moves promotions that ended more than
+# ARCHIVE_AFTER_DAYS ago out of the live table, ARCHIVE_BATCH_SIZE rows at a time
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+# Most ids GET /api/promotions?ids= and POST /api/promotions/lookup take
+LOOKUP_MAX_IDS = int(os.getenv("LOOKUP_MAX_IDS", "100"))
+
+# Identical reads in flight at once share one query. The others wait up to
+# COALESCE_TIMEOUT_MS for it before they run the query themselves.
+COALESCE_TIMEOUT_MS = int(os.getenv("COALESCE_TIMEOUT_MS", "1000"))
+
+# Lookups of ids and promotion codes that certainly do not exist are answered
+# from a Bloom filter rebuilt every NEGATIVE_CACHE_REBUILD_SECONDS
+NEGATIVE_CACHE_ENABLED = os.getenv("NEGATIVE_CACHE_ENABLED", "true").lower() == "true"
+NEGATIVE_CACHE_ERROR_RATE = float(os.getenv("NEGATIVE_CACHE_ERROR_RATE", "0.01"))
+NEGATIVE_CACHE_REBUILD_SECONDS = float(os.getenv("NEGATIVE_CACHE_REBUILD_SECONDS", "300"))
+
+# Every worker on a node serves the active promotions from one memory-mapped
+# snapshot file at SNAPSHOT_PATH, rebuilt when they change ("" disables it)
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "")
+
+# LOG_FORMAT=json writes every record as JSON from a listener thread, queueing
+# at most LOG_QUEUE_SIZE records. LOG_SAMPLE_RATES keeps a fraction of the info
+# lines of busy loggers, such as "flask.app.models=0.1".
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# With a PROFILE_DIR, requests signed with PROFILE_SECRET are profiled, and so
+# is a PROFILE_SAMPLE_RATE fraction of the others. The directory keeps the
+# newest PROFILE_MAX_FILES profiles.
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+# Statements slower than SLOW_QUERY_MS (0 turns the log off) are logged and
+# added up by fingerprint, keeping at most SLOW_QUERY_MAX_FINGERPRINTS. On
+# Postgres a SLOW_QUERY_EXPLAIN_RATE fraction of the slow plain reads of the
+# promotion tables is run again under EXPLAIN (ANALYZE, BUFFERS) for up to
+# SLOW_QUERY_EXPLAIN_TIMEOUT_MS.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_MAX_FINGERPRINTS = int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "200"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0"))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "5000"))
+
+# With a TRACE_EXPORT_PATH, requests with a sampled traceparent and a
+# TRACE_SAMPLE_RATE fraction of the others are traced. Their spans are
+# appended to the file as OTLP JSON in batches of up to TRACE_BATCH_SIZE,
+# every TRACE_EXPORT_INTERVAL_MS, queueing at most TRACE_QUEUE_SIZE spans.
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "512"))
+TRACE_EXPORT_INTERVAL_MS = int(os.getenv("TRACE_EXPORT_INTERVAL_MS", "2000"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "4096"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
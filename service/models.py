@@ -4,20 +4,28 @@ Models for Promotion
 All of the models are stored in this module
 """
 
-# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-instance-attributes, too-many-public-methods
 
+import dataclasses
 import logging
 
 # from enum import Enum
 from datetime import date
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import and_
+from sqlalchemy import and_, any_, case, delete, func, insert, inspect, or_, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import SQLAlchemyError
+from service.common.invalidation import EVERYTHING, invalidation_bus
+from service.common.notifications import notifications
 
 
-logger = logging.getLogger("flask.app")
+logger = logging.getLogger("flask.app.models")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Committed objects stay loaded so that serializing a Promotion right after
+# create() or update() does not issue another SELECT to reload it. The session
+# is removed at the end of every request, so nothing outlives the request.
+db = SQLAlchemy(session_options={"expire_on_commit": False})
 
 
 # # Function to initialize the database
@@ -36,6 +44,15 @@ class Promotion(db.Model):
     """
 
     app = None
+    trigram_search = False
+
+    # Composite indexes backing the filter combinations used by find_by_filters
+    __table_args__ = (
+        db.Index("ix_promotion_name_products_type", "name", "products_type"),
+        db.Index("ix_promotion_products_type_is_active", "products_type", "is_active"),
+        db.Index("ix_promotion_start_date_end_date", "start_date", "end_date"),
+        db.Index("ix_promotion_promotion_code", "promotion_code"),
+    )
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
@@ -62,14 +79,14 @@ class Promotion(db.Model):
             raise DataValidationError("Creates called with missing name")
         if not self.products_type:
             raise DataValidationError("Creates called with missing products_type ")
-        if not self.require_code and self.promotion_code:
-            raise DataValidationError(
-                "Creates called with promotion_code and require_code=False"
-            )
-        if self.start_date > self.end_date:
-            raise DataValidationError("Creates called with start_date > end_date")
+        errors = self.rule_violations(self)
+        if errors:
+            problems = "; ".join(f"{field} {message}" for field, message in errors.items())
+            raise DataValidationError(f"Creates called with {problems}")
 
         db.session.add(self)
+        db.session.flush()  # assigns the id that the change log refers to
+        self.log_change("create")
         db.session.commit()
 
     def update(self):
@@ -79,14 +96,41 @@ class Promotion(db.Model):
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
+        self.log_change("update")
         db.session.commit()
 
     def delete(self):
         """Removes a Promotion from the data store"""
         logger.info("Deleting %s", self.name)
         db.session.delete(self)
+        db.session.flush()  # locks the row before the change log, like every write
+        self.log_change("delete")
         db.session.commit()
 
+    def log_change(self, operation):
+        """Logs a write in the current transaction and invalidates caches
+
+        Args:
+            operation (string): create, update, delete, activate or deactivate
+        """
+        PromotionChange.record(self, operation)
+        invalidation_bus.publish(db.session, self.invalidation_keys())
+
+    def invalidation_keys(self):
+        """Returns the cache keys that a pending write to this Promotion touches
+
+        An update touches the products_type and promotion_code it had before
+        as well as the new ones.
+        """
+        keys = {("id", self.id)}
+        state = inspect(self)
+        for column in ("products_type", "promotion_code"):
+            history = state.attrs[column].history
+            for value in history.sum():
+                if value is not None:
+                    keys.add((column, value))
+        return keys
+
     def serialize(self):
         """Serializes a Promotion into a dictionary"""
         promotion = {
@@ -103,6 +147,31 @@ class Promotion(db.Model):
             promotion["_id"] = self.id
         return promotion
 
+    @staticmethod
+    def rule_violations(promotion):
+        """Returns {field: message} for the rules across fields it breaks
+
+        Args:
+            promotion: a Promotion, or any object with the same attributes
+        """
+        errors = {}
+        if promotion.promotion_code and not promotion.require_code:
+            errors["promotion_code"] = "is only allowed when require_code is true"
+        start_date, end_date = promotion.start_date, promotion.end_date
+        if start_date and end_date and start_date > end_date:
+            errors["end_date"] = "must not be before start_date"
+        return errors
+
+    def apply(self, values):
+        """Copies validated values, such as from a request body, onto the Promotion
+
+        Args:
+            values: a value object with an attribute per column to set
+        """
+        for field in dataclasses.fields(values):
+            setattr(self, field.name, getattr(values, field.name))
+        return self
+
     def deserialize(self, data):
         """
         Deserializes a Promotion from a dictionary
@@ -143,6 +212,7 @@ class Promotion(db.Model):
         """
         logger.info("Activating promotion %s", self.name)
         self.is_active = True
+        self.log_change("activate")
         db.session.commit()
 
     def deactivate(self):
@@ -151,6 +221,7 @@ class Promotion(db.Model):
         """
         logger.info("Deactivating promotion %s", self.name)
         self.is_active = False
+        self.log_change("deactivate")
         db.session.commit()
 
     @classmethod
@@ -162,6 +233,31 @@ class Promotion(db.Model):
         db.init_app(app)
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
+        cls.init_search_indexes()
+
+    @classmethod
+    def init_search_indexes(cls):
+        """Creates pg_trgm GIN indexes for name and description search
+
+        Only Postgres supports them. Everywhere else, or when the extension
+        cannot be installed, search falls back to plain LIKE matching.
+        """
+        cls.trigram_search = False
+        if db.engine.dialect.name != "postgresql":
+            return
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                for column in ("name", "description"):
+                    conn.execute(
+                        text(
+                            f"CREATE INDEX IF NOT EXISTS ix_promotion_{column}_trgm "
+                            f"ON {cls.__tablename__} USING gin ({column} gin_trgm_ops)"
+                        )
+                    )
+            cls.trigram_search = True
+        except SQLAlchemyError as error:
+            logger.warning("Trigram search indexes unavailable: %s", error)
 
     @classmethod
     def all(cls):
@@ -169,12 +265,100 @@ class Promotion(db.Model):
         logger.info("Processing all Promotion")
         return cls.query.all()
 
+    @classmethod
+    def count(cls, **filters):
+        """Returns the number of Promotion matching the filters
+
+        Args:
+            filters: the same keyword filters accepted by find_by_filters
+        """
+        logger.info("Processing count query ...")
+        return cls.find_by_filters(**filters).order_by(None).count()
+
+    @classmethod
+    def estimate_count(cls):
+        """Returns the planner's row estimate for the Promotion table
+
+        Reads pg_class.reltuples so the table is never scanned. Returns None
+        when no estimate is available, either because the database is not
+        Postgres or because the table has not been analyzed yet.
+        """
+        logger.info("Processing estimated count ...")
+        if db.engine.dialect.name != "postgresql":
+            return None
+        reltuples = db.session.execute(
+            text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+            {"table": cls.__tablename__},
+        ).scalar()
+        if reltuples is None or reltuples < 0:
+            return None
+        return int(reltuples)
+
+    @classmethod
+    def archive_expired(cls, before, batch_size=1000):
+        """Moves Promotion that ended before a day to the archive table
+
+        Rows are moved in batches of at most batch_size, each in its own
+        transaction, so locks are held briefly and the work can be stopped
+        between batches. Rows locked by a running request are skipped.
+        Yields the number of Promotion moved by every batch.
+
+        Args:
+            before (date): archive Promotion whose end_date is before this day
+            batch_size (int): the most rows to move in one transaction
+        """
+        logger.info("Archiving promotions that ended before %s ...", before)
+        columns = [column.name for column in cls.__table__.columns]
+        while True:
+            rows = db.session.execute(
+                select(cls.id, cls.end_date)
+                .where(cls.end_date < before)
+                .order_by(cls.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not rows:
+                db.session.commit()
+                return
+            ids = [row.id for row in rows]
+            ArchivedPromotion.create_partitions({row.end_date.year for row in rows})
+            db.session.execute(
+                insert(ArchivedPromotion.__table__).from_select(
+                    columns,
+                    select(*[cls.__table__.c[column] for column in columns]).where(
+                        cls.id.in_(ids)
+                    ),
+                )
+            )
+            db.session.execute(delete(cls).where(cls.id.in_(ids)))
+            PromotionChange.record_tombstones(ids, "archive")
+            invalidation_bus.publish(db.session, [EVERYTHING])
+            db.session.commit()
+            yield len(ids)
+
     @classmethod
     def find(cls, by_id):
         """Finds a Promotion by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_many(cls, ids):
+        """Returns the Promotion with any of the ids in a single query
+
+        On Postgres the ids are bound as one array, so every list length
+        shares the same statement and plan.
+
+        Args:
+            ids (list of int): the ids of the Promotion you want
+        """
+        logger.info("Processing lookup for %s ids ...", len(ids))
+        if db.engine.dialect.name == "postgresql":
+            criterion = cls.id == any_(db.bindparam("ids", list(ids), type_=ARRAY(db.Integer)))
+        else:
+            criterion = cls.id.in_(ids)
+        return cls.query.filter(criterion).all()
+
     @classmethod
     def find_by_name(cls, name):
         """Returns all Promotion with the given name
@@ -210,3 +394,252 @@ class Promotion(db.Model):
         return cls.query.filter(
             and_(cls.start_date <= date_temp, cls.end_date >= date_temp)
         )
+
+    @classmethod
+    def find_by_filters(  # pylint: disable=too-many-arguments
+        cls,
+        name=None,
+        products_type=None,
+        is_active=None,
+        require_code=None,
+        start_date=None,
+        end_date=None,
+        q=None,  # pylint: disable=invalid-name
+        promotion_code=None,
+    ):
+        """Returns all Promotion matching every filter that was supplied
+
+        Filters left as None are ignored, so all of the supplied filters are
+        combined into a single SQL query.
+
+        Args:
+            name (string): the name of the Promotion you want to match
+            products_type (string): the products_type you want to match
+            is_active (bool): only active or only inactive Promotion
+            require_code (bool): only Promotion that do or do not need a code
+            start_date (date): only Promotion still running on or after this day
+            end_date (date): only Promotion already started on or before this day
+            q (string): search text for name and description, see search()
+            promotion_code (string): the promotion_code you want to match
+        """
+        logger.info("Processing filtered query ...")
+        criteria = [
+            column == value
+            for column, value in (
+                (cls.name, name),
+                (cls.products_type, products_type),
+                (cls.is_active, is_active),
+                (cls.require_code, require_code),
+                (cls.promotion_code, promotion_code),
+            )
+            if value is not None
+        ]
+        if start_date is not None:
+            criteria.append(cls.end_date >= start_date)
+        if end_date is not None:
+            criteria.append(cls.start_date <= end_date)
+        query = cls.query.filter(*criteria)
+        if q:
+            query = cls.search(q, query)
+        return query
+
+    @classmethod
+    def search(cls, search_text, query=None):
+        """Returns all Promotion whose name or description match the text
+
+        Matching is case-insensitive on prefixes and substrings, and also fuzzy
+        on the name when pg_trgm is available. Results are ranked with name
+        prefix matches first, then name substrings, then description matches.
+
+        Args:
+            search_text (string): the text to search for
+            query (Query): an optional query to narrow down
+        """
+        logger.info("Processing search query for %s ...", search_text)
+        query = cls.query if query is None else query
+        name_prefix = cls.name.istartswith(search_text, autoescape=True)
+        name_contains = cls.name.icontains(search_text, autoescape=True)
+        description_contains = cls.description.icontains(search_text, autoescape=True)
+        matches = [name_contains, description_contains]
+        ranking = [
+            case(
+                (name_prefix, 0),
+                (name_contains, 1),
+                (cls.description.istartswith(search_text, autoescape=True), 2),
+                (description_contains, 3),
+                else_=4,
+            )
+        ]
+        if cls.trigram_search:
+            matches.append(cls.name.bool_op("%")(search_text))
+            ranking.append(func.similarity(cls.name, search_text).desc())
+        return query.filter(or_(*matches)).order_by(*ranking, cls.name, cls.id)
+
+
+class ArchivedPromotion(Promotion):
+    """
+    Class that represents an expired Promotion moved out of the live table
+
+    It shares every finder of Promotion, so archived rows are read the same
+    way. On Postgres the archive is range partitioned by end_date with one
+    partition per year, so old years can be detached or dropped cheaply.
+    """
+
+    __tablename__ = "promotion_archive"
+    __table_args__ = ({"postgresql_partition_by": "RANGE (end_date)"},)
+
+    # Table Schema, in the same column order as Promotion. Postgres needs the
+    # partition key in the primary key, but id alone identifies a row.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(63), nullable=False)
+    description = db.Column(db.String(63))
+    products_type = db.Column(db.String(63), nullable=False)
+    promotion_code = db.Column(db.String(63))
+    require_code = db.Column(db.Boolean(), nullable=False, default=False)
+    start_date = db.Column(db.Date(), nullable=False)
+    end_date = db.Column(db.Date(), primary_key=True)
+    is_active = db.Column(db.Boolean(), nullable=False, default=False)
+
+    __mapper_args__ = {"concrete": True, "primary_key": [id]}
+
+    def __repr__(self):
+        return f"<ArchivedPromotion {self.name} id=[{self.id}]>"
+
+    @classmethod
+    def create_partitions(cls, years):
+        """Creates the archive partitions for the given years if missing
+
+        Only Postgres archives are partitioned, so elsewhere nothing is done.
+
+        Args:
+            years (set): the years of end_date that rows are about to use
+        """
+        if db.engine.dialect.name != "postgresql":
+            return
+        for year in sorted(years):
+            db.session.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {cls.__tablename__}_{year:04d} "
+                    f"PARTITION OF {cls.__tablename__} "
+                    f"FOR VALUES FROM ('{year:04d}-01-01') TO ('{year + 1:04d}-01-01')"
+                )
+            )
+
+
+class PromotionChange(db.Model):
+    """
+    Class that represents one change in the Promotion change log
+
+    Every write to a Promotion appends a change in the same transaction, so
+    consumers can follow the log by its id instead of reloading every
+    Promotion. Deletes and archives are logged as tombstones without data.
+    Bulk loads that bypass the log append a reload marker instead, telling
+    consumers to reload every Promotion.
+    """
+
+    __tablename__ = "promotion_change"
+    # cursors must never be reused, even after the log is trimmed
+    __table_args__ = ({"sqlite_autoincrement": True},)
+
+    TOMBSTONES = ("delete", "archive")
+    RELOAD = "reload"  # operation of the marker left by bulk loads
+    LOCK_KEY = 0x70726F6D  # advisory lock that orders appends to the log
+    CHANNEL = "promotion_changes"  # notified when appends commit
+
+    # Table Schema
+    id = db.Column(
+        db.BigInteger().with_variant(db.Integer(), "sqlite"), primary_key=True
+    )
+    promotion_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(16), nullable=False)
+    data = db.Column(db.JSON)
+    changed_at = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),  # pylint: disable=not-callable
+    )
+
+    def __repr__(self):
+        return f"<PromotionChange {self.operation} promotion=[{self.promotion_id}]>"
+
+    def serialize(self):
+        """Serializes a PromotionChange into a dictionary"""
+        return {
+            "cursor": self.id,
+            "promotion_id": self.promotion_id,
+            "operation": self.operation,
+            "promotion": self.data,
+            "changed_at": self.changed_at.isoformat() if self.changed_at else None,
+        }
+
+    @classmethod
+    def lock(cls):
+        """Orders the appends to the change log until the transaction ends
+
+        Ids come from a sequence, and concurrent transactions may commit them
+        out of order. A consumer that had already read past the later id
+        would then miss the earlier change. Holding this lock from the
+        append to the commit makes ids become visible in order. SQLite
+        already runs one write transaction at a time.
+
+        Writes must flush their rows before they take this lock, so that
+        every transaction locks the row first and the log second. Two
+        writes to one row taking them in opposite orders would deadlock.
+        """
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(select(func.pg_advisory_xact_lock(cls.LOCK_KEY)))
+        notifications.publish(db.session, cls.CHANNEL)
+
+    @classmethod
+    def record(cls, promotion, operation):
+        """Appends a change to a Promotion to the current transaction
+
+        Args:
+            promotion (Promotion): the Promotion that was changed
+            operation (string): create, update, delete, activate or deactivate
+        """
+        cls.lock()
+        data = None if operation in cls.TOMBSTONES else promotion.serialize()
+        db.session.add(
+            cls(promotion_id=promotion.id, operation=operation, data=data)
+        )
+
+    @classmethod
+    def record_tombstones(cls, promotion_ids, operation):
+        """Appends a tombstone for every Promotion id to the current transaction
+
+        Args:
+            promotion_ids (list): the ids of the Promotion that went away
+            operation (string): delete or archive
+        """
+        cls.lock()
+        db.session.execute(
+            insert(cls),
+            [{"promotion_id": id_, "operation": operation} for id_ in promotion_ids],
+        )
+
+    @classmethod
+    def record_reload(cls):
+        """Appends a reload marker to the current transaction
+
+        Rows loaded in bulk have no changes of their own, so consumers
+        following the log, the snapshot among them, learn of them this way.
+        """
+        cls.lock()
+        db.session.add(cls(promotion_id=0, operation=cls.RELOAD))
+
+    @classmethod
+    def latest(cls):
+        """Returns the cursor of the last change logged, 0 for none"""
+        return db.session.query(func.max(cls.id)).scalar() or 0  # pylint: disable=not-callable
+
+    @classmethod
+    def since(cls, cursor, limit):
+        """Returns up to limit changes logged after the cursor, oldest first
+
+        Args:
+            cursor (int): the id of the last change already seen, 0 for all
+            limit (int): the most changes to return
+        """
+        logger.info("Processing changes since %s ...", cursor)
+        return cls.query.filter(cls.id > cursor).order_by(cls.id).limit(limit).all()
@@ -3,14 +3,23 @@ My Service
 
 Describe what your service does here
 """
-from flask import jsonify, abort
-from flask_restx import Resource, fields, reqparse
+import os
+from flask import Response, jsonify, abort, send_file
+from flask_restx import Resource, fields, reqparse, inputs
 from service.common import status  # HTTP Status Codes
-from service.models import Promotion
+from service.common.coalescing import reads, wait_timeout
+from service.common.deadlines import deadline
+from service.common.media_types import get_payload
+from service.common.metrics import metrics
+from service.common.notifications import notifications
+from service.common.validation import Validator
+from service.models import db, ArchivedPromotion, Promotion, PromotionChange
 
 # Import Flask application
 from . import app, api
 
+MAX_PROMOTION_ID = 2**31 - 1  # the largest id the integer column holds
+
 
 ######################################################################
 # GET HEALTH CHECK
@@ -63,6 +72,9 @@ create_model = api.model(
     },
 )
 
+# Checks a posted Promotion in one pass, with its rules and column lengths
+validate_promotion = Validator(create_model, rules=Promotion.rule_violations, columns=Promotion.__table__.columns)
+
 promotion_model = api.inherit(
     "PromotionModel",
     create_model,
@@ -86,6 +98,334 @@ promotion_args.add_argument(
     required=False,
     help="List Promotion by products type",
 )
+promotion_args.add_argument(
+    "is_active",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    help="List Promotion that are active or inactive",
+)
+promotion_args.add_argument(
+    "promotion_code",
+    type=str,
+    location="args",
+    required=False,
+    help="List Promotion by promotion code",
+)
+promotion_args.add_argument(
+    "require_code",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    help="List Promotion that do or do not require a code",
+)
+promotion_args.add_argument(
+    "start_date",
+    type=inputs.date_from_iso8601,
+    location="args",
+    required=False,
+    help="List Promotion still running on or after this date",
+)
+promotion_args.add_argument(
+    "end_date",
+    type=inputs.date_from_iso8601,
+    location="args",
+    required=False,
+    help="List Promotion already started on or before this date",
+)
+promotion_args.add_argument(
+    "q",
+    type=str,
+    location="args",
+    required=False,
+    help="Search Promotion by name or description",
+)
+
+promotion_args.add_argument(
+    "include_archived",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Also return expired Promotion moved to the archive",
+)
+
+archive_args = reqparse.RequestParser()
+archive_args.add_argument(
+    "include_archived",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Also look for the Promotion in the archive",
+)
+
+count_args = promotion_args.copy()
+count_args.add_argument(
+    "approximate",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Estimate the unfiltered count from planner statistics",
+)
+
+# ids is added after count_args was copied, as counting by ids makes no sense
+promotion_args.add_argument(
+    "ids",
+    type=str,
+    location="args",
+    required=False,
+    help="List the Promotion with these comma separated ids, in that order",
+)
+
+lookup_create_model = api.model(
+    "PromotionLookupRequest",
+    {
+        "ids": fields.List(
+            fields.String,
+            required=True,
+            description="The ids of the Promotions to return, in that order",
+        ),
+        "include_archived": fields.Boolean(
+            description="Also look for the Promotions in the archive"
+        ),
+    },
+)
+
+lookup_model = api.model(
+    "PromotionLookup",
+    {
+        "promotions": fields.List(
+            fields.Nested(promotion_model),
+            description="The Promotions found, in the order of the ids",
+        ),
+        "missing": fields.List(
+            fields.String, description="The ids no Promotion was found for"
+        ),
+    },
+)
+
+count_model = api.model(
+    "PromotionCount",
+    {
+        "count": fields.Integer(description="The number of matching Promotions"),
+        "approximate": fields.Boolean(
+            description="Is the count an estimate from planner statistics?"
+        ),
+    },
+)
+
+changes_args = reqparse.RequestParser()
+changes_args.add_argument(
+    "since",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    default=0,
+    help="Return the changes after this cursor, 0 for the whole log",
+)
+changes_args.add_argument(
+    "limit",
+    type=inputs.positive,
+    location="args",
+    required=False,
+    help="The most changes to return, up to the configured page size",
+)
+
+change_model = api.model(
+    "PromotionChange",
+    {
+        "cursor": fields.Integer(description="The position of the change in the log"),
+        "promotion_id": fields.String(description="The id of the changed Promotion"),
+        "operation": fields.String(
+            description="create, update, delete, activate, deactivate, archive, "
+            "or reload when promotions were loaded in bulk and must all be read again"
+        ),
+        "promotion": fields.Nested(
+            promotion_model,
+            allow_null=True,
+            description="The Promotion after the change, null for a tombstone",
+        ),
+        "changed_at": fields.DateTime(description="When the change was committed"),
+    },
+)
+
+changes_model = api.model(
+    "PromotionChanges",
+    {
+        "changes": fields.List(fields.Nested(change_model)),
+        "cursor": fields.Integer(description="The cursor to ask for the next page"),
+        "more": fields.Boolean(description="Are more changes waiting after this page?"),
+    },
+)
+
+stream_args = reqparse.RequestParser()
+stream_args.add_argument(
+    "since",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    help="Push the changes after this cursor, by default only new ones",
+)
+stream_args.add_argument(
+    "Last-Event-ID",
+    type=inputs.natural,
+    location="headers",
+    required=False,
+    help="Resume after the last event received, overrides since",
+)
+
+
+def models_to_read(include_archived):
+    """Returns the models to read, the live one first"""
+    if include_archived:
+        return [Promotion, ArchivedPromotion]
+    return [Promotion]
+
+
+def find_promotions(model, filters, limit=None):
+    """Returns the promotions of one model matching the list filters"""
+    if not filters:
+        app.logger.info("Returning unfiltered list.")
+        return model.all()
+    app.logger.info("Filtering by: %s", filters)
+    query = model.find_by_filters(**filters)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def list_promotions(filters, include_archived):
+    """Returns the serialized promotions matching the list filters and
+    how many match in all"""
+    models = models_to_read(include_archived)
+    limit = app.config["SEARCH_LIMIT"] if filters.get("q") else None
+    promotions = []
+    for model in models:
+        if limit and len(promotions) >= limit:
+            break
+        promotions += find_promotions(model, filters, limit and limit - len(promotions))
+
+    total = len(promotions)
+    if limit and total >= limit:
+        # the search was cut off so count every match
+        total = sum(model.count(**filters) for model in models)
+    return [promotion.serialize() for promotion in promotions], total
+
+
+def promotion_id_value(value):
+    """Returns the value as a promotion id, or None if it cannot be one
+
+    Only ASCII digits are accepted, since isdigit() alone lets through
+    characters such as "²" that int() rejects, and the id must fit the
+    integer column.
+    """
+    text = str(value).strip()
+    if isinstance(value, bool) or not (text.isascii() and text.isdigit()):
+        return None
+    promotion_id = int(text)
+    return promotion_id if 0 < promotion_id <= MAX_PROMOTION_ID else None
+
+
+def parse_promotion_id(promotion_id):
+    """Returns the id in the path as a number, or aborts with 404 since no
+    promotion can have it"""
+    number = promotion_id_value(promotion_id)
+    if number is None:
+        abort(status.HTTP_404_NOT_FOUND, f"Promotion with id '{promotion_id}' was not found.")
+    return number
+
+
+def find_promotion(promotion_id):
+    """Returns the Promotion with the id in the path, or aborts with 404"""
+    promotion = Promotion.find(parse_promotion_id(promotion_id))
+    if not promotion:
+        abort(status.HTTP_404_NOT_FOUND, f"Promotion with id '{promotion_id}' was not found.")
+    return promotion
+
+
+def parse_ids(values):
+    """Returns the promotion ids asked for, in order and without repeats"""
+    if not isinstance(values, list):
+        abort(status.HTTP_400_BAD_REQUEST, "ids must be a list of promotion ids.")
+    ids = []
+    for value in values:
+        promotion_id = promotion_id_value(value)
+        if promotion_id is None:
+            abort(status.HTTP_400_BAD_REQUEST, f"'{value}' is not a promotion id.")
+        ids.append(promotion_id)
+    ids = list(dict.fromkeys(ids))
+    limit = app.config["LOOKUP_MAX_IDS"]
+    if not ids or len(ids) > limit:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"Between 1 and {limit} ids can be looked up at once.",
+        )
+    return ids
+
+
+def lookup_promotions(ids, include_archived):
+    """Returns the serialized promotions with the ids, in the order of the
+    ids, and the ids that were not found"""
+    found = {}
+    for model in models_to_read(include_archived):
+        remaining = [promotion_id for promotion_id in ids if promotion_id not in found]
+        if not remaining:
+            break
+        for promotion in model.find_many(remaining):
+            found[promotion.id] = promotion.serialize()
+    app.logger.info("[%s] of %s Promotions found", len(found), len(ids))
+    promotions = [found[promotion_id] for promotion_id in ids if promotion_id in found]
+    missing = [str(promotion_id) for promotion_id in ids if promotion_id not in found]
+    return promotions, missing
+
+
+def read_promotion(promotion_id, include_archived):
+    """Returns the serialized promotion with the id, or None"""
+    promotion = Promotion.find(promotion_id)
+    if not promotion and include_archived:
+        promotion = ArchivedPromotion.find(promotion_id)
+    return promotion.serialize() if promotion else None
+
+
+def negative_cache_excludes(column, value):
+    """Returns True if the negative cache knows no promotion has the value"""
+    cache = app.extensions.get("negative_cache")
+    return bool(cache) and cache.excludes(column, value)
+
+
+def record_false_positive(column, value):
+    """Counts a lookup the negative cache let through that found nothing"""
+    cache = app.extensions.get("negative_cache")
+    if cache:
+        cache.record_false_positive(column, value)
+
+
+def active_snapshot():
+    """Returns the snapshot of the active promotions, or None without one"""
+    store = app.extensions.get("snapshot")
+    snapshot = store and store.current()
+    if snapshot is not None:
+        metrics.increment("snapshot.hits")
+    return snapshot
+
+
+def snapshot_lookup(filters, include_archived):
+    """Returns the serialized promotions for the list filters from the
+    snapshot, or None when the snapshot cannot answer them"""
+    if (
+        include_archived
+        or filters.get("is_active") is not True
+        or not set(filters) <= {"is_active", "products_type"}
+    ):
+        return None
+    snapshot = active_snapshot()
+    if snapshot is None:
+        return None
+    if "products_type" in filters:
+        return snapshot.find_by_products_type(filters["products_type"])
+    return snapshot.all()
 
 
 ######################################################################
@@ -108,7 +448,9 @@ class PromotionResource(Resource):
     # ------------------------------------------------------------------
     @api.doc("get_promotions")
     @api.response(404, "Promotion not found")
+    @api.expect(archive_args, validate=True)
     @api.marshal_with(promotion_model)
+    @deadline("DEADLINE_READ_MS")
     def get(self, promotion_id):
         """
         Retrieve a single promotion
@@ -116,13 +458,26 @@ class PromotionResource(Resource):
         This endpoint will return a promotion based on it's id
         """
         app.logger.info("Request to Retrieve a promotion with id [%s]", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        number = parse_promotion_id(promotion_id)
+        include_archived = archive_args.parse_args()["include_archived"]
+        snapshot = active_snapshot()
+        found = snapshot and snapshot.find(number)
+        if found:
+            return found, status.HTTP_200_OK
+        checked = not include_archived
+        if checked and negative_cache_excludes("id", number):
+            abort(status.HTTP_404_NOT_FOUND, f"Promotion with id '{promotion_id}' was not found.")
+        promotion = reads.do(
+            ("read", promotion_id, include_archived),
+            lambda: read_promotion(promotion_id, include_archived),
+            wait_timeout(app),
+            {("id", number)},
+        )
         if not promotion:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Promotion with id '{promotion_id}' was not found.",
-            )
-        return promotion.serialize(), status.HTTP_200_OK
+            if checked:
+                record_false_positive("id", number)
+            abort(status.HTTP_404_NOT_FOUND, f"Promotion with id '{promotion_id}' was not found.")
+        return promotion, status.HTTP_200_OK
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING PROMOTION
@@ -132,6 +487,7 @@ class PromotionResource(Resource):
     @api.response(400, "The posted Promotion data was not valid")
     @api.expect(promotion_model)
     @api.marshal_with(promotion_model)
+    @deadline("DEADLINE_WRITE_MS")
     def put(self, promotion_id):
         """
         Update a Promotion
@@ -139,16 +495,10 @@ class PromotionResource(Resource):
         This endpoint will update a Promotion based the body that is posted
         """
         app.logger.info("Request to Update a promotion with id [%s]", promotion_id)
-        promotion = Promotion.find(promotion_id)
-        if not promotion:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Promotion with id '{promotion_id}' was not found.",
-            )
-        app.logger.debug("Payload = %s", api.payload)
-        data = api.payload
-        promotion.deserialize(data)
-        promotion.id = promotion_id
+        promotion = find_promotion(promotion_id)
+        data = get_payload()
+        app.logger.debug("Payload = %s", data)
+        promotion.apply(validate_promotion(data))
         promotion.update()
         return promotion.serialize(), status.HTTP_200_OK
 
@@ -157,6 +507,8 @@ class PromotionResource(Resource):
     # ------------------------------------------------------------------
     @api.doc("delete_promotions")
     @api.response(204, "Promotion deleted")
+    @api.response(404, "The id cannot be a promotion id")
+    @deadline("DEADLINE_WRITE_MS")
     def delete(self, promotion_id):
         """
         Delete a Promotion
@@ -164,7 +516,7 @@ class PromotionResource(Resource):
         This endpoint will delete a Promotion based the id specified in the path
         """
         app.logger.info("Request to Delete a promotion with id [%s]", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find(parse_promotion_id(promotion_id))
         if promotion:
             promotion.delete()
             app.logger.info("Promotion with id [%s] was deleted", promotion_id)
@@ -185,25 +537,38 @@ class PromotionCollection(Resource):
     @api.doc("list_promotions")
     @api.expect(promotion_args, validate=True)
     @api.marshal_list_with(promotion_model)
+    @deadline("DEADLINE_LIST_MS")
     def get(self):
         """Returns all of the Promotions"""
         app.logger.info("Request to list Promotions...")
-        promotions = []
         args = promotion_args.parse_args()
-
-        if args["name"]:
-            app.logger.info("Filtering by name: %s", args["name"])
-            promotions = list(Promotion.find_by_name(args["name"]))
-        elif args["products_type"]:
-            app.logger.info("Filtering by products_type: %s", args["products_type"])
-            promotions = list(Promotion.find_by_products_type(args["products_type"]))
-        else:
-            app.logger.info("Returning unfiltered list.")
-            promotions = Promotion.all()
-
-        app.logger.info("[%s] Promotions returned", len(promotions))
-        results = [promotion.serialize() for promotion in promotions]
-        return results, status.HTTP_200_OK
+        include_archived = args.pop("include_archived")
+        ids = args.pop("ids")
+        if ids is not None:
+            promotions, missing = lookup_promotions(parse_ids(ids.split(",")), include_archived)
+            headers = {"X-Total-Count": len(promotions), "X-Missing-Ids": ",".join(missing)}
+            return promotions, status.HTTP_200_OK, headers
+
+        filters = {key: value for key, value in args.items() if value is not None}
+        results = snapshot_lookup(filters, include_archived)
+        if results is not None:
+            app.logger.info("[%s] Promotions returned from the snapshot", len(results))
+            return results, status.HTTP_200_OK, {"X-Total-Count": len(results)}
+
+        code = filters.get("promotion_code")
+        if code is not None and not include_archived:
+            if negative_cache_excludes("promotion_code", code):
+                return [], status.HTTP_200_OK, {"X-Total-Count": 0}
+
+        # identical lists requested together share one query, which only
+        # writes to its products_type or promotion_code can make stale
+        key = ("list", include_archived, tuple(sorted(filters.items())))
+        tags = {(column, filters[column]) for column in ("products_type", "promotion_code") if column in filters}
+        results, total = reads.do(
+            key, lambda: list_promotions(filters, include_archived), wait_timeout(app), tags
+        )
+        app.logger.info("[%s] Promotions returned", len(results))
+        return results, status.HTTP_200_OK, {"X-Total-Count": total}
 
     # ------------------------------------------------------------------
     # ADD A NEW PROMOTION
@@ -212,15 +577,16 @@ class PromotionCollection(Resource):
     @api.response(400, "The posted data was not valid")
     @api.expect(create_model)
     @api.marshal_with(promotion_model, code=201)
+    @deadline("DEADLINE_WRITE_MS")
     def post(self):
         """
         Creates a promotion
         This endpoint will create a promotion based the data in the body that is posted
         """
         app.logger.info("Request to Create a promotion")
-        promotion = Promotion()
-        app.logger.debug("Payload = %s", api.payload)
-        promotion.deserialize(api.payload)
+        data = get_payload()
+        app.logger.debug("Payload = %s", data)
+        promotion = Promotion().apply(validate_promotion(data))
         promotion.create()
         app.logger.info("Promotion with new id [%s] created!", promotion.id)
         location_url = api.url_for(
@@ -233,6 +599,148 @@ class PromotionCollection(Resource):
         )
 
 
+######################################################################
+#  PATH: /promotions/lookup
+######################################################################
+@api.route("/promotions/lookup")
+class PromotionLookup(Resource):
+    """Returns many Promotions by id at once"""
+
+    @api.doc("lookup_promotions")
+    @api.response(400, "The posted ids were not valid")
+    @api.expect(lookup_create_model)
+    @api.marshal_with(lookup_model)
+    @deadline("DEADLINE_LIST_MS")
+    def post(self):
+        """
+        Look up Promotions by id
+
+        Returns the Promotions with the posted ids in a single query, in the
+        order of the ids, and lists the ids that were not found
+        """
+        app.logger.info("Request to Look up Promotions")
+        data = get_payload()
+        if not isinstance(data, dict) or "ids" not in data:
+            abort(status.HTTP_400_BAD_REQUEST, "The body must have a list of ids.")
+        ids = parse_ids(data["ids"])
+        try:  # like the include_archived argument of the other routes
+            include_archived = inputs.boolean(data.get("include_archived", False))
+        except ValueError as error:
+            abort(status.HTTP_400_BAD_REQUEST, f"include_archived: {error}")
+        promotions, missing = lookup_promotions(ids, include_archived)
+        return {"promotions": promotions, "missing": missing}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /promotions/count
+######################################################################
+@api.route("/promotions/count")
+class PromotionCount(Resource):
+    """Counts the Promotions in the collection"""
+
+    @api.doc("count_promotions")
+    @api.expect(count_args, validate=True)
+    @api.marshal_with(count_model)
+    @deadline("DEADLINE_LIST_MS")
+    def get(self):
+        """
+        Count the Promotions
+
+        This endpoint will count the promotions matching the same filters as
+        the list endpoint. With approximate=true an unfiltered count is read
+        from the planner statistics instead of scanning the table.
+        """
+        app.logger.info("Request to count Promotions...")
+        args = count_args.parse_args()
+        approximate = args.pop("approximate")
+        models = models_to_read(args.pop("include_archived"))
+        filters = {key: value for key, value in args.items() if value is not None}
+
+        count = None
+        if approximate and not filters:
+            estimates = [model.estimate_count() for model in models]
+            if None not in estimates:
+                count = sum(estimates)
+        if count is None:
+            approximate = False
+            count = sum(model.count(**filters) for model in models)
+
+        app.logger.info("Counted [%s] Promotions", count)
+        return {"count": count, "approximate": approximate}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /promotions/changes
+######################################################################
+@api.route("/promotions/changes")
+class PromotionChanges(Resource):
+    """The log of changes made to Promotions"""
+
+    @api.doc("list_promotion_changes")
+    @api.expect(changes_args, validate=True)
+    @api.marshal_with(changes_model)
+    @deadline("DEADLINE_LIST_MS")
+    def get(self):
+        """
+        List the changes to Promotions
+
+        This endpoint will return the changes logged after the since cursor
+        in the order they were made, one page at a time. Pass the returned
+        cursor as since to read the next page.
+        """
+        args = changes_args.parse_args()
+        app.logger.info("Request for changes since [%s]", args["since"])
+        page_size = app.config["CHANGES_PAGE_SIZE"]
+        limit = min(args["limit"] or page_size, page_size)
+
+        changes = PromotionChange.since(args["since"], limit + 1)
+        more = len(changes) > limit
+        changes = changes[:limit]
+        cursor = changes[-1].id if changes else args["since"]
+
+        app.logger.info("[%s] changes returned", len(changes))
+        results = [change.serialize() for change in changes]
+        return (
+            {"changes": results, "cursor": cursor, "more": more},
+            status.HTTP_200_OK,
+        )
+
+
+######################################################################
+#  PATH: /promotions/stream
+######################################################################
+@api.route("/promotions/stream")
+class PromotionStream(Resource):
+    """Pushes the changes to Promotions as they are committed"""
+
+    @api.doc("stream_promotion_changes")
+    @api.expect(stream_args, validate=True)
+    @api.produces(["text/event-stream"])
+    @api.response(503, "Too many subscribers")
+    def get(self):
+        """
+        Stream the changes to Promotions
+
+        This endpoint will push every change to Promotions as a Server-Sent
+        Event once it commits. The id of every event is its change cursor, so
+        a client that reconnects with Last-Event-ID misses nothing.
+        """
+        args = stream_args.parse_args()
+        cursor = args["Last-Event-ID"]
+        if cursor is None:
+            cursor = args["since"]
+        stream = app.extensions["change_stream"]
+        notifications.start()
+        if cursor is None:
+            cursor = stream.latest()
+        app.logger.info("Request to stream changes after [%s]", cursor)
+        return Response(
+            stream.subscribe(cursor),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
 ######################################################################
 #  PATH: /promotions/{id}/activate
 ######################################################################
@@ -244,6 +752,7 @@ class ActivateResource(Resource):
     @api.doc("activate_promotions")
     @api.response(404, "Promotion not found")
     @api.response(409, "The promotion is not available for activate")
+    @deadline("DEADLINE_WRITE_MS")
     def put(self, promotion_id):
         """
         Activate a Promotion
@@ -251,13 +760,7 @@ class ActivateResource(Resource):
         This endpoint will activate a promotion
         """
         app.logger.info("Request to activate a promotion")
-        promotion = Promotion.find(promotion_id)
-        if not promotion:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Promotion with id [{promotion_id}] was not found.",
-            )
-
+        promotion = find_promotion(promotion_id)
         promotion.activate()
         app.logger.info("Promotion with id [%s] activated.", promotion.id)
         return promotion.serialize(), status.HTTP_200_OK
@@ -274,6 +777,7 @@ class DeactivateResource(Resource):
     @api.doc("deactivate_promotions")
     @api.response(404, "Promotion not found")
     @api.response(409, "The promotion is not available for deactivate")
+    @deadline("DEADLINE_WRITE_MS")
     def put(self, promotion_id):
         """
         Deactivate a Promotion
@@ -281,13 +785,215 @@ class DeactivateResource(Resource):
         This endpoint will deactivate a promotion
         """
         app.logger.info("Request to deactivate a promotion")
-        promotion = Promotion.find(promotion_id)
-        if not promotion:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Promotion with id [{promotion_id}] was not found.",
-            )
-
+        promotion = find_promotion(promotion_id)
         promotion.deactivate()
         app.logger.info("Promotion with id [%s] deactivated.", promotion.id)
         return promotion.serialize(), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /diagnostics/metrics
+######################################################################
+@api.route("/diagnostics/metrics")
+class MetricsResource(Resource):
+    """Operational metrics of this worker"""
+
+    @api.doc("get_metrics")
+    def get(self):
+        """
+        Retrieve the metrics
+
+        This endpoint will return the counters, gauges and summaries kept by
+        the worker that handles the request
+        """
+        app.logger.info("Request for metrics")
+        return metrics.snapshot(), status.HTTP_200_OK
+
+
+slow_query_args = reqparse.RequestParser()
+slow_query_args.add_argument(
+    "limit",
+    type=inputs.positive,
+    location="args",
+    required=False,
+    default=20,
+    help="The most statements to return",
+)
+
+slow_query_model = api.model(
+    "SlowQuery",
+    {
+        "fingerprint": fields.String(description="The id of the normalized statement"),
+        "statement": fields.String(description="The statement without its values"),
+        "calls": fields.Integer(description="How many times it ran slowly"),
+        "total_ms": fields.Float(description="The time of all its slow runs"),
+        "mean_ms": fields.Float(description="The mean time of its slow runs"),
+        "max_ms": fields.Float(description="The time of its slowest run"),
+        "routes": fields.Raw(description="The slow runs of each route that ran it"),
+        "parameters": fields.Raw(description="The count and types of its parameters"),
+        "plan": fields.String(description="Its latest EXPLAIN (ANALYZE, BUFFERS)"),
+    },
+)
+
+
+######################################################################
+#  PATH: /diagnostics/slow-queries
+######################################################################
+@api.route("/diagnostics/slow-queries")
+class SlowQueryCollection(Resource):
+    """SQL statements that ran slowly in this worker"""
+
+    @api.doc("list_slow_queries")
+    @api.response(404, "The slow query log is off")
+    @api.expect(slow_query_args, validate=True)
+    @api.marshal_list_with(slow_query_model)
+    def get(self):
+        """
+        List the slow queries
+
+        This endpoint will return the statements that ran slower than the
+        threshold in the worker that handles the request, with the most
+        total time first
+        """
+        app.logger.info("Request for slow queries")
+        slow_queries = app.extensions.get("slow_queries")
+        if slow_queries is None:
+            abort(status.HTTP_404_NOT_FOUND, "The slow query log is off.")
+        args = slow_query_args.parse_args()
+        return slow_queries.top(args["limit"]), status.HTTP_200_OK
+
+
+profile_toggle_model = api.model(
+    "ProfileToggle",
+    {
+        "enabled": fields.Boolean(
+            required=True, description="Profile a sample of the requests?"
+        ),
+        "sample_rate": fields.Float(
+            description="The fraction of the requests to profile, from 0 to 1"
+        ),
+    },
+)
+
+profile_model = api.model(
+    "Profile",
+    {
+        "name": fields.String(description="The file name of the profile"),
+        "created": fields.String(description="When the request was profiled"),
+        "pid": fields.Integer(description="The worker process that served it"),
+        "method": fields.String(description="The HTTP method of the request"),
+        "endpoint": fields.String(description="The endpoint of the request"),
+        "size": fields.Integer(description="The size of the profile in bytes"),
+    },
+)
+
+profiles_model = api.model(
+    "Profiles",
+    {
+        "worker": fields.Integer(description="The worker process that answered"),
+        "enabled": fields.Boolean(description="Is sampling on in this worker?"),
+        "sample_rate": fields.Float(description="The fraction of requests sampled"),
+        "profiles": fields.List(
+            fields.Nested(profile_model), description="The saved profiles, newest first"
+        ),
+    },
+)
+
+# Checks the body of a profiling toggle
+validate_profile_toggle = Validator(profile_toggle_model)
+
+
+def active_profiler():
+    """Returns the request profiler, or aborts when profiling is off"""
+    profiler = app.extensions.get("profiler")
+    if profiler is None:
+        abort(status.HTTP_404_NOT_FOUND, "Profiling is not configured.")
+    return profiler
+
+
+def signed_profiler():
+    """Returns the request profiler, or aborts unless the request is signed"""
+    profiler = active_profiler()
+    if not profiler.is_signed():
+        abort(status.HTTP_403_FORBIDDEN, "A valid X-Profile-Signature is required.")
+    return profiler
+
+
+def profiler_state(profiler):
+    """Returns the sampling state of this worker and the saved profiles"""
+    return {
+        "worker": os.getpid(),
+        "enabled": profiler.enabled,
+        "sample_rate": profiler.sample_rate,
+        "profiles": profiler.profiles(),
+    }
+
+
+######################################################################
+#  PATH: /diagnostics/profiles
+######################################################################
+@api.route("/diagnostics/profiles")
+class ProfileCollection(Resource):
+    """Request profiles saved by the workers"""
+
+    @api.doc("list_profiles")
+    @api.response(403, "The request was not signed")
+    @api.response(404, "Profiling is not configured")
+    @api.marshal_with(profiles_model)
+    def get(self):
+        """
+        List the profiles
+
+        This endpoint needs an X-Profile-Signature for GET on its path, and
+        will return the saved request profiles, newest first, and whether
+        the worker that handles the request samples requests
+        """
+        app.logger.info("Request to list profiles")
+        return profiler_state(signed_profiler()), status.HTTP_200_OK
+
+    @api.doc("toggle_profiles")
+    @api.response(400, "The posted data was not valid")
+    @api.response(403, "The request was not signed")
+    @api.response(404, "Profiling is not configured")
+    @api.expect(profile_toggle_model)
+    @api.marshal_with(profiles_model)
+    def put(self):
+        """
+        Switch sampling on or off
+
+        This endpoint needs an X-Profile-Signature for PUT on its path, and
+        applies to every worker
+        """
+        app.logger.info("Request to toggle profiling")
+        profiler = signed_profiler()
+        values = validate_profile_toggle(get_payload())
+        profiler.broadcast(db.session, values.enabled, values.sample_rate)
+        db.session.commit()
+        app.logger.info("Profiling enabled=%s rate=%s", profiler.enabled, profiler.sample_rate)
+        return profiler_state(profiler), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /diagnostics/profiles/{name}
+######################################################################
+@api.route("/diagnostics/profiles/<name>")
+@api.param("name", "The file name of the profile")
+class ProfileResource(Resource):
+    """A saved request profile"""
+
+    @api.doc("get_profile")
+    @api.response(403, "The request was not signed")
+    @api.response(404, "Profile not found")
+    @api.produces(["application/octet-stream"])
+    def get(self, name):
+        """
+        Download a profile
+
+        This endpoint needs an X-Profile-Signature for GET on its path, and
+        will return the cProfile dump, which pstats and snakeviz can open
+        """
+        app.logger.info("Request for profile %s", name)
+        path = signed_profiler().path(name)
+        if not path:
+            abort(status.HTTP_404_NOT_FOUND, f"Profile [{name}] was not found.")
+        return send_file(path, mimetype="application/octet-stream", as_attachment=True)
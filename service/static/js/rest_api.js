@@ -284,7 +284,7 @@ $(function () {
           }
 
           if (name) {
-            appendQueryParam('name', name);
+            appendQueryParam('q', name);
           }
           
           if (productsType) {
@@ -0,0 +1,160 @@
+"""
+Test cases for Admission Control
+"""
+from unittest import TestCase
+from flask import Flask
+from service import config
+from service.common import status
+from service.common.admission import RateLimiter, init_admission
+from service.common.metrics import metrics
+
+BASE_URL = "/api/promotions"
+
+
+######################################################################
+#  R A T E   L I M I T E R   T E S T   C A S E S
+######################################################################
+class TestRateLimiter(TestCase):
+    """Token Bucket Tests"""
+
+    def test_burst_then_refill(self):
+        """It should admit a burst and then refill at the steady rate"""
+        limiter = RateLimiter(rate=2, burst=3)
+        for _ in range(3):
+            self.assertEqual(limiter.acquire("client", now=0), 0)
+        self.assertAlmostEqual(limiter.acquire("client", now=0), 0.5)
+        self.assertEqual(limiter.acquire("client", now=0.5), 0)
+
+    def test_clients_are_independent(self):
+        """It should keep a separate bucket for every client"""
+        limiter = RateLimiter(rate=1, burst=1)
+        self.assertEqual(limiter.acquire("first", now=0), 0)
+        self.assertGreater(limiter.acquire("first", now=0), 0)
+        self.assertEqual(limiter.acquire("second", now=0), 0)
+
+    def test_max_clients(self):
+        """It should forget the idlest clients beyond max_clients"""
+        limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+        for client in ("a", "b", "c"):
+            limiter.acquire(client, now=0)
+        self.assertEqual(limiter.acquire("a", now=0), 0)
+
+
+######################################################################
+#  A D M I S S I O N   T E S T   C A S E S
+######################################################################
+class TestAdmission(TestCase):
+    """Admission Control Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = self.create_client()
+        metrics.reset()
+
+    def create_client(self, **settings):
+        """Returns a test client of an app with admission control"""
+        app = Flask(__name__)
+        app.config.from_object(config)
+        app.config["RATE_LIMIT_PER_SECOND"] = 0.5
+        app.config["RATE_LIMIT_BURST"] = 1
+        app.config.update(settings)
+
+        @app.route("/health")
+        def health():
+            return "OK"
+
+        @app.route(BASE_URL, methods=["GET"])
+        def list_promotions():
+            return "[]"
+
+        @app.route(f"{BASE_URL}/lookup", methods=["POST"])
+        def lookup_promotions():
+            return "{}"
+
+        @app.route(f"{BASE_URL}/<promotion_id>", methods=["GET", "DELETE"])
+        def promotion(promotion_id):  # pylint: disable=unused-argument
+            return ""
+
+        self.admission = init_admission(app)
+        return app.test_client()
+
+    def test_rate_limited(self):
+        """It should answer 429 with Retry-After once the bucket is empty"""
+        response = self.client.get(f"{BASE_URL}/1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f"{BASE_URL}/1")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["admission.rejected.rate_limited"], 1)
+
+    def test_disabled(self):
+        """It should admit everything when admission control is disabled"""
+        self.client.application.config["ADMISSION_ENABLED"] = False
+        for _ in range(3):
+            response = self.client.get(f"{BASE_URL}/1")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_trusted_proxies(self):
+        """It should tell clients apart by the hop the trusted proxy appended"""
+        client = self.create_client(TRUSTED_PROXIES=1)
+        for address in ("10.0.0.1", "10.0.0.2"):
+            response = client.get(f"{BASE_URL}/1", headers={"X-Forwarded-For": address})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_spoofed_forwarded_for(self):
+        """It should not let a client pick its key with forged hops"""
+        client = self.create_client(TRUSTED_PROXIES=1)
+        for forged in ("1.1.1.1", "2.2.2.2"):
+            response = client.get(
+                f"{BASE_URL}/1", headers={"X-Forwarded-For": f"{forged}, 10.0.0.1"}
+            )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_untrusted_forwarded_for(self):
+        """It should ignore X-Forwarded-For when no proxy is trusted"""
+        for address in ("10.0.0.1", "10.0.0.2"):
+            response = self.client.get(
+                f"{BASE_URL}/1", headers={"X-Forwarded-For": address}
+            )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_overloaded(self):
+        """It should answer 503 with Retry-After when a route class is full"""
+        self.admission.limiter = None
+        slots = self.admission.slots["list"]
+        while slots.acquire(blocking=False):  # pylint: disable=consider-using-with
+            pass
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["admission.rejected.overloaded.list"], 1)
+
+        # reads have their own slots and still get through
+        response = self.client.get(f"{BASE_URL}/1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_lookup_is_a_list(self):
+        """It should admit lookups by id as lists rather than writes"""
+        self.admission.limiter = None
+        slots = self.admission.slots["list"]
+        while slots.acquire(blocking=False):  # pylint: disable=consider-using-with
+            pass
+        response = self.client.post(f"{BASE_URL}/lookup", json={"ids": [1]})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["admission.rejected.overloaded.list"], 1)
+
+    def test_slots_released(self):
+        """It should give the slot back when the request is done"""
+        self.admission.limiter = None
+        for _ in range(config.MAX_CONCURRENT_WRITES + 1):
+            response = self.client.delete(f"{BASE_URL}/1")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_exempt_routes(self):
+        """It should never limit the health check"""
+        for _ in range(3):
+            response = self.client.get("/health")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
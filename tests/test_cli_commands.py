@@ -2,10 +2,14 @@
 CLI Command Extensions for Flask
 """
 import os
+import time
+from datetime import date
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service import app
+from service.common.profiling import sign
+from service.common.cli_commands import db_create, profile_signature, promotions_archive
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +25,42 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.Promotion')
+    def test_promotions_archive(self, promotion_mock):
+        """It should archive expired promotions in batches"""
+        promotion_mock.archive_expired.return_value = iter([2, 2, 1])
+        result = self.runner.invoke(promotions_archive, ["--days", "0", "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Batch 3: archived 1 promotions", result.output)
+        self.assertIn("Archived 5 promotions", result.output)
+        before, batch_size = promotion_mock.archive_expired.call_args.args
+        self.assertEqual(before, date.today())
+        self.assertEqual(batch_size, 2)
+
+    @patch('service.common.cli_commands.Promotion')
+    def test_promotions_archive_max_batches(self, promotion_mock):
+        """It should stop archiving after --max-batches"""
+        promotion_mock.archive_expired.return_value = iter([2, 2, 1])
+        result = self.runner.invoke(promotions_archive, ["--max-batches", "1"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Archived 2 promotions", result.output)
+        self.assertNotIn("Batch 2", result.output)
+
+    def test_profile_signature(self):
+        """It should print the header that has a request profiled"""
+        with patch.dict(app.config, {"PROFILE_SECRET": "secret"}):
+            result = self.runner.invoke(profile_signature, ["get", "/api/promotions"])
+        self.assertEqual(result.exit_code, 0)
+        header, value = result.output.strip().split(": ")
+        self.assertEqual(header, "X-Profile-Signature")
+        expires = int(value.split(".")[0])
+        self.assertEqual(value, sign("secret", "GET", "/api/promotions", expires))
+        self.assertAlmostEqual(expires, time.time() + 600, delta=5)
+
+    def test_profile_signature_without_secret(self):
+        """It should not sign without a PROFILE_SECRET"""
+        with patch.dict(app.config, {"PROFILE_SECRET": ""}):
+            result = self.runner.invoke(profile_signature, ["GET", "/"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("PROFILE_SECRET is not set", result.output)
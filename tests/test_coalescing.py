@@ -0,0 +1,145 @@
+"""
+Test cases for Request Coalescing
+"""
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import Mock
+from service.common.coalescing import SingleFlight
+from service.common.invalidation import EVERYTHING, PUBLISHED
+from service.common.metrics import metrics
+
+
+def wait_for(condition, timeout=5):
+    """Waits until condition() is true"""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+######################################################################
+#  S I N G L E   F L I G H T   T E S T   C A S E S
+######################################################################
+class TestSingleFlight(TestCase):
+    """Single Flight Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.group = SingleFlight("test")
+        self.release = threading.Event()
+        self.calls = 0
+        metrics.reset()
+
+    def slow_call(self):
+        """Counts the call and returns once released"""
+        self.calls += 1
+        self.release.wait(5)
+        return ["result"]
+
+    def run_followers(self, count, function=None, tags=None):
+        """Calls the group from threads and returns their results and errors"""
+        outcomes = []
+
+        def follow():
+            try:
+                outcomes.append(self.group.do("key", function or self.slow_call, 5, tags))
+            except ValueError as error:
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=follow) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, outcomes
+
+    def counters(self):
+        """Returns the counters of the group"""
+        return metrics.snapshot()["counters"]
+
+    def test_coalesce_identical_calls(self):
+        """It should share one call among the identical calls in flight"""
+        threads, outcomes = self.run_followers(5)
+        wait_for(lambda: self.counters().get("coalesce.test.waits") == 4)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [["result"]] * 5)
+        self.assertEqual(self.counters()["coalesce.test.coalesced"], 4)
+        self.assertEqual(len(self.group), 0)
+
+    def test_different_keys(self):
+        """It should not coalesce calls with different keys"""
+        self.release.set()
+        self.assertEqual(self.group.do("a", self.slow_call, 1), ["result"])
+        self.assertEqual(self.group.do("b", self.slow_call, 1), ["result"])
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.counters()["coalesce.test.calls"], 2)
+
+    def test_follower_gives_up(self):
+        """It should run the call itself after waiting out its timeout"""
+        threads, _ = self.run_followers(1)
+        wait_for(lambda: self.calls == 1)
+        self.assertEqual(self.group.do("key", lambda: ["own"], 0.01), ["own"])
+        self.assertEqual(self.counters()["coalesce.test.timeouts"], 1)
+        self.release.set()
+        threads[0].join()
+
+    def test_leader_error(self):
+        """It should raise the error of the leader in its followers"""
+
+        def failing_call():
+            self.release.wait(5)
+            raise ValueError("database down")
+
+        threads, outcomes = self.run_followers(3, failing_call)
+        wait_for(lambda: self.counters().get("coalesce.test.waits") == 2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(outcomes), 3)
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+
+    def test_evict(self):
+        """It should start a new call after a write forgets the one in flight"""
+        threads, _ = self.run_followers(1)
+        wait_for(lambda: self.calls == 1)
+        self.assertEqual(self.group.evict(()), 0)
+        self.assertEqual(self.group.evict({("id", 1)}), 1)
+        self.assertEqual(self.group.do("key", lambda: ["fresh"], 5), ["fresh"])
+        self.release.set()
+        threads[0].join()
+        self.assertEqual(len(self.group), 0)
+
+    def test_evict_by_tags(self):
+        """It should forget only the calls that depend on the keys written"""
+        threads, _ = self.run_followers(1, tags={("products_type", "Toys")})
+        wait_for(lambda: self.calls == 1)
+        self.assertEqual(self.group.evict({("id", 1), ("products_type", "Books")}), 0)
+        self.assertEqual(len(self.group), 1)
+        self.assertEqual(self.group.evict({("products_type", "Toys")}), 1)
+        self.release.set()
+        threads[0].join()
+
+        self.release.clear()
+        threads, _ = self.run_followers(1, tags={("id", 1)})
+        wait_for(lambda: self.calls == 2)
+        self.assertEqual(self.group.evict({EVERYTHING}), 1)
+        self.release.set()
+        threads[0].join()
+
+    def test_after_commit(self):
+        """It should forget the calls on the keys the session published"""
+        threads, _ = self.run_followers(1, tags={("id", 1)})
+        wait_for(lambda: self.calls == 1)
+        session = Mock(info={})
+        self.group.after_commit(session)
+        self.assertEqual(len(self.group), 1)
+        session.info[PUBLISHED] = {("id", 2)}
+        self.group.after_rollback(session)
+        self.assertNotIn(PUBLISHED, session.info)
+        session.info[PUBLISHED] = {("id", 1)}
+        self.group.after_commit(session)
+        self.assertEqual(len(self.group), 0)
+        self.assertNotIn(PUBLISHED, session.info)
+        self.release.set()
+        threads[0].join()
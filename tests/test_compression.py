@@ -0,0 +1,113 @@
+"""
+Test cases for Response Compression
+"""
+import gzip
+import zlib
+from unittest import TestCase
+from flask import Flask, Response, jsonify
+from service.common import compression
+from service.common.compression import ENCODERS, init_compression
+
+PAYLOAD = [{"products_type": "Electronics", "description": "Holiday Sale"}] * 100
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Response Compression Tests"""
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config["COMPRESS_ALGORITHMS"] = "br,zstd,gzip"
+        app.config["COMPRESS_MIN_SIZE"] = 1024
+
+        @app.route("/large")
+        def large():
+            return jsonify(PAYLOAD)
+
+        @app.route("/small")
+        def small():
+            return jsonify(status="OK")
+
+        @app.route("/stream")
+        def stream():
+            return Response((f"data: {i}\n\n" for i in range(3)), mimetype="text/event-stream")
+
+        @app.route("/image")
+        def image():
+            return Response(b"x" * 2048, mimetype="image/png")
+
+        init_compression(app)
+        self.client = app.test_client()
+
+    def test_gzip_large_response(self):
+        """It should gzip a large response when the client accepts gzip"""
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        body = gzip.decompress(response.data)
+        self.assertLess(len(response.data), len(body))
+        self.assertEqual(int(response.headers["Content-Length"]), len(response.data))
+
+    def test_no_accept_encoding(self):
+        """It should not compress when the client does not ask for it"""
+        response = self.client.get("/large")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_json(), PAYLOAD)
+
+    def test_small_response(self):
+        """It should not compress a response below the size threshold"""
+        response = self.client.get("/small", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_json(), {"status": "OK"})
+
+    def test_incompressible_type(self):
+        """It should not compress media types that are already compressed"""
+        response = self.client.get("/image", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_preferred_encoding(self):
+        """It should pick the preferred encoding the client accepts"""
+        response = self.client.get(
+            "/large", headers={"Accept-Encoding": "gzip, deflate, br, zstd"}
+        )
+        expected = [name for name in ("br", "zstd", "gzip") if name in ENCODERS][0]
+        self.assertEqual(response.headers["Content-Encoding"], expected)
+
+    def test_quality_values(self):
+        """It should honor the quality values sent by the client"""
+        response = self.client.get(
+            "/large", headers={"Accept-Encoding": "br;q=0.1, zstd;q=0.1, gzip"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_streamed_response(self):
+        """It should compress a streamed response chunk by chunk"""
+        response = self.client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+        self.assertEqual(
+            gzip.decompress(response.data), b"data: 0\n\ndata: 1\n\ndata: 2\n\n"
+        )
+
+    def test_stream_flushes_each_chunk(self):
+        """It should make every chunk decodable as soon as it is sent"""
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = compression.compress_stream(ENCODERS["gzip"](), [b"one", b"two"])
+        self.assertEqual(decoder.decompress(next(chunks)), b"one")
+        self.assertEqual(decoder.decompress(next(chunks)), b"two")
+
+    def test_encoders_round_trip(self):
+        """It should produce output every available decoder can read"""
+        data = b"Electronics " * 500
+        for name, encoder_class in ENCODERS.items():
+            encoder = encoder_class()
+            encoded = encoder.compress(data) + encoder.flush() + encoder.finish()
+            if name == "br":
+                self.assertEqual(compression.brotli.decompress(encoded), data)
+            elif name == "zstd":
+                decoder = compression.zstandard.ZstdDecompressor().decompressobj()
+                self.assertEqual(decoder.decompress(encoded), data)
+            else:
+                self.assertEqual(gzip.decompress(encoded), data)
@@ -0,0 +1,99 @@
+"""
+Test cases for the gunicorn configuration
+"""
+import importlib.util
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+CONF_PATH = Path(__file__).resolve().parent.parent / "gunicorn.conf.py"
+
+
+def load_conf():
+    """Loads gunicorn.conf.py, which is not an importable module name"""
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+conf = load_conf()
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G   T E S T   C A S E S
+######################################################################
+class TestGunicornConf(TestCase):
+    """gunicorn Configuration Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        """Writes a fake cgroup file under the temporary root"""
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+
+    def test_cpu_limit_v2(self):
+        """It should read the CPU quota from cgroup v2"""
+        self.write("cpu.max", "50000 100000")
+        self.assertEqual(conf.cpu_limit(self.root), 0.5)
+
+    def test_cpu_limit_v1(self):
+        """It should read the CPU quota from cgroup v1"""
+        self.write("cpu/cpu.cfs_quota_us", "200000")
+        self.write("cpu/cpu.cfs_period_us", "100000")
+        self.assertEqual(conf.cpu_limit(self.root), 2.0)
+
+    def test_cpu_unlimited(self):
+        """It should fall back to the usable CPUs without a quota"""
+        self.write("cpu.max", "max 100000")
+        self.assertEqual(conf.cpu_limit(self.root), len(os.sched_getaffinity(0)))
+        os.remove(os.path.join(self.root, "cpu.max"))
+        self.assertEqual(conf.cpu_limit(self.root), len(os.sched_getaffinity(0)))
+
+    def test_memory_limit(self):
+        """It should read the memory limit from cgroup v2 and v1"""
+        self.write("memory/memory.limit_in_bytes", str(256 * 2**20))
+        self.assertEqual(conf.memory_limit_mb(self.root), 256)
+        self.write("memory.max", str(128 * 2**20))
+        self.assertEqual(conf.memory_limit_mb(self.root), 128)
+
+    def test_memory_unlimited(self):
+        """It should return None when memory is unlimited"""
+        self.assertIsNone(conf.memory_limit_mb(self.root))
+        self.write("memory.max", "max")
+        self.assertIsNone(conf.memory_limit_mb(self.root))
+        os.remove(os.path.join(self.root, "memory.max"))
+        self.write("memory/memory.limit_in_bytes", "9223372036854771712")
+        self.assertIsNone(conf.memory_limit_mb(self.root))
+
+    def test_worker_count(self):
+        """It should size the workers by worker class, CPUs and memory"""
+        self.assertEqual(conf.worker_count("sync", 2, None, 48), 5)
+        self.assertEqual(conf.worker_count("gthread", 2, None, 48), 2)
+        self.assertEqual(conf.worker_count("gthread", 0.5, None, 48), 1)
+        self.assertEqual(conf.worker_count("sync", 2, 128, 48), 2)
+        self.assertEqual(conf.worker_count("sync", 4, 32, 48), 1)
+
+    def test_worker_concurrency(self):
+        """It should tell the app how many requests a worker serves at once"""
+        self.assertEqual(conf.worker_concurrency("gthread", 4, 100), 4)
+        self.assertEqual(conf.worker_concurrency("sync", 1, 100), 1)
+        self.assertEqual(conf.worker_concurrency("gevent", 1, 100), 100)
+        self.assertTrue(os.environ["WORKER_CONCURRENCY"].isdigit())
+
+    def test_settings(self):
+        """It should recycle workers and give threads only to gthread"""
+        self.assertGreaterEqual(conf.workers, 1)
+        self.assertGreater(conf.max_requests, 0)
+        self.assertEqual(conf.threads, 4 if conf.worker_class == "gthread" else 1)
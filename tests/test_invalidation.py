@@ -0,0 +1,55 @@
+"""
+Test cases for Cache Invalidation
+"""
+from unittest import TestCase
+from unittest.mock import Mock
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from service.common.invalidation import EVERYTHING, PUBLISHED, InvalidationBus
+from service.common.metrics import metrics
+from service.common.notifications import Notifications
+
+
+######################################################################
+#  I N V A L I D A T I O N   B U S   T E S T   C A S E S
+######################################################################
+class TestInvalidationBus(TestCase):
+    """Invalidation Bus Tests with the in-process transport"""
+
+    def setUp(self):
+        """This runs before each test"""
+        transport = Notifications()
+        self.session = Session(create_engine("sqlite://"))
+        transport.watch(self.session)
+        self.bus = InvalidationBus(transport)
+        self.cache = self.bus.register(Mock())
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.session.close()
+
+    def test_invalidate_on_commit(self):
+        """It should evict the published keys once the write commits"""
+        self.session.execute(text("SELECT 1"))
+        self.bus.publish(self.session, {("id", 1), ("products_type", "Toys")})
+        self.assertEqual(self.session.info[PUBLISHED], {("id", 1), ("products_type", "Toys")})
+        self.cache.evict.assert_not_called()
+        self.session.commit()
+        self.cache.evict.assert_called_once_with({("id", 1), ("products_type", "Toys")})
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"]["invalidation.received"], 1)
+        self.assertEqual(snapshot["summaries"]["invalidation.lag_seconds"]["count"], 1)
+
+    def test_no_invalidation_on_rollback(self):
+        """It should keep the cached entries when the write rolls back"""
+        self.session.execute(text("SELECT 1"))
+        self.bus.publish(self.session, {("products_type", "Toys")})
+        self.session.rollback()
+        self.cache.evict.assert_not_called()
+
+    def test_resync(self):
+        """It should evict everything when the listener listens again"""
+        self.bus.resync()
+        self.cache.evict.assert_called_once_with({EVERYTHING})
+        self.assertEqual(metrics.snapshot()["counters"]["invalidation.resyncs"], 1)
@@ -0,0 +1,111 @@
+"""
+Test cases for the JSON Providers
+"""
+import uuid
+from datetime import date
+from decimal import Decimal
+from unittest import TestCase
+from flask import Flask, jsonify, request
+from flask_restx import Api, Resource
+from service.common.json_provider import PROVIDERS, StdlibJSONProvider, init_json
+
+DATA = {
+    "name": "Holiday Sale",
+    "start_date": date(2023, 11, 15),
+    "price": Decimal("9.99"),
+    "ref": uuid.UUID(int=1),
+}
+EXPECTED = {
+    "name": "Holiday Sale",
+    "start_date": "2023-11-15",
+    "price": "9.99",
+    "ref": "00000000-0000-0000-0000-000000000001",
+}
+
+
+######################################################################
+#  J S O N   P R O V I D E R   T E S T   C A S E S
+######################################################################
+class TestJSONProvider(TestCase):
+    """JSON Provider Tests"""
+
+    def _make_app(self, provider):
+        """Creates an app with a flask route and a flask-restx resource"""
+        app = Flask(__name__)
+        app.config["JSON_PROVIDER"] = provider
+        api = Api(app, prefix="/api")
+
+        @app.route("/plain", methods=["POST"])
+        def plain():
+            return jsonify(request.get_json())
+
+        @api.route("/echo")
+        class Echo(Resource):  # pylint: disable=unused-variable
+            """Echoes the payload back"""
+
+            def get(self):
+                """Returns the sample data"""
+                return DATA, 200, {"X-Total-Count": 1}
+
+            def post(self):
+                """Returns the posted data"""
+                return api.payload, 201
+
+        init_json(app, api)
+        return app
+
+    def test_auto_provider(self):
+        """It should pick orjson when it is installed"""
+        app = self._make_app("auto")
+        self.assertIsInstance(app.json, PROVIDERS.get("orjson", StdlibJSONProvider))
+
+    def test_unknown_provider(self):
+        """It should fall back to stdlib for an unknown provider"""
+        app = self._make_app("nope")
+        self.assertIsInstance(app.json, StdlibJSONProvider)
+
+    def test_providers_agree(self):
+        """It should encode the same way with every provider"""
+        for name in PROVIDERS:
+            client = self._make_app(name).test_client()
+            response = client.get("/api/echo")
+            self.assertEqual(response.status_code, 200, name)
+            self.assertEqual(response.content_type, "application/json", name)
+            self.assertEqual(response.headers["X-Total-Count"], "1", name)
+            self.assertEqual(response.get_json(), EXPECTED, name)
+
+    def test_decode_requests(self):
+        """It should decode request bodies with every provider"""
+        for name in PROVIDERS:
+            client = self._make_app(name).test_client()
+            response = client.post("/api/echo", json={"name": "Holiday Sale"})
+            self.assertEqual(response.status_code, 201, name)
+            self.assertEqual(response.get_json(), {"name": "Holiday Sale"}, name)
+            response = client.post("/plain", json=[1, 2])
+            self.assertEqual(response.get_json(), [1, 2], name)
+
+    def test_bad_json(self):
+        """It should reject a malformed request body with every provider"""
+        for name in PROVIDERS:
+            client = self._make_app(name).test_client()
+            response = client.post(
+                "/plain", data="{not json", content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400, name)
+
+    def test_not_serializable(self):
+        """It should refuse to encode unknown types with every provider"""
+        for name in PROVIDERS:
+            app = self._make_app(name)
+            self.assertRaises(TypeError, app.json.dumps, object())
+
+    def test_debug_and_sorted_output(self):
+        """It should indent in debug mode and sort keys on request"""
+        for name in PROVIDERS:
+            app = self._make_app(name)
+            app.debug = True
+            app.json.sort_keys = True
+            with app.app_context():
+                body = app.json.response({"b": 1, "a": 2}).get_data(as_text=True)
+            self.assertIn("\n", body.strip(), name)
+            self.assertLess(body.index('"a"'), body.index('"b"'), name)
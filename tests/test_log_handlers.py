@@ -0,0 +1,133 @@
+"""
+Test cases for the Log Handlers
+"""
+import io
+import json
+import logging
+import os
+from unittest import TestCase
+from flask import Flask
+from service import config
+from service.common.log_handlers import (
+    ListenerQueueHandler,
+    SamplingFilter,
+    init_logging,
+    parse_sample_rates,
+)
+from service.common.metrics import metrics
+
+
+######################################################################
+#  L O G G I N G   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Log Handlers Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.output = io.StringIO()
+        self.server_logger = logging.getLogger(f"test.server.{self.id()}")
+        self.server_logger.handlers = [logging.StreamHandler(self.output)]
+        self.server_logger.setLevel(logging.INFO)
+        self.app = Flask(f"test_{self._testMethodName}")
+        self.app.config.from_object(config)
+
+        @self.app.route("/hello")
+        def hello():
+            self.app.logger.info("Hello %s", "world")
+            logging.getLogger(f"{self.app.logger.name}.models").info("Loaded")
+            return "Hello"
+
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        for handler in self.app.logger.handlers:
+            handler.close()
+
+    def lines(self):
+        """Returns the lines logged so far"""
+        for handler in self.app.logger.handlers:
+            if isinstance(handler, ListenerQueueHandler) and handler.listener:
+                handler.listener.stop()  # writes out the queued records
+                handler.listener = None
+        return self.output.getvalue().splitlines()
+
+    def test_text(self):
+        """It should log text lines by default"""
+        init_logging(self.app, self.server_logger.name)
+        response = self.app.test_client().get("/hello")
+        self.assertEqual(len(response.headers["X-Request-ID"]), 32)
+        lines = self.lines()
+        self.assertIn("[INFO] [test_log_handlers] Hello world", lines[-2])
+
+    def test_json(self):
+        """It should log JSON records with the request id off the request thread"""
+        self.app.config["LOG_FORMAT"] = "json"
+        init_logging(self.app, self.server_logger.name)
+        handler = self.app.logger.handlers[0]
+        self.assertIsInstance(handler, ListenerQueueHandler)
+        response = self.app.test_client().get("/hello", headers={"X-Request-ID": "abc-123"})
+        self.assertEqual(response.headers["X-Request-ID"], "abc-123")
+        records = [json.loads(line) for line in self.lines()]
+        self.assertEqual(records[0]["message"], "Logging handler established")
+        self.assertIsNone(records[0]["request_id"])
+        hello = records[1]
+        self.assertEqual(hello["message"], "Hello world")
+        self.assertEqual(hello["level"], "INFO")
+        self.assertEqual(hello["request_id"], "abc-123")
+        self.assertEqual(records[2]["logger"], f"{self.app.logger.name}.models")
+
+    def test_json_exception(self):
+        """It should log the traceback of an exception in the record"""
+        self.app.config["LOG_FORMAT"] = "json"
+        init_logging(self.app, self.server_logger.name)
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            self.app.logger.exception("Failed")
+        record = json.loads(self.lines()[-1])
+        self.assertIn("ValueError: broken", record["exception"])
+
+    def test_sampling(self):
+        """It should keep only the sampled fraction of the info lines"""
+        self.app.config.update(LOG_FORMAT="json", LOG_SAMPLE_RATES=f"{self.app.logger.name}.models=0")
+        init_logging(self.app, self.server_logger.name)
+        self.app.test_client().get("/hello")
+        logging.getLogger(f"{self.app.logger.name}.models").warning("Kept")
+        messages = [json.loads(line)["message"] for line in self.lines()]
+        self.assertIn("Hello world", messages)
+        self.assertNotIn("Loaded", messages)
+        self.assertIn("Kept", messages)
+        self.assertEqual(metrics.snapshot()["counters"]["logging.sampled_out"], 1)
+
+    def test_sample_rates(self):
+        """It should apply the rate of the most specific logger"""
+        rates = parse_sample_rates(" flask.app=0.5, flask.app.models=0.1 ,other=7,")
+        self.assertEqual(rates, {"flask.app": 0.5, "flask.app.models": 0.1, "other": 1.0})
+        sampling = SamplingFilter(rates)
+        self.assertEqual(sampling.rate("flask.app.models.query"), 0.1)
+        self.assertEqual(sampling.rate("flask.app.routes"), 0.5)
+        self.assertEqual(sampling.rate("gunicorn.error"), 1.0)
+
+    def test_queue_full(self):
+        """It should drop records rather than wait when the queue is full"""
+        handler = ListenerQueueHandler([logging.StreamHandler(self.output)], maxsize=1)
+        handler._pid = os.getpid()  # pylint: disable=protected-access
+        record = logging.makeLogRecord({"msg": "queued", "levelno": logging.INFO})
+        handler.enqueue(record)
+        handler.enqueue(record)
+        self.assertEqual(metrics.snapshot()["counters"]["logging.dropped"], 1)
+
+    def test_listener_per_process(self):
+        """It should start a new listener in a forked process"""
+        handler = ListenerQueueHandler([logging.StreamHandler(self.output)], maxsize=10)
+        handler.handle(logging.makeLogRecord({"msg": "first", "levelno": logging.INFO}))
+        parent = handler.listener
+        handler._pid = -1  # pylint: disable=protected-access
+        handler.handle(logging.makeLogRecord({"msg": "second", "levelno": logging.INFO}))
+        self.assertIsNot(handler.listener, parent)
+        parent.stop()
+        handler.close()
+        # each listener writes on its own thread, so in either order
+        self.assertCountEqual(self.output.getvalue().splitlines(), ["first", "second"])
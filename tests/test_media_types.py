@@ -0,0 +1,30 @@
+"""
+Test cases for the MessagePack Media Type
+"""
+from datetime import date
+from unittest import TestCase
+import msgpack
+from service import app
+from service.common.media_types import output_msgpack
+
+
+######################################################################
+#  M E D I A   T Y P E   T E S T   C A S E S
+######################################################################
+class TestMediaTypes(TestCase):
+    """MessagePack Representation Tests"""
+
+    def test_output_msgpack(self):
+        """It should encode dates and keep the status code and headers"""
+        with app.test_request_context():
+            resp = output_msgpack(
+                {"start_date": date(2023, 11, 15)}, 201, {"X-Total-Count": 1}
+            )
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.headers["X-Total-Count"], "1")
+        self.assertEqual(msgpack.unpackb(resp.data), {"start_date": "2023-11-15"})
+
+    def test_output_msgpack_not_serializable(self):
+        """It should refuse to encode unknown types"""
+        with app.test_request_context():
+            self.assertRaises(TypeError, output_msgpack, {"data": object()}, 200)
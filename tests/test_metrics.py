@@ -0,0 +1,42 @@
+"""
+Test cases for the Metrics registry
+"""
+from unittest import TestCase
+from service.common.metrics import Metrics
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(TestCase):
+    """Metrics Registry Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.metrics = Metrics()
+
+    def test_counters_and_gauges(self):
+        """It should add to counters and keep the latest gauge value"""
+        self.metrics.increment("requests")
+        self.metrics.increment("requests", 2)
+        self.metrics.set("pool.size", 5)
+        self.metrics.set("pool.size", 3)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot["counters"], {"requests": 3})
+        self.assertEqual(snapshot["gauges"], {"pool.size": 3})
+
+    def test_summaries(self):
+        """It should summarize observations by count, total and max"""
+        for value in (0.5, 2.0, 1.0):
+            self.metrics.observe("latency", value)
+        summary = self.metrics.snapshot()["summaries"]["latency"]
+        self.assertEqual(summary, {"count": 3, "total": 3.5, "max": 2.0})
+
+    def test_reset(self):
+        """It should clear every metric"""
+        self.metrics.increment("requests")
+        self.metrics.observe("latency", 1)
+        self.metrics.reset()
+        self.assertEqual(
+            self.metrics.snapshot(), {"counters": {}, "gauges": {}, "summaries": {}}
+        )
@@ -0,0 +1,213 @@
+"""
+Test cases for the Negative Cache
+"""
+import logging
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.models import db, Promotion, PromotionChange
+from service.common.invalidation import EVERYTHING
+from service.common.metrics import metrics
+from service.common.negative_cache import BloomFilter, NegativeCache
+from tests.factories import PromotionFactory
+
+
+######################################################################
+#  B L O O M   F I L T E R   T E S T   C A S E S
+######################################################################
+class TestBloomFilter(TestCase):
+    """Bloom Filter Tests"""
+
+    def test_no_false_negatives(self):
+        """It should contain every value that was added"""
+        bloom = BloomFilter(1000, 0.01)
+        values = [f"id:{number}" for number in range(1000)]
+        for value in values:
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in values))
+        self.assertEqual(bloom.count, 1000)
+
+    def test_false_positive_rate(self):
+        """It should stay near the error rate it was sized for"""
+        bloom = BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom.add(f"id:{number}")
+        false_positives = sum(f"code:{number}" in bloom for number in range(10000))
+        self.assertLess(false_positives / 10000, 0.03)
+        self.assertAlmostEqual(bloom.false_positive_rate(), 0.01, delta=0.005)
+
+    def test_empty(self):
+        """It should contain nothing when empty"""
+        bloom = BloomFilter(0, 0.01)
+        self.assertNotIn("id:1", bloom)
+        self.assertEqual(bloom.false_positive_rate(), 0)
+
+
+######################################################################
+#  N E G A T I V E   C A C H E   T E S T   C A S E S
+######################################################################
+class TestNegativeCache(TestCase):
+    """Negative Cache Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        # the service created the tables when it was imported
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Promotion).delete()  # clean up the last tests
+        db.session.query(PromotionChange).delete()
+        db.session.commit()
+        self.cache = NegativeCache(app)
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def rebuilt(self):
+        """Rebuilds the filter on its thread and waits for it"""
+        self.cache.rebuild_if_due()
+        self.cache.rebuilder.join()
+
+    def test_excludes_unknown_values(self):
+        """It should exclude only the ids and codes that do not exist"""
+        promotion = PromotionFactory(require_code=True, promotion_code="SAVE10")
+        promotion.create()
+        self.rebuilt()
+        self.assertFalse(self.cache.excludes("id", promotion.id))
+        self.assertTrue(self.cache.excludes("id", promotion.id - 1))
+        self.assertFalse(self.cache.excludes("id", promotion.id + 1))  # may be new
+        self.assertFalse(self.cache.excludes("promotion_code", "SAVE10"))
+        self.assertTrue(self.cache.excludes("promotion_code", "GUESS"))
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["negative_cache.hits"], 2)
+        self.assertEqual(counters["negative_cache.rebuilds"], 1)
+        self.assertIn("negative_cache.rebuild_seconds", metrics.snapshot()["summaries"])
+        self.assertIn("negative_cache.false_positive_rate", metrics.snapshot()["gauges"])
+
+    def test_stream_rows(self):
+        """It should read the table in batches into the filter"""
+        promotions = [PromotionFactory(require_code=True, promotion_code=f"CODE{n}") for n in range(5)]
+        for promotion in promotions:
+            promotion.create()
+        with patch("service.common.negative_cache.BATCH_SIZE", 2):
+            self.cache.rebuild()
+        for promotion in promotions:
+            self.assertFalse(self.cache.excludes("id", promotion.id))
+            self.assertFalse(self.cache.excludes("promotion_code", promotion.promotion_code))
+        self.assertEqual(self.cache.max_id, promotions[-1].id)
+
+    def test_answer_while_rebuilding(self):
+        """It should keep answering from the old filter during a rebuild"""
+        self.cache.rebuild()
+        self.cache.built_at = None
+        started, finish = threading.Event(), threading.Event()
+        real_rebuild = self.cache.rebuild
+
+        def slow_rebuild():
+            started.set()
+            finish.wait(timeout=5)
+            real_rebuild()
+
+        with patch.object(self.cache, "rebuild", side_effect=slow_rebuild):
+            self.assertTrue(self.cache.excludes("promotion_code", "GUESS"))
+            started.wait(timeout=5)
+            self.assertTrue(self.cache.excludes("promotion_code", "GUESS"))  # one rebuild at a time
+            finish.set()
+            self.cache.rebuilder.join()
+        self.assertEqual(metrics.snapshot()["counters"]["negative_cache.rebuilds"], 2)
+
+    def test_own_writes(self):
+        """It should add the keys of this worker's writes when they commit"""
+        cache = app.extensions["negative_cache"]  # the one watching the session
+        cache.rebuild()
+        promotion = PromotionFactory(require_code=True, promotion_code="FRESH")
+        promotion.create()
+        self.assertFalse(cache.excludes("promotion_code", "FRESH"))
+        self.assertFalse(cache.excludes("id", promotion.id))
+        db.session.add(PromotionFactory(require_code=True, promotion_code="UNDONE"))
+        db.session.flush()
+        db.session.rollback()
+        self.assertTrue(cache.excludes("promotion_code", "UNDONE"))
+
+    def test_add_written_keys(self):
+        """It should add the keys of every write between rebuilds"""
+        self.cache.rebuild()
+        self.assertTrue(self.cache.excludes("promotion_code", "NEW"))
+        self.cache.evict({("promotion_code", "NEW"), ("id", 41), ("products_type", "Toys")})
+        self.assertFalse(self.cache.excludes("promotion_code", "NEW"))
+        self.assertEqual(self.cache.max_id, 41)
+        self.assertTrue(self.cache.excludes("id", 40))
+
+    def test_catch_up_with_change_log(self):
+        """It should not exclude a code written elsewhere before its invalidation"""
+        self.cache.rebuild()
+        self.assertIsNotNone(self.cache.cursor)
+        promotion = PromotionFactory(require_code=True, promotion_code="ELSEWHERE")
+        promotion.create()  # this cache is not told of the write
+        self.assertFalse(self.cache.excludes("promotion_code", "ELSEWHERE"))
+        self.assertTrue(self.cache.excludes("promotion_code", "GUESS"))
+        self.assertEqual(self.cache.cursor, PromotionChange.latest())
+        self.assertEqual(metrics.snapshot()["counters"]["negative_cache.catch_ups"], 1)
+
+    def test_too_far_behind(self):
+        """It should not exclude codes until a rebuild after a bulk load or a long gap"""
+        self.cache.rebuild()
+        PromotionChange.record_reload()
+        db.session.commit()
+        self.assertFalse(self.cache.excludes("promotion_code", "GUESS"))
+        self.assertIsNone(self.cache.cursor)
+        self.assertFalse(self.cache.excludes("promotion_code", "GUESS"))
+        self.cache.rebuilder.join()
+        self.assertTrue(self.cache.excludes("promotion_code", "GUESS"))
+
+        for code in ("FIRST", "SECOND"):
+            PromotionFactory(require_code=True, promotion_code=code).create()
+        with patch("service.common.negative_cache.CATCH_UP_LIMIT", 1):
+            self.assertFalse(self.cache.excludes("promotion_code", "GUESS"))
+        self.assertIsNone(self.cache.cursor)
+        self.cache.rebuilder.join()
+        self.assertTrue(self.cache.excludes("promotion_code", "GUESS"))
+        self.assertFalse(self.cache.excludes("promotion_code", "SECOND"))
+
+    def test_rebuild_when_due(self):
+        """It should rebuild after bulk writes and when the interval passed"""
+        self.cache.rebuild()
+        self.cache.evict({EVERYTHING})
+        self.assertIsNone(self.cache.built_at)
+        self.rebuilt()
+        with patch.dict(app.config, {"NEGATIVE_CACHE_REBUILD_SECONDS": 0}):
+            self.rebuilt()
+        self.assertEqual(metrics.snapshot()["counters"]["negative_cache.rebuilds"], 3)
+
+    def test_keys_written_during_rebuild(self):
+        """It should keep the keys written while the table was read"""
+
+        def estimate_count():
+            self.cache.evict({("promotion_code", "RACE")})
+            return 0
+
+        with patch.object(Promotion, "estimate_count", side_effect=estimate_count):
+            self.cache.rebuild()
+        self.assertFalse(self.cache.excludes("promotion_code", "RACE"))
+
+    def test_rebuild_fails(self):
+        """It should keep answering from the database when it cannot rebuild"""
+        with patch.object(self.cache, "rebuild", side_effect=RuntimeError("down")):
+            self.assertFalse(self.cache.excludes("id", 1))
+            self.cache.rebuilder.join()
+            self.rebuilt()  # the failed rebuild let go of its lock
+        self.assertIsNone(self.cache.filter)
+
+    def test_false_positives(self):
+        """It should count only the misses the filter let through"""
+        self.cache.record_false_positive("id", 1)
+        self.cache.rebuild()
+        self.cache.record_false_positive("id", 1)
+        self.cache.record_false_positive("promotion_code", "GUESS")
+        self.assertEqual(metrics.snapshot()["counters"]["negative_cache.false_positives"], 1)
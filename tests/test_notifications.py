@@ -0,0 +1,121 @@
+"""
+Test cases for Notifications
+"""
+import threading
+from unittest import TestCase
+from unittest.mock import Mock
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from service.common.invalidation import EVERYTHING, InvalidationBus
+from service.common.notifications import Notifications
+from tests.database import DATABASE_URI
+
+LISTENER = "notifications-test"  # application_name of the listener's connection
+
+
+######################################################################
+#  N O T I F I C A T I O N S   T E S T   C A S E S
+######################################################################
+class TestNotifications(TestCase):
+    """In-process Notification Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.notifications = Notifications()
+        self.session = Session(create_engine("sqlite://"))
+        self.notifications.watch(self.session)
+        self.received = []
+        self.notifications.subscribe("changes", self.received.append)
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.session.close()
+
+    def test_delivered_on_commit(self):
+        """It should deliver notifications once the transaction commits"""
+        self.session.execute(text("SELECT 1"))
+        for payload in ("1", "1", "2"):
+            self.notifications.publish(self.session, "changes", payload)
+        self.assertEqual(self.received, [])
+        self.session.commit()
+        self.assertEqual(self.received, ["1", "2"])
+
+    def test_dropped_on_rollback(self):
+        """It should drop the notifications of a rolled back transaction"""
+        self.session.execute(text("SELECT 1"))
+        self.notifications.publish(self.session, "changes", "1")
+        self.session.rollback()
+        self.session.commit()
+        self.assertEqual(self.received, [])
+
+    def test_failing_handler(self):
+        """It should keep dispatching when a handler fails"""
+        self.notifications.subscribe("changes", lambda payload: 1 / 0)
+        self.notifications.subscribe("changes", self.received.append)
+        self.notifications.dispatch("changes", "1")
+        self.assertEqual(self.received, ["1", "1"])
+
+    def test_no_listener_without_postgres(self):
+        """It should not start a Postgres listener on other databases"""
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        SQLAlchemy(app)
+        self.notifications.app = app
+        self.notifications.start()
+        self.notifications.start()
+        self.assertFalse(self.notifications.listening)
+
+
+######################################################################
+#  P O S T G R E S   L I S T E N E R   T E S T   C A S E S
+######################################################################
+class TestListener(TestCase):
+    """Postgres Listener Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "connect_args": {"application_name": LISTENER}
+        }
+        self.database = SQLAlchemy(app)
+        with app.app_context():
+            if self.database.engine.dialect.name != "postgresql":
+                self.skipTest("LISTEN needs Postgres")
+        self.app = app
+        self.notifications = Notifications()
+        self.notifications.app = app
+        self.notifications.RECONNECT_DELAY = 0.01
+        self.bus = InvalidationBus(self.notifications)
+        self.cache = self.bus.register(Mock())
+        self.listened = threading.Event()
+        self.notifications.on_listen(self.listened.set)
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.notifications._pid = None  # pylint: disable=protected-access
+        with self.app.app_context():
+            self.database.engine.dispose()
+
+    def test_resync_after_reconnect(self):
+        """It should evict every cache when it listens again after losing its connection"""
+        self.notifications.start()
+        self.assertTrue(self.listened.wait(timeout=5))
+        self.listened.clear()
+        self.cache.evict.reset_mock()
+
+        # the notifications sent while it reconnects are lost
+        with self.app.app_context():
+            self.database.session.execute(
+                text(
+                    "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                    "WHERE application_name = :name AND pid != pg_backend_pid()"
+                ),
+                {"name": LISTENER},
+            )
+            self.database.session.commit()
+        self.assertTrue(self.listened.wait(timeout=5))
+        self.cache.evict.assert_called_once_with({EVERYTHING})
@@ -0,0 +1,170 @@
+"""
+Test cases for Request Profiling
+"""
+import os
+import pstats
+import sys
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from service import config
+from service.common.metrics import metrics
+from service.common.notifications import Notifications
+from service.common.profiling import (
+    PROFILE_ID_HEADER,
+    SIGNATURE_HEADER,
+    Profiler,
+    init_profiling,
+    sign,
+)
+
+
+######################################################################
+#  P R O F I L I N G   T E S T   C A S E S
+######################################################################
+class TestProfiling(TestCase):
+    """Request Profiling Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.app = Flask(__name__)
+        self.app.config.from_object(config)
+        self.app.config.update(
+            PROFILE_DIR=self.directory.name, PROFILE_SECRET="secret", PROFILE_MAX_FILES=3
+        )
+
+        @self.app.route("/hello")
+        def hello():
+            return "Hello"
+
+        @self.app.route("/fail")
+        def fail():
+            raise RuntimeError("broken")
+
+        self.client = self.app.test_client()
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.directory.cleanup()
+
+    def signed(self, path="/hello", expires=None):
+        """Returns the headers of a signed GET of the path"""
+        expires = expires or time.time() + 60
+        return {SIGNATURE_HEADER: sign("secret", "GET", path, expires)}
+
+    def test_off_without_directory(self):
+        """It should install nothing without a PROFILE_DIR"""
+        self.app.config["PROFILE_DIR"] = ""
+        self.assertIsNone(init_profiling(self.app))
+        self.assertIsNone(self.app.extensions["profiler"])
+        self.assertEqual(dict(self.app.before_request_funcs), {})
+
+    def test_signed_request(self):
+        """It should profile a signed request into the directory"""
+        profiler = init_profiling(self.app)
+        self.assertNotIn(PROFILE_ID_HEADER, self.client.get("/hello").headers)
+        response = self.client.get("/hello", headers=self.signed())
+        self.assertEqual(response.status_code, 200)
+        name = response.headers[PROFILE_ID_HEADER]
+        self.assertTrue(name.endswith(f"-{os.getpid()}-GET-hello.prof"))
+        stats = pstats.Stats(profiler.path(name))
+        self.assertTrue(any(function[2] == "hello" for function in stats.stats))
+        profiles = profiler.profiles()
+        self.assertEqual([profile["name"] for profile in profiles], [name])
+        self.assertEqual(profiles[0]["endpoint"], "hello")
+        self.assertEqual(metrics.snapshot()["counters"]["profiling.captured"], 1)
+
+    def test_bad_signatures(self):
+        """It should not profile requests with an expired or forged signature"""
+        init_profiling(self.app)
+        for headers in (
+            self.signed(expires=time.time() - 1),
+            self.signed(path="/other"),
+            {SIGNATURE_HEADER: "garbage"},
+            {SIGNATURE_HEADER: f"{int(time.time()) + 60}.{'0' * 64}"},
+        ):
+            response = self.client.get("/hello", headers=headers)
+            self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+        self.app.extensions["profiler"].secret = ""
+        response = self.client.get("/hello", headers=self.signed())
+        self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+
+    def test_sampling(self):
+        """It should profile the sampled fraction once it is switched on"""
+        profiler = init_profiling(self.app)
+        self.assertFalse(profiler.enabled)
+        profiler.toggle(True, 5)
+        self.assertEqual(profiler.sample_rate, 1.0)
+        self.assertIn(PROFILE_ID_HEADER, self.client.get("/hello").headers)
+        profiler.toggle(True, 0)
+        self.assertNotIn(PROFILE_ID_HEADER, self.client.get("/hello").headers)
+        profiler.toggle(False)
+        self.assertFalse(profiler.enabled)
+
+    def test_broadcast(self):
+        """It should switch sampling in every worker once the switch commits"""
+        bus = Notifications()
+        session = Session(create_engine("sqlite://"))
+        bus.watch(session)
+        workers = [Profiler(self.app, bus), Profiler(self.app, bus)]
+        workers[0].broadcast(session, True, 0.5)
+        self.assertTrue(workers[0].enabled)
+        self.assertFalse(workers[1].enabled)
+        session.commit()
+        self.assertTrue(workers[1].enabled)
+        self.assertEqual(workers[1].sample_rate, 0.5)
+        workers[1].broadcast(session, False)
+        session.commit()
+        self.assertFalse(workers[0].enabled)
+        self.assertEqual(workers[0].sample_rate, 0.5)
+        session.close()
+
+    def test_exempt(self):
+        """It should not profile the requests under the exempt path"""
+        init_profiling(self.app, exempt="/hello")
+        response = self.client.get("/hello", headers=self.signed())
+        self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_rotation(self):
+        """It should keep only the newest profiles"""
+        profiler = init_profiling(self.app)
+        names = [
+            self.client.get("/hello", headers=self.signed()).headers[PROFILE_ID_HEADER]
+            for _ in range(5)
+        ]
+        self.assertEqual(profiler.names(), names[:1:-1])
+        self.assertEqual(len(os.listdir(self.directory.name)), 3)
+
+    def test_failed_request(self):
+        """It should stop the profile of a request that raised"""
+        self.app.config["PROPAGATE_EXCEPTIONS"] = True
+        profiler = init_profiling(self.app)
+        with patch.object(profiler, "save") as save:
+            with self.assertRaises(RuntimeError):
+                self.client.get("/fail", headers=self.signed("/fail"))
+        save.assert_not_called()
+        self.assertIsNone(sys.getprofile())
+
+    def test_save_fails(self):
+        """It should answer the request when the profile cannot be saved"""
+        profiler = init_profiling(self.app)
+        with patch("os.replace", side_effect=OSError("disk full")):
+            response = self.client.get("/hello", headers=self.signed())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+        self.assertEqual(os.listdir(self.directory.name), [])
+        self.assertEqual(metrics.snapshot()["counters"]["profiling.errors"], 1)
+        self.assertEqual(profiler.profiles(), [])
+
+    def test_path(self):
+        """It should only return the paths of saved profiles"""
+        profiler = Profiler(self.app)
+        self.assertIsNone(profiler.path("../etc/passwd"))
+        self.assertIsNone(profiler.path("1-2-GET-hello.prof"))
@@ -0,0 +1,152 @@
+"""
+Test cases for Seeding
+"""
+import csv
+import io
+import logging
+import os
+import tempfile
+from collections import Counter
+from datetime import date
+from unittest import TestCase
+from click.testing import CliRunner
+from service import app
+from service.models import db, Promotion, PromotionChange
+from service.common.cli_commands import promotions_seed
+from service.common.invalidation import EVERYTHING
+from service.common.seeding import COLUMNS, SeedSpec, chunks, generate, generate_chunk, generate_csv
+from service.common.snapshot import SnapshotStore
+
+
+######################################################################
+#  G E N E R A T O R   T E S T   C A S E S
+######################################################################
+class TestGenerate(TestCase):
+    """Synthetic Promotion Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.spec = SeedSpec(
+            products_types=("Toys", "clothing", "Electronics"),
+            type_skew=2.0,
+            code_ratio=0.25,
+            active_ratio=0.75,
+            start_from=date(2020, 1, 1),
+            start_to=date(2020, 12, 31),
+            max_days=10,
+        )
+
+    def test_distribution(self):
+        """It should follow the skew, ratios and date spreads asked for"""
+        rows = [dict(zip(COLUMNS, row)) for row in generate(self.spec, 5000, seed=1)]
+        types = Counter(row["products_type"] for row in rows)
+        self.assertEqual([name for name, _ in types.most_common()], ["Toys", "clothing", "Electronics"])
+        self.assertAlmostEqual(types["Toys"] / 5000, 1 / (1 + 1 / 4 + 1 / 9), delta=0.03)
+        self.assertAlmostEqual(sum(row["require_code"] for row in rows) / 5000, 0.25, delta=0.03)
+        self.assertAlmostEqual(sum(row["is_active"] for row in rows) / 5000, 0.75, delta=0.03)
+        for row in rows:
+            self.assertEqual(row["promotion_code"] is not None, row["require_code"])
+            self.assertTrue(date(2020, 1, 1) <= row["start_date"] <= date(2020, 12, 31))
+            self.assertTrue(0 <= (row["end_date"] - row["start_date"]).days <= 10)
+
+    def test_uniform(self):
+        """It should spread the products types evenly without skew"""
+        self.assertEqual(SeedSpec(type_skew=0).type_weights(), [1.0, 1.0, 1.0, 1.0])
+
+    def test_reproducible(self):
+        """It should generate the same rows from the same seed"""
+        self.assertEqual(generate(self.spec, 10, seed=3), generate(self.spec, 10, seed=3))
+        self.assertNotEqual(generate(self.spec, 10, seed=3), generate(self.spec, 10, seed=4))
+
+    def test_csv(self):
+        """It should write rows as CSV for COPY, with NULL as an empty field"""
+        rows = generate(self.spec, 20, seed=5)
+        lines = list(csv.reader(io.StringIO(generate_csv(self.spec, 20, seed=5))))
+        self.assertEqual(len(lines), 20)
+        for row, line in zip(rows, lines):
+            self.assertEqual(line[3], row[3] or "")
+            self.assertEqual(line[4], "t" if row[4] else "f")
+            self.assertEqual(line[5], row[5].isoformat())
+        first = generate(self.spec, 2, seed=5)[0]
+        self.assertEqual(generate_chunk((self.spec, 2, 5, False))[0], dict(zip(COLUMNS, first)))
+
+    def test_chunks(self):
+        """It should split the rows into batches with their own seeds"""
+        sizes = list(chunks(25, 10, seed=1))
+        self.assertEqual([size for size, _ in sizes], [10, 10, 5])
+        self.assertEqual(len({chunk_seed for _, chunk_seed in sizes}), 3)
+
+
+######################################################################
+#  S E E D   C O M M A N D   T E S T   C A S E S
+######################################################################
+class TestSeedCommand(TestCase):
+    """promotions-seed Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        # the service created the tables when it was imported
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Promotion).delete()  # clean up the last tests
+        db.session.query(PromotionChange).delete()
+        db.session.commit()
+        self.runner = CliRunner()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.query(Promotion).delete()
+        db.session.query(PromotionChange).delete()
+        db.session.commit()
+        db.session.remove()
+
+    def test_seed(self):
+        """It should add the promotions in batches and report the rate"""
+        result = self.runner.invoke(
+            promotions_seed,
+            ["--count", "45", "--batch-size", "20", "--workers", "1", "--seed", "9",
+             "--products-types", "Toys,clothing", "--active-ratio", "1", "--start-to", "2020-01-01"],
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertRegex(result.output, r"Seeded 45 promotions in .*rows/second \(writer=\w+, workers=1, seed=9\)")
+        promotions = Promotion.all()
+        self.assertEqual(len(promotions), 45)
+        self.assertTrue(all(promotion.is_active for promotion in promotions))
+        self.assertEqual({promotion.products_type for promotion in promotions} - {"Toys", "clothing"}, set())
+        for promotion in promotions:
+            self.assertEqual(Promotion.rule_violations(promotion), {})
+
+    def test_seed_without_products_types(self):
+        """It should not seed without a products type to pick from"""
+        for products_types in ("", ",", " , "):
+            result = self.runner.invoke(promotions_seed, ["--count", "1", "--products-types", products_types])
+            self.assertEqual(result.exit_code, 2, result.output)
+            self.assertIn("must name at least one products type", result.output)
+        self.assertEqual(Promotion.all(), [])
+
+    def test_seed_in_parallel(self):
+        """It should generate the batches in several processes"""
+        result = self.runner.invoke(promotions_seed, ["--count", "30", "--batch-size", "7", "--workers", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("workers=2", result.output)
+        self.assertEqual(len(Promotion.all()), 30)
+
+    def test_reload_snapshot(self):
+        """It should log a reload so that the snapshot picks the rows up"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = SnapshotStore(app, os.path.join(directory, "promotions.snapshot"))
+            store.rebuild()
+            self.assertEqual(len(store.current()), 0)
+            result = self.runner.invoke(
+                promotions_seed, ["--count", "5", "--workers", "1", "--active-ratio", "1"]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(PromotionChange.query.one().operation, PromotionChange.RELOAD)
+            store.evict({EVERYTHING})
+            self.assertIsNone(store.current())  # behind the log, so rebuilding
+            store.rebuilder.join()
+            self.assertEqual(len(store.current()), 5)
@@ -0,0 +1,195 @@
+"""
+Test cases for the Slow Query Log
+"""
+import logging
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import create_engine, text
+from service import app
+from service.models import db
+from service.common.metrics import metrics
+from service.common.slow_queries import (
+    SlowQueryLog,
+    fingerprint,
+    init_slow_queries,
+    is_plain_read,
+    normalize,
+    parameter_shape,
+)
+
+
+######################################################################
+#  N O R M A L I Z A T I O N   T E S T   C A S E S
+######################################################################
+class TestNormalize(TestCase):
+    """Statement Normalization Tests"""
+
+    def test_normalize(self):
+        """It should replace values, parameters and IN lists"""
+        self.assertEqual(
+            normalize(
+                "SELECT promotion.id\n  FROM promotion WHERE name = 'it''s'"
+                " AND id IN (%(ids_1_1)s, %(ids_1_2)s) AND price > -1.5 AND x = :x"
+                " AND y = $1 AND z = %s AND t::text = ?"
+            ),
+            "SELECT promotion.id FROM promotion WHERE name = ? AND id IN (?, ...)"
+            " AND price > ? AND x = ? AND y = ? AND z = ? AND t::text = ?",
+        )
+
+    def test_fingerprint(self):
+        """It should give statements that differ only in values one fingerprint"""
+        first = fingerprint(normalize("SELECT * FROM promotion WHERE id IN (1, 2)"))
+        second = fingerprint(normalize("SELECT *  FROM promotion WHERE id IN (3, 4, 5)"))
+        other = fingerprint(normalize("SELECT * FROM promotion WHERE name = 'a'"))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(len(first), 16)
+
+    def test_parameter_shape(self):
+        """It should describe parameters by count and type only"""
+        self.assertEqual(
+            parameter_shape({"name": "secret", "id": 1, "other": "x"}),
+            {"count": 3, "types": ["int", "str"]},
+        )
+        self.assertEqual(parameter_shape(None), {"count": 0, "types": []})
+        self.assertEqual(
+            parameter_shape([(1, "a"), (2, "b")], executemany=True),
+            {"count": 2, "types": ["int", "str"], "rows": 2},
+        )
+        self.assertEqual(parameter_shape([], executemany=True), {"count": 0, "types": [], "rows": 0})
+
+
+######################################################################
+#  S L O W   Q U E R Y   L O G   T E S T   C A S E S
+######################################################################
+class TestSlowQueryLog(TestCase):
+    """Slow Query Log Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.engine = create_engine("sqlite://")
+        with patch.dict(app.config, {"SLOW_QUERY_MS": 0, "SLOW_QUERY_MAX_FINGERPRINTS": 2}):
+            self.slow_queries = SlowQueryLog(app)
+        self.slow_queries.attach(self.engine)
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.slow_queries.detach(self.engine)
+        self.engine.dispose()
+
+    def run_sql(self, statement, parameters=None):
+        """Runs a statement on the test engine"""
+        with self.engine.connect() as connection:
+            return connection.execute(text(statement), parameters or {}).all()
+
+    def test_aggregate_by_fingerprint(self):
+        """It should add up the runs of one statement with any values"""
+        self.run_sql("SELECT :value", {"value": 1})
+        self.run_sql("SELECT  :value", {"value": "two"})
+        with app.test_request_context("/api/promotions"):
+            self.run_sql("SELECT :value", {"value": 3})
+        [entry] = self.slow_queries.top()
+        self.assertEqual(entry["statement"], "SELECT ?")
+        self.assertEqual(entry["calls"], 3)
+        self.assertEqual(entry["routes"], {"-": 2, "GET promotion_collection": 1})
+        self.assertEqual(entry["parameters"], {"count": 1, "types": ["int"]})
+        self.assertAlmostEqual(entry["mean_ms"], entry["total_ms"] / 3)
+        self.assertGreaterEqual(entry["max_ms"], entry["mean_ms"])
+        self.assertIsNone(entry["plan"])
+        self.assertEqual(metrics.snapshot()["counters"]["slow_queries.recorded"], 3)
+
+    def test_threshold(self):
+        """It should ignore the statements faster than the threshold"""
+        self.slow_queries.threshold = 60
+        self.run_sql("SELECT 1")
+        self.assertEqual(self.slow_queries.top(), [])
+
+    def test_keep_the_costliest(self):
+        """It should drop the cheapest statement to make room for a new one"""
+        self.slow_queries.record("a", "SELECT a", {}, "-", 5.0)
+        self.slow_queries.record("b", "SELECT b", {}, "-", 1.0)
+        self.slow_queries.record("c", "SELECT c", {}, "-", 3.0)
+        self.assertEqual([entry["fingerprint"] for entry in self.slow_queries.top()], ["a", "c"])
+        self.assertEqual(len(self.slow_queries.top(limit=1)), 1)
+        self.slow_queries.reset()
+        self.assertEqual(self.slow_queries.top(), [])
+
+    def test_log_off(self):
+        """It should not time statements run with the log turned off"""
+        with self.engine.connect() as connection:
+            connection.execution_options(slow_query_log=False).execute(text("SELECT 1"))
+        self.assertEqual(self.slow_queries.top(), [])
+
+    def test_not_configured(self):
+        """It should not set up the log without a threshold"""
+        with patch.dict(app.config, {"SLOW_QUERY_MS": 0}), patch.dict(app.extensions):
+            self.assertIsNone(init_slow_queries(app))
+            self.assertIsNone(app.extensions["slow_queries"])
+
+    def test_explain_only_postgres_selects(self):
+        """It should explain only a sample of the slow SELECTs on Postgres"""
+        read = "SELECT promotion.id FROM promotion WHERE promotion.id = ?"
+        with self.engine.connect() as connection:
+            self.assertFalse(self.slow_queries.explain_due(connection, read))
+            self.slow_queries.explain_rate = 1.0
+            self.assertFalse(self.slow_queries.explain_due(connection, read))
+        with app.app_context(), db.engine.connect() as connection:
+            postgres = connection.dialect.name == "postgresql"
+            self.assertEqual(self.slow_queries.explain_due(connection, read), postgres)
+            self.assertFalse(self.slow_queries.explain_due(connection, "DELETE FROM promotion"))
+
+    def test_explain_only_plain_reads(self):
+        """It should never run statements that lock or write again"""
+        for statement in (
+            "SELECT promotion.id FROM promotion WHERE promotion.id = ?",
+            'SELECT count(*) FROM "promotion_change" WHERE id > ?',
+            "SELECT a.id FROM promotion_archive_2020 AS a JOIN promotion ON true",
+        ):
+            self.assertTrue(is_plain_read(statement), statement)
+        for statement in (
+            "SELECT pg_advisory_xact_lock(?)",
+            "SELECT pg_notify(?, ?), pg_notify(?, ?)",
+            "SELECT promotion.id FROM promotion ORDER BY promotion.id LIMIT ? FOR UPDATE SKIP LOCKED",
+            "SELECT id FROM promotion FOR NO KEY UPDATE",
+            "SELECT pg_try_advisory_lock(id) FROM promotion",
+            "SELECT ?",
+            "SELECT relname FROM pg_class",
+            "UPDATE promotion SET name = ?",
+        ):
+            self.assertFalse(is_plain_read(statement), statement)
+
+    def test_explain(self):
+        """It should keep the plan of a slow query from a background thread"""
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name != "postgresql":
+            self.skipTest("EXPLAIN (ANALYZE, BUFFERS) needs Postgres")
+        self.slow_queries.record("key", "SELECT ?", {}, "-", 1.0)
+        self.slow_queries.queue_explain(engine, "key", "SELECT %(value)s", {"value": 1})
+        for _ in range(100):
+            if self.slow_queries.top()[0]["plan"]:
+                break
+            time.sleep(0.02)
+        self.assertIn("Execution Time", self.slow_queries.top()[0]["plan"])
+        self.assertEqual(metrics.snapshot()["counters"]["slow_queries.explained"], 1)
+
+    def test_explain_fails(self):
+        """It should keep the error of a statement that cannot be explained"""
+        self.slow_queries.record("key", "SELECT ?", {}, "-", 1.0)
+        self.slow_queries.explain(self.engine, "key", "SELECT 1", {})  # SQLite has no SET LOCAL
+        self.assertIn("EXPLAIN failed", self.slow_queries.top()[0]["plan"])
+
+    def test_explain_queue_full(self):
+        """It should drop explains rather than wait when the thread is busy"""
+        with patch.object(self.slow_queries, "run_explains"):
+            for _ in range(17):
+                self.slow_queries.queue_explain(self.engine, "key", "SELECT 1", {})
+        self.assertEqual(metrics.snapshot()["counters"]["slow_queries.explains_dropped"], 1)
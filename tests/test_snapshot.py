@@ -0,0 +1,195 @@
+"""
+Test cases for the Snapshot of Active Promotions
+"""
+import os
+import logging
+import tempfile
+import threading
+from datetime import date
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.models import db, Promotion, PromotionChange
+from service.common.metrics import metrics
+from service.common.snapshot import FIELDS, Snapshot, SnapshotStore, encode
+from tests.factories import PromotionFactory
+
+
+def promotion(promotion_id, products_type="Toys", **fields):
+    """Returns a serialized promotion"""
+    data = {
+        "name": f"Promotion {promotion_id}",
+        "description": "Ünïcode and a long description",
+        "products_type": products_type,
+        "promotion_code": None,
+        "require_code": False,
+        "start_date": "2024-01-01",
+        "end_date": "2024-12-31",
+        "is_active": True,
+        "_id": promotion_id,
+    }
+    data.update(fields)
+    return data
+
+
+def rows(promotions):
+    """Returns serialized promotions as the rows to encode, by id"""
+    columns = [
+        dict(
+            data,
+            id=data["_id"],
+            start_date=date.fromisoformat(data["start_date"]),
+            end_date=date.fromisoformat(data["end_date"]),
+        )
+        for data in sorted(promotions, key=lambda data: data["_id"])
+    ]
+    return [tuple(data[field] for field in FIELDS) for data in columns]
+
+
+######################################################################
+#  S N A P S H O T   F O R M A T   T E S T   C A S E S
+######################################################################
+class TestSnapshot(TestCase):
+    """Snapshot Format Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.promotions = [
+            promotion(7, promotion_code="SAVE7", require_code=True),
+            promotion(3, "Electronics"),
+            promotion(5),
+            promotion(9, "Electronics", description=None),
+        ]
+        self.snapshot = Snapshot(encode(rows(self.promotions), cursor=42))
+
+    def test_round_trip(self):
+        """It should read back every promotion as it was serialized"""
+        self.assertEqual(len(self.snapshot), 4)
+        self.assertEqual(self.snapshot.cursor, 42)
+        expected = sorted(self.promotions, key=lambda data: data["_id"])
+        self.assertEqual(self.snapshot.all(), expected)
+
+    def test_find(self):
+        """It should find a promotion by id"""
+        self.assertEqual(self.snapshot.find(7), self.promotions[0])
+        self.assertEqual(self.snapshot.find(9)["description"], None)
+        for missing in (0, 4, 10):
+            self.assertIsNone(self.snapshot.find(missing))
+
+    def test_find_by_products_type(self):
+        """It should find the promotions of a products type by id"""
+        toys = self.snapshot.find_by_products_type("Toys")
+        self.assertEqual([data["_id"] for data in toys], [5, 7])
+        electronics = self.snapshot.find_by_products_type("Electronics")
+        self.assertEqual([data["_id"] for data in electronics], [3, 9])
+        self.assertEqual(self.snapshot.find_by_products_type("Books"), [])
+
+    def test_empty(self):
+        """It should read an empty snapshot"""
+        snapshot = Snapshot(encode([], cursor=0))
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(snapshot.all(), [])
+        self.assertIsNone(snapshot.find(1))
+        self.assertEqual(snapshot.find_by_products_type("Toys"), [])
+
+    def test_not_a_snapshot(self):
+        """It should not read a buffer that is not a snapshot"""
+        self.assertRaises(ValueError, Snapshot, b"\0" * 64)
+
+
+######################################################################
+#  S N A P S H O T   S T O R E   T E S T   C A S E S
+######################################################################
+class TestSnapshotStore(TestCase):
+    """Snapshot Store Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        # the service created the tables when it was imported
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Promotion).delete()  # clean up the last tests
+        db.session.query(PromotionChange).delete()
+        db.session.commit()
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.directory.name, "promotions.snapshot")
+        self.store = SnapshotStore(app, self.path)
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+        self.directory.cleanup()
+
+    def current(self, store=None):
+        """Returns the snapshot of the store once its rebuild is done"""
+        store = store or self.store
+        store.current()
+        if store.rebuilder:
+            store.rebuilder.join()
+        return store.current()
+
+    def test_rebuild_when_behind(self):
+        """It should rebuild the snapshot only when the change log moved"""
+        active = PromotionFactory(is_active=True)
+        active.create()
+        PromotionFactory(is_active=False).create()
+        snapshot = self.current()
+        self.assertEqual([data["_id"] for data in snapshot.all()], [active.id])
+        self.assertEqual(snapshot.cursor, PromotionChange.latest())
+        self.assertIs(self.store.current(), snapshot)
+
+        self.store.evict({("id", active.id)})
+        self.assertIs(self.store.current(), snapshot)  # nothing changed
+        active.deactivate()
+        self.store.evict({("id", active.id)})
+        self.assertEqual(len(self.current()), 0)
+        self.assertEqual(metrics.snapshot()["counters"]["snapshot.rebuilds"], 2)
+
+    def test_stream_rows(self):
+        """It should read the active promotions in batches into the columns"""
+        created = PromotionFactory.create_batch(5, is_active=True)
+        for active in created:
+            active.create()
+        with patch("service.common.snapshot.BATCH_SIZE", 2):
+            snapshot = self.current()
+        expected = sorted((active.serialize() for active in created), key=lambda data: data["_id"])
+        self.assertEqual(snapshot.all(), expected)
+
+    def test_read_database_while_rebuilding(self):
+        """It should not make readers wait for the rebuild"""
+        PromotionFactory(is_active=True).create()
+        started, finish = threading.Event(), threading.Event()
+        rebuild = self.store.rebuild
+
+        def slow_rebuild():
+            started.set()
+            finish.wait(5)
+            rebuild()
+
+        with patch.object(self.store, "rebuild", side_effect=slow_rebuild):
+            self.assertIsNone(self.store.current())
+            self.assertTrue(started.wait(5))
+            self.assertIsNone(self.store.current())  # one rebuild at a time
+            finish.set()
+            self.store.rebuilder.join()
+        self.assertEqual(len(self.store.current()), 1)
+        self.assertEqual(metrics.snapshot()["counters"]["snapshot.rebuilds"], 1)
+
+    def test_map_file_of_another_worker(self):
+        """It should map a snapshot that another worker already rebuilt"""
+        PromotionFactory(is_active=True).create()
+        other = SnapshotStore(app, self.path)
+        self.assertEqual(len(self.current(other)), 1)
+        self.assertEqual(len(self.current()), 1)
+        self.assertEqual(metrics.snapshot()["counters"]["snapshot.rebuilds"], 1)
+
+    def test_unavailable(self):
+        """It should give up on the snapshot when the file cannot be written"""
+        with patch("service.common.snapshot.os.replace", side_effect=OSError("full")):
+            self.assertIsNone(self.current())
+        self.assertEqual(os.listdir(self.directory.name), ["promotions.snapshot.lock"])
@@ -0,0 +1,323 @@
+"""
+Test cases for Tracing
+"""
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase
+from flask import Flask
+from flask_restx import Api, Resource
+from sqlalchemy import create_engine, text
+from service import config
+from service.common.metrics import metrics
+from service.common.tracing import (
+    CLIENT,
+    SERVER,
+    BatchExporter,
+    Span,
+    Tracer,
+    init_tracing,
+    parse_traceparent,
+)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class Collector:  # pylint: disable=too-few-public-methods
+    """Keeps the exported spans"""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        """Keeps one span"""
+        self.spans.append(span)
+
+
+class Repository:
+    """Stands in for a model class"""
+
+    def save(self, engine):
+        """Runs a statement"""
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT :value"), {"value": 1}).scalar()
+
+    @classmethod
+    def find(cls, engine):
+        """Runs a statement from a class method"""
+        return cls().save(engine)
+
+    @staticmethod
+    def check():
+        """Fails"""
+        raise ValueError("broken")
+
+    @staticmethod
+    def rows():
+        """Yields its results"""
+        yield 1
+
+    def _private(self):
+        """Is not traced"""
+
+
+######################################################################
+#  T R A C E P A R E N T   T E S T   C A S E S
+######################################################################
+class TestTraceparent(TestCase):
+    """Traceparent Tests"""
+
+    def test_parse_traceparent(self):
+        """It should only accept well formed traceparent headers"""
+        self.assertEqual(
+            parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01"), (TRACE_ID, PARENT_ID, True)
+        )
+        self.assertEqual(
+            parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-00"), (TRACE_ID, PARENT_ID, False)
+        )
+        for header in (
+            None,
+            "",
+            f"01-{TRACE_ID}-{PARENT_ID}-01",
+            f"00-{TRACE_ID.upper()}-{PARENT_ID}-01",
+            f"00-{'0' * 32}-{PARENT_ID}-01",
+            f"00-{TRACE_ID}-{'0' * 16}-01",
+        ):
+            self.assertIsNone(parse_traceparent(header))
+
+
+######################################################################
+#  T R A C E R   T E S T   C A S E S
+######################################################################
+class TestTracer(TestCase):
+    """Tracer Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.app = Flask(__name__)
+        self.app.config.from_object(config)
+        self.app.config.update(TRACE_SAMPLE_RATE=0, PROPAGATE_EXCEPTIONS=False)
+        api = Api(self.app)
+        self.engine = create_engine("sqlite://")
+        engine = self.engine
+
+        @api.route("/things")
+        class Things(Resource):  # pylint: disable=unused-variable
+            """A traced resource"""
+
+            def get(self):
+                """Reads through the repository"""
+                return {"value": Repository.find(engine)}
+
+            def post(self):
+                """Fails in the repository"""
+                return Repository.check()
+
+        self.collector = Collector()
+        self.tracer = Tracer(self.app, self.collector)
+        self.app.before_request(self.tracer.start_request)
+        self.app.after_request(self.tracer.finish_response)
+        self.app.teardown_request(self.tracer.finish_request)
+        self.tracer.attach(self.engine)
+        self.tracer.instrument_views(self.app)
+        self.tracer.instrument_representations(api)
+        self.originals = dict(vars(Repository))
+        self.tracer.instrument_class(Repository)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.tracer.detach(self.engine)
+        self.engine.dispose()
+        for name, attribute in self.originals.items():
+            if not name.startswith("__"):
+                setattr(Repository, name, attribute)
+
+    def spans(self):
+        """Returns the exported spans by name"""
+        return {span.name: span for span in self.collector.spans}
+
+    def test_continue_trace(self):
+        """It should trace a request through its handler, models, SQL and encoding"""
+        response = self.client.get("/things", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+        self.assertEqual(response.get_json(), {"value": 1})
+        spans = self.spans()
+        self.assertEqual(
+            set(spans),
+            {"GET /things", "handler things", "Repository.find", "Repository.save", "SELECT",
+             "encode application/json"},
+        )
+        self.assertTrue(all(span.trace_id == TRACE_ID for span in spans.values()))
+        server = spans["GET /things"]
+        self.assertEqual(server.kind, SERVER)
+        self.assertEqual(server.parent_id, PARENT_ID)
+        self.assertEqual(server.attributes["http.status_code"], 200)
+        self.assertEqual(response.headers["traceresponse"], f"00-{TRACE_ID}-{server.span_id}-01")
+        self.assertEqual(spans["handler things"].parent_id, server.span_id)
+        self.assertEqual(spans["Repository.find"].parent_id, spans["handler things"].span_id)
+        self.assertEqual(spans["Repository.save"].parent_id, spans["Repository.find"].span_id)
+        statement = spans["SELECT"]
+        self.assertEqual(statement.kind, CLIENT)
+        self.assertEqual(statement.parent_id, spans["Repository.save"].span_id)
+        self.assertEqual(statement.attributes["db.statement"], "SELECT ?")
+        self.assertEqual(spans["encode application/json"].parent_id, spans["handler things"].span_id)
+        self.assertTrue(all(span.end >= span.start for span in spans.values()))
+
+    def test_sampling(self):
+        """It should trace only sampled requests"""
+        self.client.get("/things", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"})
+        response = self.client.get("/things")
+        self.assertNotIn("traceresponse", response.headers)
+        self.assertEqual(self.collector.spans, [])
+        self.tracer.sample_rate = 1.0
+        self.client.get("/things", headers={"traceparent": "garbage"})
+        server = self.spans()["GET /things"]
+        self.assertIsNone(server.parent_id)
+        self.assertEqual(len(server.trace_id), 32)
+
+    def test_errors(self):
+        """It should mark the spans of a failed request as errors"""
+        self.tracer.sample_rate = 1.0
+        response = self.client.post("/things")
+        self.assertEqual(response.status_code, 500)
+        spans = self.spans()
+        self.assertEqual(spans["Repository.check"].error, "ValueError: broken")
+        self.assertEqual(spans["POST /things"].error, "HTTP 500")  # flask-restx handled it
+        self.client.get("/nowhere")
+        self.assertIsNone(self.spans()["GET unknown route"].error)
+
+    def test_unhandled_error(self):
+        """It should mark the server span of an unhandled error"""
+        self.tracer.sample_rate = 1.0
+        with self.app.test_request_context("/things"):
+            self.tracer.start_request()
+            self.tracer.finish_request(ValueError("broken"))
+        self.assertEqual(self.spans()["GET /things"].error, "ValueError: broken")
+
+    def test_failed_statement(self):
+        """It should end the span of a statement that failed"""
+        self.tracer.sample_rate = 1.0
+        with self.app.test_request_context("/things"):
+            self.tracer.start_request()
+            with self.assertRaises(Exception), self.engine.connect() as connection:
+                connection.execute(text("SELECT * FROM missing"))
+            self.tracer.finish_request()
+        self.assertIn("no such table", self.spans()["SELECT"].error)
+
+    def test_instrument_class(self):
+        """It should leave private methods and generators alone"""
+        self.assertEqual(list(Repository.rows()), [1])
+        self.assertIs(Repository.rows, self.originals["rows"].__func__)
+        self.assertIs(Repository.__dict__["_private"], self.originals["_private"])
+        self.assertTrue(hasattr(Repository.find, "__wrapped__"))
+        self.assertIsInstance(Repository.__dict__["check"], staticmethod)
+
+    def test_init_tracing(self):
+        """It should trace the app, its API and its models"""
+        app = Flask("traced")
+        app.config.from_object(config)
+        app.config["TRACE_EXPORT_PATH"] = os.devnull
+        api = Api(app)
+        api.add_resource(Resource, "/nothing")
+        tracer = init_tracing(app, api, ())
+        try:
+            self.assertIs(app.extensions["tracer"], tracer)
+            self.assertIn(tracer.start_request, app.before_request_funcs[None])
+            self.assertTrue(hasattr(app.view_functions["resource"], "__wrapped__"))
+            self.assertTrue(hasattr(api.representations["application/json"], "__wrapped__"))
+        finally:
+            tracer.detach()
+
+    def test_not_configured(self):
+        """It should not set up tracing without an export path"""
+        self.app.config["TRACE_EXPORT_PATH"] = ""
+        self.assertIsNone(init_tracing(self.app, None, ()))
+        self.assertIsNone(self.app.extensions["tracer"])
+
+
+######################################################################
+#  E X P O R T E R   T E S T   C A S E S
+######################################################################
+class TestBatchExporter(TestCase):
+    """Batch Exporter Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.directory.name, "spans.jsonl")
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.directory.cleanup()
+
+    def span(self, **attributes):
+        """Returns a finished span"""
+        span = Span("work", SERVER, TRACE_ID, None, attributes)
+        span.end = span.start + 1000
+        return span
+
+    def batches(self):
+        """Returns the batches written so far"""
+        with open(self.path, encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+
+    def test_batches(self):
+        """It should write full batches from its thread as OTLP JSON"""
+        exporter = BatchExporter(self.path, batch_size=2, interval=60, maxsize=10)
+        for _ in range(4):
+            exporter.export(self.span(flag=True, count=3, ratio=0.5, text="a"))
+        for _ in range(100):
+            if os.path.exists(self.path) and len(self.batches()) == 2:
+                break
+            time.sleep(0.01)
+        batches = self.batches()
+        self.assertEqual(len(batches), 2)
+        [resource] = batches[0]["resourceSpans"]
+        self.assertEqual(resource["resource"]["attributes"][0]["value"], {"stringValue": "promotions"})
+        span = resource["scopeSpans"][0]["spans"][0]
+        self.assertEqual(span["traceId"], TRACE_ID)
+        self.assertNotIn("parentSpanId", span)
+        self.assertEqual(int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"]), 1000)
+        self.assertEqual(
+            span["attributes"],
+            [
+                {"key": "flag", "value": {"boolValue": True}},
+                {"key": "count", "value": {"intValue": "3"}},
+                {"key": "ratio", "value": {"doubleValue": 0.5}},
+                {"key": "text", "value": {"stringValue": "a"}},
+            ],
+        )
+        self.assertEqual(metrics.snapshot()["counters"]["tracing.exported"], 4)
+
+    def test_partial_batch(self):
+        """It should write a partial batch once the interval has passed"""
+        exporter = BatchExporter(self.path, batch_size=100, interval=0.01, maxsize=10)
+        exporter.export(self.span())
+        for _ in range(100):
+            if os.path.exists(self.path):
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.batches()[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]), 1)
+
+    def test_queue_full(self):
+        """It should drop spans rather than wait when the queue is full"""
+        exporter = BatchExporter(self.path, batch_size=10, interval=60, maxsize=2)
+        exporter._pid = os.getpid()  # pylint: disable=protected-access
+        for _ in range(3):
+            exporter.export(self.span())
+        self.assertEqual(metrics.snapshot()["counters"]["tracing.dropped"], 1)
+        exporter.flush()
+        exporter.flush()
+        self.assertEqual(len(self.batches()), 1)
+
+    def test_write_fails(self):
+        """It should count the spans it cannot write"""
+        exporter = BatchExporter(self.directory.name, batch_size=10, interval=60, maxsize=2)
+        span = self.span()
+        span.error = "failed"
+        exporter.write([span])
+        self.assertEqual(metrics.snapshot()["counters"]["tracing.dropped"], 1)
+        self.assertEqual(span.to_otlp()["status"], {"code": 2, "message": "failed"})
@@ -0,0 +1,128 @@
+"""
+Test cases for Request Validation
+"""
+from datetime import date
+from unittest import TestCase
+from flask_restx import Model, fields
+from service.models import DataValidationError, Promotion
+from service.common.validation import ValidationError, Validator
+from service.routes import create_model, validate_promotion
+from tests.factories import PromotionFactory
+
+
+######################################################################
+#  V A L I D A T O R   T E S T   C A S E S
+######################################################################
+class TestValidator(TestCase):
+    """Validator Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        model = Model(
+            "Thing",
+            {
+                "_id": fields.String(readonly=True),
+                "name": fields.String(required=True),
+                "note": fields.String(),
+                "count": fields.Integer(),
+                "rate": fields.Float(),
+                "enabled": fields.Boolean(required=True),
+                "day": fields.Date(),
+            },
+        )
+        self.validate = Validator(model)
+
+    def test_valid(self):
+        """It should return a value object with the converted values"""
+        values = self.validate({"name": "a", "enabled": False, "day": "2024-02-29", "rate": 1, "_id": "9"})
+        self.assertEqual(values.name, "a")
+        self.assertIsNone(values.note)
+        self.assertIsNone(values.count)
+        self.assertEqual(values.rate, 1.0)
+        self.assertFalse(values.enabled)
+        self.assertEqual(values.day, date(2024, 2, 29))
+        self.assertFalse(hasattr(values, "_id"))  # read only fields are ignored
+        with self.assertRaises(AttributeError):
+            values.name = "b"
+
+    def test_every_error_at_once(self):
+        """It should report the problems of every field together"""
+        with self.assertRaises(ValidationError) as context:
+            self.validate({"name": "", "note": 1, "count": True, "rate": "1", "enabled": "yes", "day": "2024-13-01"})
+        self.assertEqual(
+            context.exception.errors,
+            {
+                "name": "is required",
+                "note": "must be a string",
+                "count": "must be an integer",
+                "rate": "must be a number",
+                "enabled": "must be true or false",
+                "day": "must be a date as YYYY-MM-DD",
+            },
+        )
+        self.assertIn("Invalid Thing: name is required;", str(context.exception))
+        self.assertIsInstance(context.exception, DataValidationError)
+
+    def test_max_length(self):
+        """It should reject strings longer than the field or its column allow"""
+        model = Model("Short", {"code": fields.String(max_length=3), "name": fields.String()})
+        validate = Validator(model, columns=Promotion.__table__.columns)
+        self.assertEqual(validate({"code": "abc", "name": "n" * 63}).code, "abc")
+        with self.assertRaises(ValidationError) as context:
+            validate({"code": "abcd", "name": "n" * 64})
+        self.assertEqual(
+            context.exception.errors,
+            {"code": "must be at most 3 characters", "name": "must be at most 63 characters"},
+        )
+
+    def test_not_an_object(self):
+        """It should not validate a body that is not an object"""
+        for body in (None, [], "name"):
+            self.assertRaises(ValidationError, self.validate, body)
+
+
+######################################################################
+#  P R O M O T I O N   V A L I D A T I O N   T E S T   C A S E S
+######################################################################
+class TestValidatePromotion(TestCase):
+    """Promotion Validation Tests"""
+
+    def test_valid_promotion(self):
+        """It should validate a serialized Promotion"""
+        data = PromotionFactory().serialize()
+        promotion = Promotion().apply(validate_promotion(data))
+        self.assertEqual(promotion.serialize(), data)
+
+    def test_rules_across_fields(self):
+        """It should check the date order and that a code needs require_code"""
+        data = PromotionFactory(require_code=True).serialize()
+        data.update(require_code=False, start_date="2024-02-01", end_date="2024-01-01")
+        with self.assertRaises(ValidationError) as context:
+            validate_promotion(data)
+        self.assertEqual(
+            set(context.exception.errors), {"promotion_code", "end_date"}
+        )
+
+    def test_rules_after_field_errors(self):
+        """It should check the rules only on the fields that are valid"""
+        data = PromotionFactory().serialize()
+        data.update(start_date="yesterday", name=None)
+        with self.assertRaises(ValidationError) as context:
+            validate_promotion(data)
+        self.assertEqual(set(context.exception.errors), {"start_date", "name"})
+
+    def test_column_lengths(self):
+        """It should reject strings longer than their columns"""
+        data = PromotionFactory(require_code=True).serialize()
+        data.update(name="n" * 63, promotion_code="C" * 63)
+        self.assertEqual(validate_promotion(data).name, "n" * 63)
+        data.update(name="n" * 64, description="d" * 64, products_type="p" * 64, promotion_code="C" * 64)
+        with self.assertRaises(ValidationError) as context:
+            validate_promotion(data)
+        self.assertEqual(
+            context.exception.errors,
+            dict.fromkeys(
+                ("name", "description", "products_type", "promotion_code"), "must be at most 63 characters"
+            ),
+        )
+        self.assertEqual(create_model["name"].schema()["maxLength"], 63)